@@ -0,0 +1,403 @@
+"""
+End-to-end throughput benchmark: scan -> queue -> OCR -> proxy delivery -> move, with the simulator engine standing in
+for FineReader.
+
+A synthetic watch tree is built with --files inputs spread over a tree --depth levels deep with --fanout subfolders
+each, with sizes drawn from --sizes (a distribution as for the simulator, in bytes). --share-latency milliseconds are
+added to every directory listing and every output move, to stand in for a network share. The tree is then scanned
+with the parallel scanner, queued, run through an AbbyyPool of simulator instances, delivered over the proxy protocol
+to an AcrobatProxyListener and moved into an output folder by the OutputMover, as MainWindow does.
+
+Reports files per hour, time to first job, p50/p95/p99 for each stage of a job and peak RSS. Results are written as
+JSON with --output, and --compare checks them against an earlier run's JSON, exiting with an error if anything is
+more than --tolerance worse.
+
+Needs PyQt4, but not Windows.
+
+    python benchmarks/bench_pipeline.py --files 500 --workers 4 --page lognormal:0.5:0.3 --output run.json
+    python benchmarks/bench_pipeline.py --files 500 --workers 4 --page lognormal:0.5:0.3 --compare run.json
+"""
+import argparse
+import json
+import os
+import platform
+import Queue
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from PyQt4.QtCore import QCoreApplication, QObject, QTimer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'utils'))
+
+# Everything the pipeline keeps in the temp folder (FineReader10 temp folders, the listener's socket) goes in a folder
+# of its own, which has to be set before the ui modules are imported.
+WORK_FOLDER = tempfile.mkdtemp(prefix='bench_pipeline_')
+os.environ['TMPDIR'] = WORK_FOLDER
+tempfile.tempdir = None
+
+from fake_finereader import sample
+from ui import output_mover, scanner
+from ui.abbyy_controller import AbbyyPool, AcrobatProxyListener
+from ui.engines import Simulator
+from ui.output_mover import OutputMover
+from ui.reaper import temp_reaper
+from ui.scanner import ParallelScanner, list_directory
+from ui.work_queue import POLICIES, make_work_queue
+
+__author__ = 'Gary Hughes'
+
+EXTENSION = ('.tiff', '.tif')
+STAGES = ('queue', 'ocr', 'move', 'total')
+# Metrics compared against a baseline, and whether a higher value is better.
+COMPARED = [('files_per_hour', True), ('time_to_first_job', False)] + [
+    ('stages.{0:s}.{1:s}'.format(stage, percentile), False) for stage in STAGES for percentile in ('p50', 'p95', 'p99')]
+
+
+def build_tree(root, files, depth, fanout, sizes, seed):
+    """
+    Spread files over every folder of the tree in turn. Returns the total size in bytes.
+    """
+    folders = [root]
+    level = [root]
+    for _ in xrange(depth):
+        level = [os.path.join(folder, 'folder{0:02d}'.format(i)) for folder in level for i in xrange(fanout)]
+        folders += level
+    for folder in folders[1:]:
+        os.mkdir(folder)
+    rng = random.Random(seed)
+    total = 0
+    for i in xrange(files):
+        size = int(sample(sizes, rng))
+        with open(os.path.join(folders[i % len(folders)], 'page{0:06d}.tif'.format(i)), 'wb') as input_file:
+            input_file.write(os.urandom(min(size, 4096)) * (size // 4096) + os.urandom(size % 4096))
+        total += size
+    return total
+
+
+def with_latency(function, latency):
+    def delayed(*args, **kwargs):
+        time.sleep(latency)
+        return function(*args, **kwargs)
+    return delayed
+
+
+def percentiles(values):
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+
+    def rank(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    return {
+        'count': len(ordered),
+        'mean': sum(ordered) / len(ordered),
+        'p50': rank(0.5),
+        'p95': rank(0.95),
+        'p99': rank(0.99),
+        'max': ordered[-1],
+    }
+
+
+def peak_rss():
+    """
+    Peak resident set size in MB of this process and of its largest finished child, or None where it isn't known.
+    """
+    if not resource:
+        return None, None
+    # Kilobytes on Linux, bytes on OS X.
+    scale = 1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+
+
+class Pipeline(QObject):
+    """
+    The parts of MainWindow that move a file through the pipeline, without the window.
+    """
+
+    def __init__(self, args, watch_folder, output_folder, engine, parent=None):
+        super(Pipeline, self).__init__(parent)
+        self.args = args
+        self.watch_folder = watch_folder
+        self.output_folder = output_folder
+        self.found = Queue.Queue()
+        self.scan_finished = False
+        self.file_queue = make_work_queue(args.schedule, watch_folder)
+        self.jobs = {}  # Input path: {stage name: time}
+        self.errors = []
+        self.finished = 0
+
+        self.listener = AcrobatProxyListener()
+        self.listener.new_path.connect(self.path_received)
+        self.mover = OutputMover(args.mover_workers)
+        self.mover.moved.connect(self.output_moved)
+        self.pool = AbbyyPool(engine, args.workers, args.recycle_after)
+        self.pool.error.connect(self.error_received)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(10)
+        self.timer.timeout.connect(self.drain_found)
+
+    def start(self):
+        if not self.listener.start():
+            raise RuntimeError('Could not listen: {0:s}'.format(self.listener.errorString()))
+        self.mover.start()
+        self.started_at = time.time()
+        self.scan_thread = threading.Thread(target=self.scan, name='Scan')
+        self.scan_thread.daemon = True
+        self.scan_thread.start()
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+        self.listener.stop()
+        self.pool.kill()
+        self.mover.stop()
+
+    def scan(self):
+        def process(dir_path):
+            subdirs, files = list_directory(dir_path, EXTENSION)
+            return [os.path.join(dir_path, name) for name in subdirs], files
+
+        for dir_path, files in ParallelScanner(self.args.scan_workers).walk(self.watch_folder, process):
+            self.found.put([(os.path.normpath(os.path.join(dir_path, name)), size) for name, size, mtime in files])
+        self.found.put(None)
+
+    def drain_found(self):
+        while True:
+            try:
+                entries = self.found.get_nowait()
+            except Queue.Empty:
+                break
+            if entries is None:
+                self.scan_finished = True
+                self.scan_time = time.time() - self.started_at
+                continue
+            now = time.time()
+            for path, size in entries:
+                self.jobs[path] = {'queued': now}
+            self.file_queue.extend(entries)
+        self.process_next()
+        self.check_finished()
+
+    def process_next(self):
+        while self.pool.has_idle:
+            try:
+                path = self.file_queue.popleft()
+            except IndexError:
+                return
+            self.jobs[path]['launched'] = time.time()
+            self.pool.ocr(path)
+
+    def get_output_path(self, path):
+        relative_path = os.path.relpath(path, self.watch_folder)
+        return os.path.join(self.output_folder, os.path.splitext(relative_path)[0] + '.pdf')
+
+    def path_received(self, job_id, path):
+        source_path = self.pool.complete(str(job_id))
+        if source_path is None:
+            return
+        self.jobs[source_path]['delivered'] = time.time()
+        self.mover.request(source_path, str(path), self.get_output_path(source_path))
+        self.process_next()
+
+    def output_moved(self, source_path, path, out_path, error_message):
+        source_path = str(source_path)
+        self.jobs[source_path]['moved'] = time.time()
+        if error_message:
+            self.errors.append((source_path, str(error_message)))
+            self.jobs[source_path]['failed'] = time.time()
+        self.finished += 1
+        self.check_finished()
+
+    def error_received(self, path, error_message):
+        self.errors.append((str(path), str(error_message)))
+        self.jobs[str(path)]['failed'] = time.time()
+        self.finished += 1
+        self.process_next()
+        self.check_finished()
+
+    def check_finished(self):
+        if self.scan_finished and self.finished >= len(self.jobs):
+            self.finished_at = time.time()
+            QCoreApplication.instance().quit()
+
+    def results(self):
+        elapsed = self.finished_at - self.started_at
+        stage_times = dict((stage, []) for stage in STAGES)
+        for times in self.jobs.itervalues():
+            if 'moved' not in times or 'failed' in times:
+                continue
+            stage_times['queue'].append(times['launched'] - times['queued'])
+            stage_times['ocr'].append(times['delivered'] - times['launched'])
+            stage_times['move'].append(times['moved'] - times['delivered'])
+            stage_times['total'].append(times['moved'] - times['queued'])
+        launched = [times['launched'] for times in self.jobs.itervalues() if 'launched' in times]
+        delivered = [times['delivered'] for times in self.jobs.itervalues() if 'delivered' in times]
+        completed = len(stage_times['total'])
+        rss, child_rss = peak_rss()
+        return {
+            'files': len(self.jobs),
+            'completed': completed,
+            'failed': len(self.errors),
+            'elapsed': elapsed,
+            'scan_time': self.scan_time,
+            'files_per_hour': completed * 3600.0 / elapsed if elapsed else 0.0,
+            'time_to_first_job': min(launched) - self.started_at if launched else None,
+            'time_to_first_result': min(delivered) - self.started_at if delivered else None,
+            'stages': dict((stage, percentiles(values)) for stage, values in stage_times.iteritems()),
+            'peak_rss_mb': rss,
+            'peak_child_rss_mb': child_rss,
+        }
+
+
+def lookup(results, key):
+    for part in key.split('.'):
+        results = results.get(part) if isinstance(results, dict) else None
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print how results differ from baseline. Returns the number of metrics that got worse by more than tolerance.
+    """
+    regressions = 0
+    print
+    print 'Against {0:s}:'.format(baseline.get('timestamp', 'baseline'))
+    for key, higher_is_better in COMPARED:
+        old, new = lookup(baseline, key), lookup(results, key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        flag = ''
+        if worse > tolerance:
+            flag = '  REGRESSION'
+            regressions += 1
+        print '  {0:<24s} {1:12.3f} -> {2:12.3f}  {3:+7.1%}{4:s}'.format(key, old, new, change, flag)
+    return regressions
+
+
+def report(results):
+    print 'Files: {0:,} completed, {1:,} failed in {2:.1f} s (scan {3:.2f} s)'.format(
+        results['completed'], results['failed'], results['elapsed'], results['scan_time'])
+    print 'Throughput: {0:,.0f} files per hour'.format(results['files_per_hour'])
+    if results['time_to_first_job'] is not None:
+        print 'Time to first job: {0:.3f} s, first result: {1:.3f} s'.format(
+            results['time_to_first_job'], results['time_to_first_result'] or 0.0)
+    for stage in STAGES:
+        stats = results['stages'][stage]
+        if stats['count']:
+            print '  {0:<6s} p50 {1:8.3f} s  p95 {2:8.3f} s  p99 {3:8.3f} s'.format(
+                stage, stats['p50'], stats['p95'], stats['p99'])
+    if results['peak_rss_mb'] is not None:
+        print 'Peak RSS: {0:.1f} MB, largest simulator {1:.1f} MB'.format(
+            results['peak_rss_mb'], results['peak_child_rss_mb'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--depth', type=int, default=2)
+    parser.add_argument('--fanout', type=int, default=4)
+    parser.add_argument('--sizes', default='lognormal:200000:1.0', help='input file size distribution in bytes')
+    parser.add_argument('--share-latency', type=float, default=0.0,
+                        help='milliseconds added to every directory listing and output move')
+    parser.add_argument('--workers', type=int, default=4, help='simulator instances run at once')
+    parser.add_argument('--recycle-after', type=int, default=1)
+    parser.add_argument('--scan-workers', type=int, default=8)
+    parser.add_argument('--mover-workers', type=int, default=2)
+    parser.add_argument('--schedule', default='fifo', choices=POLICIES)
+    parser.add_argument('--startup', default='fixed:0.5', help='simulator start-up time distribution')
+    parser.add_argument('--page', default='fixed:0.2', help='simulator time per file distribution')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--hang-rate', type=float, default=0.0)
+    parser.add_argument('--crash-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=3600, help='give up after this many seconds')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='fraction worse that counts as a regression')
+    parser.add_argument('--verbose', action='store_true', help="show the pipeline's own output")
+    args = parser.parse_args()
+
+    app = QCoreApplication(sys.argv)
+    watch_folder = os.path.join(WORK_FOLDER, 'watch')
+    output_folder = os.path.join(WORK_FOLDER, 'output')
+    os.mkdir(watch_folder)
+    os.mkdir(output_folder)
+    real_scandir, real_listdir, real_replace = scanner.scandir, os.listdir, output_mover.replace
+    try:
+        total_size = build_tree(watch_folder, args.files, args.depth, args.fanout, args.sizes, args.seed)
+        print 'Tree: {0:,} files, {1:,.1f} MB, depth {2:d}, fanout {3:d}, {4:.1f} ms share latency'.format(
+            args.files, total_size / 1048576.0, args.depth, args.fanout, args.share_latency)
+
+        latency = args.share_latency / 1000.0
+        if latency:
+            if real_scandir:
+                scanner.scandir = with_latency(real_scandir, latency)
+            else:
+                os.listdir = with_latency(real_listdir, latency)
+            output_mover.replace = with_latency(real_replace, latency)
+
+        engine = Simulator(args.startup, args.page, args.error_rate, args.hang_rate, args.crash_rate, args.seed)
+        pipeline = Pipeline(args, watch_folder, output_folder, engine)
+        temp_reaper.start()
+        QTimer.singleShot(int(args.timeout * 1000), app.quit)
+        stdout = sys.stdout
+        if not args.verbose:
+            sys.stdout = open(os.devnull, 'w')
+        try:
+            pipeline.start()
+            app.exec_()
+            if not hasattr(pipeline, 'finished_at'):
+                pipeline.finished_at = time.time()
+                pipeline.scan_time = getattr(pipeline, 'scan_time', pipeline.finished_at - pipeline.started_at)
+            pipeline.stop()
+            temp_reaper.stop()
+        finally:
+            sys.stdout = stdout
+    finally:
+        scanner.scandir, os.listdir, output_mover.replace = real_scandir, real_listdir, real_replace
+        shutil.rmtree(WORK_FOLDER, ignore_errors=True)
+
+    results = {
+        'benchmark': 'pipeline',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': vars(args),
+    }
+    results.update(pipeline.results())
+    report(results)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+        print 'Results written to', args.output
+
+    if results['completed'] + results['failed'] < results['files']:
+        unfinished = results['files'] - results['completed'] - results['failed']
+        print 'Timed out with {0:,} files unfinished'.format(unfinished)
+        return 1
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
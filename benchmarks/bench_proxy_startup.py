@@ -0,0 +1,136 @@
+"""
+Time how long acrobat_proxy.py takes to deliver one path, from starting the process to it exiting, as FineReader sees
+it once per document.
+
+The proxy is run --runs times against a stand-in listener (the protocol from ui.proxy_protocol on a Unix socket, so
+this doesn't run on Windows) and every delivery is checked to have arrived. For comparison it also times a bare
+interpreter start and, if PyQt4 is installed, importing what the old Qt proxy imported. With --budget the script exits
+with an error if the median proxy time is over that many milliseconds.
+
+    python benchmarks/bench_proxy_startup.py --runs 50 --budget 150
+"""
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from ui.proxy_protocol import LISTENER_NAME, DeliveryHandler, FrameDecoder, ProtocolError
+
+__author__ = 'Gary Hughes'
+
+QT_IMPORTS = 'import PyQt4.QtCore, PyQt4.QtNetwork'
+
+
+class StubListener(object):
+    """
+    Accepts proxy connections on a background thread and records the paths delivered.
+    """
+
+    def __init__(self, address):
+        self.handler = DeliveryHandler()
+        self.received = []
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(address)
+        self.server.listen(16)
+        self.thread = threading.Thread(target=self.serve, name='StubListener')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except socket.error:
+                return
+            decoder = FrameDecoder()
+            try:
+                while True:
+                    data = connection.recv(4096)
+                    if not data:
+                        break
+                    for payload in decoder.feed(data):
+                        response, delivered = self.handler.handle(payload)
+                        if delivered:
+                            self.received.append(delivered[1])
+                        connection.sendall(response)
+            except (socket.error, ProtocolError):
+                pass
+            finally:
+                connection.close()
+
+    def close(self):
+        self.server.close()
+
+
+def time_runs(command, runs, environment):
+    times = []
+    for i in xrange(runs):
+        start = time.time()
+        code = subprocess.call(command(i), env=environment)
+        times.append((time.time() - start) * 1000)
+        if code:
+            raise RuntimeError('{0:s} exited with {1:d}'.format(' '.join(command(i)), code))
+    return times
+
+
+def summary(name, times):
+    ordered = sorted(times)
+    median = ordered[len(ordered) // 2]
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print '{0:<24s} median {1:7.1f} ms  p95 {2:7.1f} ms  min {3:7.1f} ms'.format(name, median, p95, ordered[0])
+    return median
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=50)
+    parser.add_argument('--python', default=sys.executable, help='interpreter to run the proxy with')
+    parser.add_argument('--budget', type=float, help='fail if the median proxy time is over this many ms')
+    args = parser.parse_args()
+
+    if sys.platform == 'win32':
+        print 'The stand-in listener needs Unix sockets.'
+        return 1
+
+    temp_folder = tempfile.mkdtemp(prefix='proxy-startup-')
+    environment = dict(os.environ, TMPDIR=temp_folder, PYTHONPATH=ROOT)
+    os.mkdir(os.path.join(temp_folder, 'FineReader11'))
+    listener = StubListener(os.path.join(temp_folder, LISTENER_NAME))
+    proxy = os.path.join(ROOT, 'acrobat_proxy.py')
+    try:
+        baseline = summary('python -c pass', time_runs(lambda i: [args.python, '-c', 'pass'], args.runs, environment))
+        paths = [os.path.join(temp_folder, 'FineReader11', 'tmp{0:04d}.pdf'.format(i)) for i in xrange(args.runs)]
+        median = summary('acrobat_proxy.py', time_runs(lambda i: [args.python, proxy, paths[i]], args.runs,
+                                                       environment))
+        print '{0:<24s} {1:7.1f} ms over a bare interpreter'.format('', median - baseline)
+        with open(os.devnull, 'w') as null:
+            has_qt = subprocess.call([args.python, '-c', QT_IMPORTS], env=environment, stderr=null) == 0
+        if has_qt:
+            summary('PyQt4 imports alone', time_runs(lambda i: [args.python, '-c', QT_IMPORTS], args.runs,
+                                                     environment))
+        else:
+            print 'PyQt4 not installed for {0:s}, skipping the old proxy imports'.format(args.python)
+    finally:
+        listener.close()
+        shutil.rmtree(temp_folder, ignore_errors=True)
+
+    missing = set(paths) - set(listener.received)
+    if missing or len(listener.received) != len(paths):
+        print '{0:,} of {1:,} paths delivered'.format(len(set(listener.received)), len(paths))
+        return 1
+    if args.budget and median > args.budget:
+        print 'Median {0:.1f} ms is over the {1:.1f} ms budget'.format(median, args.budget)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""
+Replay watch folder create and delete events against the old deque-based queue and the work queue for each
+scheduling policy.
+
+Creates every path (with some duplicate create events), then deletes them all in shuffled order, as happens when a
+large batch of files is moved out of the watch folder. With --drain, the paths are popped off the queue in scheduled
+order instead of deleted.
+
+    python benchmarks/bench_queue.py --events 100000
+"""
+import argparse
+from collections import deque
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ui.work_queue import POLICIES, make_work_queue
+
+__author__ = 'Gary Hughes'
+
+ROOT = os.path.join(os.sep, 'nas', 'scans')
+
+
+def make_events(count, seed, drain=False):
+    paths = [os.path.join(ROOT, 'batch{0:04d}'.format(i // 500), 'page{0:06d}.tif'.format(i)) for i in xrange(count)]
+    random.seed(seed)
+    creates = [(1, path, random.randint(10000, 50000000)) for path in paths]
+    # A few files reported as created twice.
+    creates += random.sample(creates, count // 100)
+    if drain:
+        return creates + [(0, None, None)] * count
+    deletes = [(2, path, None) for path in paths]
+    random.shuffle(deletes)
+    return creates + deletes
+
+
+def replay_deque(events):
+    # What watch_folder_changed() used to do.
+    file_queue = deque()
+    for action, filename, size in events:
+        if action == 1:
+            file_queue.append(filename)
+        elif action == 0:
+            file_queue.popleft()
+        else:
+            try:
+                file_queue.remove(filename)
+            except ValueError:
+                pass
+    return len(file_queue)
+
+
+def replay_work_queue(events, policy):
+    file_queue = make_work_queue(policy, ROOT, [('batch00*', 1)])
+    for action, filename, size in events:
+        if action == 1:
+            file_queue.append(filename, size)
+        elif action == 0:
+            try:
+                file_queue.popleft()
+            except IndexError:
+                pass
+        else:
+            try:
+                file_queue.remove(filename)
+            except ValueError:
+                pass
+    return len(file_queue)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=100000, help='number of files created and then deleted')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--skip-deque', action='store_true', help="don't time the old deque (slow for big runs)")
+    parser.add_argument('--drain', action='store_true', help='pop every path instead of deleting them')
+    parser.add_argument('--policies', nargs='+', default=POLICIES, choices=POLICIES)
+    args = parser.parse_args()
+
+    events = make_events(args.events, args.seed, args.drain)
+    print 'Replaying {0:,} events'.format(len(events))
+
+    runs = [(policy, lambda events, policy=policy: replay_work_queue(events, policy)) for policy in args.policies]
+    if not args.skip_deque:
+        runs.insert(0, ('deque', replay_deque))
+    for name, replay in runs:
+        start = time.time()
+        remaining = replay(events)
+        elapsed = time.time() - start
+        print '{0:<12s} {1:8.3f} s  {2:10,.0f} events/s  {3:,} left queued'.format(
+            name, elapsed, len(events) / elapsed, remaining)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Benchmark the initial watch folder scan: the original serial os.walk against the parallel scandir scanner.
+
+A synthetic tree is built in a temp folder and every directory listing is delayed by --latency milliseconds to stand
+in for the round trip to an SMB share.
+
+    python benchmarks/bench_scan.py --depth 4 --fanout 4 --files 20 --latency 5 --workers 1 4 8 16
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ui import scanner
+from ui.scanner import ParallelScanner, list_directory
+
+__author__ = 'Gary Hughes'
+
+EXTENSION = ('.tiff', '.tif')
+
+
+def build_tree(root, depth, fanout, files):
+    count = 0
+    stack = [(root, 0)]
+    while stack:
+        path, level = stack.pop()
+        for i in xrange(files):
+            # Mix in some files that shouldn't be picked up.
+            name = 'page{0:04d}.{1:s}'.format(i, 'txt' if i % 10 == 9 else 'tif')
+            open(os.path.join(path, name), 'w').close()
+            count += 1
+        if level < depth:
+            for i in xrange(fanout):
+                subdir = os.path.join(path, 'folder{0:02d}'.format(i))
+                os.mkdir(subdir)
+                stack.append((subdir, level + 1))
+    return count
+
+
+def with_latency(function, latency):
+    def delayed(*args, **kwargs):
+        time.sleep(latency)
+        return function(*args, **kwargs)
+    return delayed
+
+
+def scan_os_walk(root):
+    # The scan FileWatcher.start() used to do.
+    file_queue = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        file_queue += [os.path.normpath(os.path.join(dirpath, x)) for x in filenames if x.lower().endswith(EXTENSION)]
+    return file_queue
+
+
+def scan_parallel(root, workers):
+    def process(dir_path):
+        subdirs, files = list_directory(dir_path, EXTENSION)
+        return [os.path.join(dir_path, name) for name in subdirs], files
+
+    file_queue = []
+    for dir_path, files in ParallelScanner(workers).walk(root, process):
+        file_queue += [os.path.normpath(os.path.join(dir_path, name)) for name, size, mtime in files]
+    return file_queue
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--fanout', type=int, default=4)
+    parser.add_argument('--files', type=int, default=20, help='files per directory')
+    parser.add_argument('--latency', type=float, default=5.0, help='milliseconds added to every directory listing')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8, 16])
+    args = parser.parse_args()
+
+    latency = args.latency / 1000.0
+    root = tempfile.mkdtemp(prefix='bench_scan_')
+    try:
+        file_count = build_tree(root, args.depth, args.fanout, args.files)
+        print 'Tree: {0:,} files, depth {1:d}, fanout {2:d}, {3:.1f} ms per listing'.format(
+            file_count, args.depth, args.fanout, args.latency)
+
+        real_listdir = os.listdir
+        os.listdir = with_latency(real_listdir, latency)
+        try:
+            start = time.time()
+            expected = scan_os_walk(root)
+            baseline = time.time() - start
+        finally:
+            os.listdir = real_listdir
+        print '{0:<20s} {1:8.3f} s  {2:,} files'.format('os.walk', baseline, len(expected))
+
+        real_scandir = scanner.scandir
+        if real_scandir:
+            scanner.scandir = with_latency(real_scandir, latency)
+        else:
+            os.listdir = with_latency(real_listdir, latency)
+        try:
+            for workers in args.workers:
+                start = time.time()
+                found = scan_parallel(root, workers)
+                elapsed = time.time() - start
+                print '{0:<20s} {1:8.3f} s  {2:,} files  x{3:.1f}{4:s}'.format(
+                    'parallel ({0:d})'.format(workers), elapsed, len(found), baseline / elapsed,
+                    '' if found == expected else '  MISMATCH')
+        finally:
+            scanner.scandir = real_scandir
+            os.listdir = real_listdir
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Benchmark skip throughput: how fast queued files whose output already exists are skipped and marked done in the job
+journal on a restart. The old way marked each file done in its own transaction, all in one pass of the event loop.
+The new way is ui.work_queue.pop_unfinished, as MainWindow.process_next uses it: SKIP_CHUNK files per pass, marked done
+together with JobJournal.mark_all_done.
+
+Also reports the longest pass, which is how long the UI (including the REFRESH_RATE status tick) is held up. Status
+bar redraws aren't included, as they need the Qt widgets.
+
+    python benchmarks/bench_status.py --files 20000
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ui.job_journal import JobJournal
+from ui.work_queue import SKIP_CHUNK, WorkQueue, pop_unfinished
+
+__author__ = 'Gary Hughes'
+
+ROOT = os.path.join(os.sep, 'nas', 'scans')
+
+
+def make_journal(db_path, entries):
+    journal = JobJournal(db_path)
+    journal.open_run(ROOT, os.path.join(os.sep, 'nas', 'pdfs'))
+    journal.add(entries)
+    return journal
+
+
+def skip_per_file(file_queue, outputs, journal):
+    # What process_next() used to do: one pass, one transaction per skipped file.
+    start = time.time()
+    while file_queue:
+        path = file_queue.popleft()
+        if path[:-4] + '.pdf' in outputs:
+            journal.mark_done(path)
+    return time.time() - start
+
+
+def skip_chunked(file_queue, outputs, journal, chunk):
+    # Every file is finished, so each call returns None after chunk files until the queue runs out. Each call is one
+    # pass of the event loop.
+    longest = 0.0
+    while True:
+        start = time.time()
+        try:
+            pop_unfinished(file_queue, lambda path: path[:-4] + '.pdf' in outputs, journal.mark_all_done, chunk)
+        except IndexError:
+            return max(longest, time.time() - start)
+        longest = max(longest, time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=20000, help='number of finished files to skip')
+    parser.add_argument('--chunk', type=int, default=SKIP_CHUNK, help='files per pass (default: %(default)s)')
+    args = parser.parse_args()
+
+    entries = [(os.path.join(ROOT, 'batch{0:04d}'.format(i // 500), 'page{0:07d}.tif'.format(i)), 100000)
+               for i in xrange(args.files)]
+    outputs = set(path[:-4] + '.pdf' for path, size in entries)
+
+    temp_folder = tempfile.mkdtemp()
+    try:
+        for name in ('per file', 'chunked'):
+            journal = make_journal(os.path.join(temp_folder, name.replace(' ', '_') + '.sqlite'), entries)
+            file_queue = WorkQueue(entries)
+            start = time.time()
+            if name == 'per file':
+                longest = skip_per_file(file_queue, outputs, journal)
+            else:
+                longest = skip_chunked(file_queue, outputs, journal, args.chunk)
+            elapsed = time.time() - start
+            done = journal.counts().get('done', 0)
+            journal.close()
+            print '{0:<10s} {1:8.3f} s  {2:12,.0f} skips/s  longest pass {3:8.1f} ms  {4:,} done'.format(
+                name, elapsed, args.files / elapsed, longest * 1000, done)
+    finally:
+        shutil.rmtree(temp_folder)
+
+
+if __name__ == '__main__':
+    main()
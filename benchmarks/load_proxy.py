@@ -0,0 +1,92 @@
+"""
+Load test for the Acrobat proxy protocol. Many client threads deliver PDF paths to a real AcrobatProxyListener over a
+local socket (a Unix socket on Linux), each on a new connection as the proxy does. Some deliveries are sent twice with
+the same request ID, as a proxy that lost its acknowledgement would. Every path should be received exactly once.
+
+Needs PyQt4, but not Windows.
+
+    python benchmarks/load_proxy.py --deliveries 20000 --clients 16 --repeat 0.05
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+from PyQt4.QtCore import QCoreApplication, QTimer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ui.abbyy_controller import AcrobatProxyListener
+from ui.proxy_protocol import Connection, deliver, new_request_id
+
+__author__ = 'Gary Hughes'
+
+LISTENER_NAME = 'Acrobat-Proxy-Load-Test'
+
+
+def client(index, count, repeat, errors):
+    random.seed(index)
+    for i in xrange(count):
+        path = os.path.join('FineReader10', 'tmp{0:03d}{1:07d}.pdf'.format(index, i))
+        try:
+            if random.random() < repeat:
+                request_id = new_request_id()
+                for attempt in xrange(2):
+                    connection = Connection(LISTENER_NAME)
+                    try:
+                        connection.deliver(request_id, str(index), path)
+                    finally:
+                        connection.close()
+            else:
+                deliver(str(index), path, LISTENER_NAME)
+        except Exception, e:
+            errors.append(e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--deliveries', type=int, default=20000)
+    parser.add_argument('--clients', type=int, default=16, help='number of client threads')
+    parser.add_argument('--repeat', type=float, default=0.05, help='fraction of deliveries sent twice')
+    args = parser.parse_args()
+
+    app = QCoreApplication(sys.argv)
+    listener = AcrobatProxyListener(LISTENER_NAME)
+    if not listener.start():
+        print 'Could not listen:', listener.errorString()
+        return 1
+    received = []
+    listener.new_path.connect(lambda job_id, path: received.append(str(path)))
+
+    errors = []
+    per_client = args.deliveries // args.clients
+    threads = [threading.Thread(target=client, args=(i, per_client, args.repeat, errors))
+               for i in xrange(args.clients)]
+
+    def check_finished():
+        if not any(thread.is_alive() for thread in threads):
+            app.quit()
+
+    timer = QTimer()
+    timer.timeout.connect(check_finished)
+    timer.start(20)
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    app.exec_()
+    elapsed = time.time() - start
+    listener.stop()
+
+    expected = per_client * args.clients
+    print '{0:,} deliveries from {1:d} clients in {2:.3f} s: {3:,.0f} deliveries/s'.format(
+        expected, args.clients, elapsed, expected / elapsed)
+    print '{0:,} received, {1:,} unique, {2:,} errors'.format(len(received), len(set(received)), len(errors))
+    if errors:
+        print 'First error:', errors[0]
+    return 0 if len(received) == len(set(received)) == expected and not errors else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -106,16 +106,14 @@ class Ui_MainWindow(object):
         self.horizontalLayout_4.setObjectName(_fromUtf8("horizontalLayout_4"))
         self.verticalLayout_2.addLayout(self.horizontalLayout_4)
         self.verticalLayout_3.addWidget(self.fr_top_controls)
-        self.pte_log = QtGui.QPlainTextEdit(self.centralwidget)
+        self.lv_log = LogView(self.centralwidget)
         sizePolicy = QtGui.QSizePolicy(QtGui.QSizePolicy.Expanding, QtGui.QSizePolicy.Expanding)
         sizePolicy.setHorizontalStretch(0)
         sizePolicy.setVerticalStretch(1)
-        sizePolicy.setHeightForWidth(self.pte_log.sizePolicy().hasHeightForWidth())
-        self.pte_log.setSizePolicy(sizePolicy)
-        self.pte_log.setReadOnly(True)
-        self.pte_log.setPlainText(_fromUtf8(""))
-        self.pte_log.setObjectName(_fromUtf8("pte_log"))
-        self.verticalLayout_3.addWidget(self.pte_log)
+        sizePolicy.setHeightForWidth(self.lv_log.sizePolicy().hasHeightForWidth())
+        self.lv_log.setSizePolicy(sizePolicy)
+        self.lv_log.setObjectName(_fromUtf8("lv_log"))
+        self.verticalLayout_3.addWidget(self.lv_log)
         self.horizontalLayout_2 = QtGui.QHBoxLayout()
         self.horizontalLayout_2.setObjectName(_fromUtf8("horizontalLayout_2"))
         self.progress_bar = QtGui.QProgressBar(self.centralwidget)
@@ -157,8 +155,8 @@ class Ui_MainWindow(object):
         MainWindow.setTabOrder(self.tb_refresh_profiles, self.rb_pdf)
         MainWindow.setTabOrder(self.rb_pdf, self.rb_tiff)
         MainWindow.setTabOrder(self.rb_tiff, self.rb_jpeg)
-        MainWindow.setTabOrder(self.rb_jpeg, self.pte_log)
-        MainWindow.setTabOrder(self.pte_log, self.button_save_errors)
+        MainWindow.setTabOrder(self.rb_jpeg, self.lv_log)
+        MainWindow.setTabOrder(self.lv_log, self.button_save_errors)
         MainWindow.setTabOrder(self.button_save_errors, self.button_reset)
         MainWindow.setTabOrder(self.button_reset, self.button_start)
 
@@ -179,5 +177,5 @@ class Ui_MainWindow(object):
         self.button_reset.setText(_translate("MainWindow", "Reset", None))
         self.button_start.setText(_translate("MainWindow", "Start", None))
 
-from custom_widgets import StatusBar, LineEdit_DragDrop_Folder
+from custom_widgets import StatusBar, LogView, LineEdit_DragDrop_Folder
 import res_rc
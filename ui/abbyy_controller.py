@@ -1,215 +1,496 @@
-import glob
-import os
-import stat
-import subprocess
-import re
-import tempfile
 from PyQt4.QtCore import QObject, pyqtSignal, QThread, QCoreApplication, QTimer
-from PyQt4.QtNetwork import QLocalServer, QLocalSocket
-from itertools import chain
-from shutil import rmtree
-import time
-import pywinauto
-from ui.custom_widgets import find_app_path
-
-__author__ = 'Gary Hughes'
-
-regex_pid = re.compile(r'(?<=^PID:\s)\d+$')
+from PyQt4.QtNetwork import QAbstractSocket, QLocalServer
 
+from ui.engines import EngineError
+from ui.liveness import LivenessMonitor
+from ui.metrics import metrics, monotonic
+from ui.tracing import tracer
+from ui.proxy_protocol import LISTENER_NAME, DeliveryHandler, FrameDecoder, ProtocolError
+from ui.reaper import temp_reaper
 
-def get_abbyy_temp_folder(pid):
-    base_folder = os.path.join(tempfile.gettempdir(), 'FineReader10')
-    for folder_base in reversed(glob.glob('{0:s}/Untitled.FR10*'.format(base_folder))):
-        for loc_file_path in glob.glob('{0:s}/{{*}}.loc'.format(folder_base)):
-            with open(loc_file_path, 'r') as loc_file:
-                for line in loc_file:
-                    match = regex_pid.findall(line)
-                    if len(match) == 1 and match[0] == str(pid):
-                        return folder_base
-    return None
+__author__ = 'Gary Hughes'
 
 
 class AppWatcher(QObject):
+    """
+    Watches an engine instance for error dialogs and hangs, using a LivenessMonitor to decide how often to look.
+    """
+
     # Signals
     error = pyqtSignal(str)
+    hand_off_failed = pyqtSignal()
 
-    check_phrases = (
-        'Some licenses cannot be used',
-        'Some of the pages have not been',
-        'Process failed'
-    )
-
-    def __init__(self, proc, parent=None):
+    def __init__(self, engine, proc, input_paths=(), parent=None):
         super(AppWatcher, self).__init__(parent)
+        self.engine = engine
         self.proc = proc
         self.pid = proc.pid
-        self.polls_without_dialog = 0
+        self.input_paths = input_paths
         self.current_temp_path = None
+        self.active = True
+        self.probe = None
+        self.monitor = None
+        # The watcher is created straight after the process is started.
+        self.launched_at = monotonic()
+        self.last_dialog = None
         print 'PID:', self.pid
 
     def start(self):
         print 'Starting watcher'
-        self.abbyy_app = pywinauto.Application().connect(process=self.pid)
-        """@type : Application"""
-        self.abbyy_dialog = self.abbyy_app.window_(class_name='#32770')
+        self.probe = self.engine.probe(self.proc)
+        self.monitor = LivenessMonitor(self.probe, self.engine.check_phrases, self.input_paths)
 
         print QThread.currentThread()
         self.polling_timer = QTimer()
-        self.polling_timer.setInterval(500)
+        self.polling_timer.setSingleShot(True)
         self.polling_timer.timeout.connect(self.poll)
-        self.polling_timer.start()
+        self.polling_timer.start(int(self.monitor.interval * 1000))
+
+    def job_finished(self):
+        # FineReader is left idle until the next job, so stop treating the lack of progress as a hang.
+        self.active = False
+        self.monitor.send_pending = False
+
+    def open_document(self, input_paths):
+        """
+        Start the next job by opening input_paths as a new document in the running FineReader. Once FineReader has
+        finished reading them, poll() sends the result to the Acrobat proxy.
+        """
+        self.active = True
+        try:
+            self.monitor.open_document(input_paths)
+        except Exception, e:  # pywinauto raises all sorts if the UI isn't in the state we expect.
+            print 'Could not open the next document:', e
+            self.active = False
+            self.monitor.send_pending = False
+            self.hand_off_failed.emit()
 
     def poll(self):
         if not self.current_temp_path:
-            self.current_temp_path = get_abbyy_temp_folder(self.pid)
+            self.current_temp_path = self.engine.temp_folder(self.pid)
             print 'Temp path set to', self.current_temp_path
-        if not self.proc.poll() is None:
-            # Application seems to have exited.
-            print 'Abbyy quit?'
-            self.error.emit('Abbyy exited before being able to process the file.')
+            if self.current_temp_path:
+                metrics.observe('temp_folder', monotonic() - self.launched_at)
+                tracer.step('instance', self.pid, 'running', temp_folder=self.current_temp_path)
+        if not self.active:
+            # Idle between jobs. If FineReader has gone away it's replaced when the next job starts.
+            self.polling_timer.start(int(self.monitor.max_interval * 1000))
+            return
+
+        with metrics.time('dialog_poll'):
+            error_message = self.monitor.check()
+        if self.monitor.dialog != self.last_dialog:
+            self.last_dialog = self.monitor.dialog
+            if self.last_dialog is not None:
+                tracer.mark('instance', self.pid, 'dialog', text=self.last_dialog)
+        if error_message:
+            print 'Abbyy failed:', error_message
+            self.error.emit(error_message)
+            self.probe.kill()
             return
+
         try:
-            dialog_exists = self.abbyy_dialog.Exists()
-        except pywinauto.WindowAmbiguousError:
-            dialog_exists = True
-        if dialog_exists:
-            # We have a dialog. Read it!
-            static_texts = ''
-            try:  # Wrap in a try block in case the pesky window vanishes while we're reading...
-                try:
-                    static_texts = ' '.join([
-                        ' '.join(self.abbyy_dialog.Static.Texts()),
-                        ' '.join(self.abbyy_dialog.Static2.Texts())
-                    ]).strip()
-                except (MemoryError, OverflowError):
-                    print 'Memory error when attempting to read text'
-                except pywinauto.findwindows.WindowAmbiguousError:
-                    # More than one dialog.
-                    try:
-                        static_texts = ' '.join(' '.join(c.Texts()) for c in chain.from_iterable(
-                            x.Children() for x in self.abbyy_app.windows_(class_name='#32770')))
-                    except (MemoryError, OverflowError):
-                        print 'Memory error when attempting to read text'
-                        static_texts = ''
-                except TypeError:
-                    # Bug in pywinauto, possibly for when there is no window text.
-                    static_texts = ''
-                if static_texts:
-                    for phrase in self.check_phrases:
-                        if phrase in static_texts:
-                            self.error.emit(phrase)
-                            self.abbyy_app.kill_()
-                            break
-            except pywinauto.findwindows.WindowNotFoundError:
-                print 'Window went away. No biggy.'
-                return
-        else:
-            self.polls_without_dialog += 1
-            print '{0:.1f} seconds without activity...'.format(
-                (self.polls_without_dialog * self.polling_timer.interval()) / 1000.0)
-            if self.polls_without_dialog >= 20:
-                # Abbyy is running but it doesn't look like it's doing anything. Kill it.
-                self.error.emit('Abbyy was idle for too long without a dialog.')
-                self.abbyy_app.kill_()
-                return
+            # Once reading has finished, send the document on as FineReader does itself when started with /send.
+            self.monitor.send_if_due()
+        except Exception, e:
+            print 'Could not send the document:', e
+            self.error.emit('Could not send the document to Acrobat.')
+            self.probe.kill()
+            return
+        self.polling_timer.start(int(self.monitor.interval * 1000))
 
 
 class AbbyyOcr(QObject):
+    """
+    Runs one job at a time on an instance of an OCR engine from ui.engines.
+
+    When a job finishes its instance is normally kept running, and the next job is opened into it through the UI
+    rather than by starting a new process. The instance is only killed and replaced once it has run recycle_after
+    jobs, its memory use has grown past recycle_memory MB (0 for no limit), an error dialog has appeared, the profile
+    has changed, or it has exited on its own. With recycle_after=1 (or an engine that isn't reusable, such as
+    FineReader without pywinauto) every job gets a fresh instance.
+    """
+
     # Signals
     error = pyqtSignal(str)
+    next_document = pyqtSignal(object)
+    job_done = pyqtSignal()
 
-    def __init__(self, abbyy_path, parent=None):
+    def __init__(self, engine, recycle_after=1, recycle_memory=0, parent=None):
         super(AbbyyOcr, self).__init__(parent)
 
-        self.abbyy_path = abbyy_path
+        self.engine = engine
+        self.recycle_after = recycle_after
+        self.recycle_memory = recycle_memory
         self.app_watcher = None
         self.proc = None
         self.current_profile = None
+        self.current_job = None
+        self.current_path = None
+        self.current_inputs = None
+        self.last_path = None
+        # Job ID the running instance was started with. Its Acrobat proxy sends this back for every job it runs.
+        self.instance_id = None
+        self.instance_profile = None
+        self.jobs_run = 0
+        # When the current job was sent to FineReader and when the last one came back, for the stage timings.
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def busy(self):
+        return self.current_path is not None
+
+    @property
+    def warm(self):
+        """
+        True if a FineReader instance is running idle and can be given the next job.
+        """
+        return self.proc is not None and not self.busy and self.proc.poll() is None
+
+    def ocr(self, path, job_id=None, input_paths=None):
+        """
+        Process path in FineReader. If input_paths is given those files are opened together as one document instead,
+        with the result still reported against path.
+        """
+        reuse = self.engine.reusable and self.warm and self.instance_profile == self.current_profile
+
+        self.current_job = job_id
+        self.current_path = path
+        self.current_inputs = input_paths or [path]
+        self.last_path = path
+
+        if reuse:
+            print 'Reusing FineReader instance', self.proc.pid
+            tracer.mark('instance', self.proc.pid, 'next job', job=job_id)
+            self.jobs_run += 1
+            # The watcher lives on its own thread, so it's only ever told about jobs through queued signals.
+            self.next_document.emit(self.current_inputs)
+            return
+        self.stop_instance()
+        self.start_instance()
 
-    def ocr(self, path):
-        options = ['/OptionsFile', self.current_profile] if self.current_profile else []
-        args = [self.abbyy_path, path] + options + ['/send', 'Acrobat']
-
-        startup_info = subprocess.STARTUPINFO()
-        startup_info.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-
-        self.proc = subprocess.Popen(args, startupinfo=startup_info)
+    def start_instance(self):
+        start = monotonic()
+        try:
+            self.proc = self.engine.launch(self.current_inputs, self.current_profile, self.current_job)
+        except EngineError, e:
+            QTimer.singleShot(0, lambda: self.emit_error(str(e)))
+            return
+        metrics.observe('spawn', monotonic() - start)
+        metrics.count('instances_started')
+        tracer.step('instance', self.proc.pid, 'starting', job=self.current_job)
+        self.instance_id = self.current_job
+        self.instance_profile = self.current_profile
+        self.jobs_run = 1
 
         self.app_watcher_thread = QThread()
 
-        self.app_watcher = AppWatcher(self.proc)
+        self.app_watcher = AppWatcher(self.engine, self.proc, self.current_inputs)
         self.app_watcher.moveToThread(self.app_watcher_thread)
         self.app_watcher.error.connect(self.emit_error)
+        self.app_watcher.hand_off_failed.connect(self.restart)
+        self.next_document.connect(self.app_watcher.open_document)
+        self.job_done.connect(self.app_watcher.job_finished)
 
         self.app_watcher_thread.started.connect(self.app_watcher.start)
         self.app_watcher_thread.finished.connect(self.app_watcher_thread.deleteLater)
         self.app_watcher_thread.start()
 
+    def restart(self):
+        """
+        The running instance couldn't be given the current job, so start a fresh one for it.
+        """
+        if not self.busy:
+            return
+        print 'Restarting FineReader for', self.current_path
+        self.stop_instance()
+        self.start_instance()
+
+    def should_recycle(self):
+        if not self.engine.reusable or self.proc is None or self.proc.poll() is not None:
+            return True
+        if self.jobs_run >= self.recycle_after:
+            return True
+        if self.recycle_memory:
+            memory = self.engine.memory(self.proc.pid)
+            if memory is not None and memory > self.recycle_memory * 1024 * 1024:
+                print 'Instance is using {0:,} bytes. Recycling.'.format(memory)
+                return True
+        return False
+
+    def finish(self):
+        """
+        The current job has produced its PDF. Keep the instance for the next job unless it's due to be recycled.
+        """
+        self.current_job = None
+        self.current_path = None
+        if self.should_recycle():
+            self.stop_instance()
+        else:
+            self.job_done.emit()
+
     def kill(self):
-        print 'Killing...'
-        try:
+        self.current_job = None
+        self.current_path = None
+        self.stop_instance()
+
+    def stop_instance(self):
+        """
+        Kill FineReader and stop its watcher. Waiting for the process to exit and removing its temp files is left to the
+        reaper thread.
+        """
+        if self.proc is None and self.app_watcher is None:
+            return
+        start = monotonic()
+        self.instance_id = None
+        proc, self.proc = self.proc, None
+        abbyy_temp_path = None
+        if self.app_watcher is not None:
             abbyy_temp_path = self.app_watcher.current_temp_path
-            if not abbyy_temp_path:
-                abbyy_temp_path = get_abbyy_temp_folder(self.pid)
-            self.proc.kill()
-            self.proc.wait()
-            self.proc = None
-        except AttributeError:
-            # The process has already been deleted.
-            abbyy_temp_path = None
+        if proc is not None and proc.poll() is None:
+            proc.kill()
+        if proc is not None:
+            tracer.step('instance', proc.pid, 'cleanup')
 
         try:
+            self.next_document.disconnect(self.app_watcher.open_document)
+            self.job_done.disconnect(self.app_watcher.job_finished)
             self.app_watcher.deleteLater()
             self.app_watcher_thread.quit()
             self.app_watcher_thread.wait()
-        except (RuntimeError, AttributeError):
+        except (RuntimeError, AttributeError, TypeError):
             # self.app_watcher already deleted.
             pass
+        self.app_watcher = None
 
-        # Try to remove temp files.
-        if abbyy_temp_path:
-            print 'Removing', abbyy_temp_path
-            os.chmod(abbyy_temp_path, stat.S_IWRITE)
-            try:
-                rmtree(abbyy_temp_path)
-                map(os.remove, glob.glob('{0:s}/*.tmp'.format(os.path.join(tempfile.gettempdir(), 'FineReader10'))))
-            except (OSError, IOError, WindowsError):
-                pass
-        print 'Killed'
+        if proc is not None:
+            temp_reaper.reap(proc, abbyy_temp_path)
+        elapsed = monotonic() - start
+        metrics.observe('kill', elapsed)
+        print 'Killed in {0:.3f} s'.format(elapsed)
 
     def emit_error(self, error_message):
         self.kill()
         self.error.emit(error_message)
 
 
+class AbbyyPool(QObject):
+    """
+    Runs several engine instances side by side, each with its own AbbyyOcr worker, AppWatcher and temp folder.
+
+    Every job is given a unique ID. A new instance is passed the ID of the job it starts with through the environment,
+    and the Acrobat proxy launched by FineReader inherits it and sends it back along with the PDF path.
+    Since each instance only runs one job at a time, that ID identifies the worker (and so the job) a result is for,
+    including later jobs run on the same warm instance.
+    """
+
+    # Signals
+    error = pyqtSignal(str, str)  # Input path, error message.
+
+    def __init__(self, engine, size=1, recycle_after=1, recycle_memory=0, parent=None):
+        super(AbbyyPool, self).__init__(parent)
+        self.engine = engine
+        self.recycle_after = recycle_after
+        self.recycle_memory = recycle_memory
+        self.workers = []
+        self.next_job_id = 1
+        self._current_profile = None
+        self.resize(size)
+
+    @property
+    def current_profile(self):
+        return self._current_profile
+
+    @current_profile.setter
+    def current_profile(self, profile):
+        self._current_profile = profile
+        for worker in self.workers:
+            worker.current_profile = profile
+
+    @property
+    def size(self):
+        return len(self.workers)
+
+    @property
+    def busy_count(self):
+        return sum(1 for worker in self.workers if worker.busy)
+
+    @property
+    def has_idle(self):
+        return any(not worker.busy for worker in self.workers)
+
+    @property
+    def busy_paths(self):
+        return [worker.current_path for worker in self.workers if worker.busy]
+
+    def resize(self, size):
+        """
+        Set the number of concurrent FineReader instances. Busy workers beyond the new size are left to finish.
+        """
+        size = max(1, int(size))
+        while len(self.workers) < size:
+            worker = AbbyyOcr(self.engine, self.recycle_after, self.recycle_memory)
+            worker.current_profile = self._current_profile
+            worker.error.connect(lambda message, worker=worker: self.worker_error(worker, message))
+            self.workers.append(worker)
+        for worker in [w for w in self.workers[size:] if not w.busy]:
+            worker.kill()
+            self.workers.remove(worker)
+
+    def ocr(self, path, input_paths=None):
+        """
+        Start processing path (or a batch of input_paths that make up the document path) on an idle worker. Returns
+        the job ID, or None if every worker is busy.
+        """
+        idle_workers = [worker for worker in self.workers if not worker.busy]
+        if not idle_workers:
+            return None
+        # Prefer an instance that's already running.
+        worker = max(idle_workers, key=lambda w: w.warm)
+        job_id = str(self.next_job_id)
+        self.next_job_id += 1
+        print 'Job {0:s} on worker {1:d}: {2:s}'.format(job_id, self.workers.index(worker), path)
+        start = monotonic()
+        if worker.finished_at:
+            # With cleanup and output moves off this thread, this should be little more than the time the queue was
+            # empty.
+            print 'Worker {0:d} idle for {1:.3f} s'.format(self.workers.index(worker), start - worker.finished_at)
+        worker.ocr(path, job_id, input_paths)
+        worker.started_at = start
+        print 'Job {0:s} launched in {1:.3f} s'.format(job_id, monotonic() - start)
+        return job_id
+
+    def find_worker(self, job_id):
+        """
+        Find the worker running job_id. If the proxy didn't pass a job ID but only one job is running, assume it's
+        that one.
+        """
+        busy_workers = [worker for worker in self.workers if worker.busy]
+        if job_id:
+            for worker in busy_workers:
+                if worker.instance_id == job_id:
+                    return worker
+            return None
+        if len(busy_workers) == 1:
+            return busy_workers[0]
+        return None
+
+    def complete(self, job_id):
+        """
+        Finish the job on the FineReader instance that produced a result for job_id and return its input path, or None
+        if the job is unknown (e.g. it already timed out). The instance is kept for the next job unless it's due to be
+        recycled.
+        """
+        worker = self.find_worker(job_id)
+        if not worker:
+            return None
+        path = worker.current_path
+        finished_at = monotonic()
+        if worker.proc is not None:
+            tracer.mark('instance', worker.proc.pid, 'delivered', job=job_id)
+        if worker.started_at:
+            metrics.observe('ocr', finished_at - worker.started_at)
+            print 'Job {0:s} took {1:.3f} s in FineReader'.format(job_id, finished_at - worker.started_at)
+        metrics.count('jobs_completed')
+        worker.finish()
+        worker.finished_at = finished_at
+        return path
+
+    def worker_error(self, worker, error_message):
+        # The worker has already been killed (and its current path cleared) by the time this is called.
+        worker.finished_at = monotonic()
+        metrics.count('jobs_failed')
+        self.error.emit(worker.last_path, error_message)
+
+    def kill(self):
+        for worker in self.workers:
+            worker.kill()
+
+
 class AcrobatProxyListener(QLocalServer):
+    """
+    Receives PDF paths from Acrobat proxies over any number of connections at once, using the framed protocol in
+    ui.proxy_protocol. Each path is acknowledged once new_path has been emitted for it, and repeats of a request
+    already delivered are acknowledged without being emitted again.
+    """
+
     # Signals
-    new_path = pyqtSignal(str)
+    new_path = pyqtSignal(str, str)  # Job ID, PDF path.
 
-    def __init__(self, parent=None):
+    def __init__(self, name=LISTENER_NAME, parent=None):
         super(AcrobatProxyListener, self).__init__(parent)
+        self.name = name
         self.newConnection.connect(self.on_new_connection)
-        self.local_socket = QLocalSocket()
+        self.connections = {}  # QLocalSocket: FrameDecoder
+        self.connected_at = {}  # QLocalSocket: when it connected, for the delivery time.
+        self.handler = DeliveryHandler()
 
     def start(self):
-        success = self.listen('Acrobat-Proxy-Listener')
+        success = self.listen(self.name)
+        if not success and self.serverError() == QAbstractSocket.AddressInUseError:
+            # Left behind by a crashed run (Unix sockets only).
+            QLocalServer.removeServer(self.name)
+            success = self.listen(self.name)
         print 'Listening for Acrobat paths...'
         return success
 
     def stop(self):
         success = self.close()
+        for local_socket in self.connections.keys():
+            local_socket.abort()
         print 'Stopped listening for Acrobat paths'
         return success
 
     def on_new_connection(self):
-        print 'NEW CONNECTION'
-        self.local_socket = self.nextPendingConnection()
-        self.local_socket.readyRead.connect(self.on_ready_read)
-
-    def on_ready_read(self):
-        print 'READING...'
-        data = str(self.local_socket.readAll())
-        self.local_socket.close()
-        self.local_socket.deleteLater()
-        print 'New path:', data
-        self.new_path.emit(data)
+        while self.hasPendingConnections():
+            local_socket = self.nextPendingConnection()
+            self.connections[local_socket] = FrameDecoder()
+            self.connected_at[local_socket] = monotonic()
+            local_socket.readyRead.connect(lambda local_socket=local_socket: self.on_ready_read(local_socket))
+            local_socket.disconnected.connect(lambda local_socket=local_socket: self.on_disconnected(local_socket))
+
+    def on_ready_read(self, local_socket):
+        decoder = self.connections.get(local_socket)
+        if decoder is None:
+            return
+        try:
+            frames = decoder.feed(str(local_socket.readAll()))
+        except ProtocolError, e:
+            print 'Bad data from the Acrobat proxy:', e
+            self.connections.pop(local_socket, None)
+            self.connected_at.pop(local_socket, None)
+            local_socket.abort()
+            local_socket.deleteLater()
+            return
+        for payload in frames:
+            response, delivered = self.handler.handle(payload)
+            if delivered:
+                job_id, path = delivered
+                print 'New path:', path, 'for job', job_id
+                self.new_path.emit(job_id, path)
+            local_socket.write(response)
+            if delivered and local_socket in self.connected_at:
+                metrics.observe('delivery', monotonic() - self.connected_at[local_socket])
+                # Any further requests on this connection are timed from when this one was answered.
+                self.connected_at[local_socket] = monotonic()
+
+    def on_disconnected(self, local_socket):
+        decoder = self.connections.pop(local_socket, None)
+        self.connected_at.pop(local_socket, None)
+        if decoder is not None:
+            data = str(local_socket.readAll())
+            try:
+                if data:
+                    decoder.feed(data)
+            except ProtocolError, e:
+                print 'Bad data from the Acrobat proxy:', e
+                local_socket.abort()
+                local_socket.deleteLater()
+                return
+            if decoder.legacy:
+                # An old proxy that sends "<job ID>\n<path>" and disconnects.
+                job_id, path = DeliveryHandler.handle_legacy(decoder.buffer)
+                print 'New path:', path, 'for job', job_id
+                self.new_path.emit(job_id, path)
+        local_socket.deleteLater()
@@ -0,0 +1,117 @@
+import os
+import re
+
+__author__ = 'Gary Hughes'
+
+
+MODES = ('none', 'folder', 'pattern')
+
+regex_digits = re.compile(r'(\d+)')
+
+
+def natural_key(name):
+    """
+    Sort key that puts page2 before page10.
+    """
+    return [int(part) if part.isdigit() else part.lower() for part in regex_digits.split(name)]
+
+
+class Batcher(object):
+    """
+    Groups input files that belong in one output document so they can be sent to FineReader in a single run, which
+    saves its start-up and shutdown time for every page.
+
+    Each group is queued as one job under a document path that stands in for the output:
+      - folder: every matching file in a subfolder makes one document, named after the folder. W\\a\\b\\*.tif becomes
+        the document W\\a\\b.tif, which is output as a\\b.pdf. Files directly in the watch folder aren't grouped.
+      - pattern: files in the same folder whose names give the same first group for the pattern regex make one
+        document, named by that group. With ^(.+)_p\\d+ the files W\\a\\doc_p1.tif and W\\a\\doc_p2.tif become
+        W\\a\\doc.tif. Names that don't match aren't grouped.
+      - none: every file is its own job.
+
+    A folder can be split across several batches of scan results, so group() keeps each document's total size over
+    every call. Files that arrive while running are held by the caller until signature() stops changing, so a document
+    isn't queued as soon as its first page lands.
+    """
+
+    def __init__(self, mode, pattern, extension, watch_folder):
+        self.mode = mode if mode in MODES else 'none'
+        self.pattern = re.compile(pattern, re.IGNORECASE) if self.mode == 'pattern' and pattern else None
+        if self.mode == 'pattern' and not self.pattern:
+            self.mode = 'none'
+        self.extension = extension
+        self.watch_folder = os.path.normcase(os.path.normpath(watch_folder))
+        self.sizes = {}  # Document path: total size of the files seen for it by group().
+
+    @property
+    def enabled(self):
+        return self.mode != 'none'
+
+    def document(self, path):
+        """
+        The document path a file belongs to, or the file itself if it isn't grouped.
+        """
+        folder, name = os.path.split(path)
+        extension = os.path.splitext(name)[1]
+        if self.mode == 'folder':
+            if os.path.normcase(folder) == self.watch_folder:
+                return path
+            return folder + extension
+        elif self.mode == 'pattern':
+            match = self.pattern.match(name)
+            if match and match.group(1):
+                return os.path.join(folder, match.group(1) + extension)
+        return path
+
+    def group(self, entries):
+        """
+        Turn (path, size) entries into (document path, total size) entries, keeping the order documents are first
+        seen in. The total includes files passed to earlier calls.
+        """
+        if not self.enabled:
+            return entries
+        seen = set()
+        order = []
+        for path, size in entries:
+            document = self.document(path)
+            if document not in seen:
+                seen.add(document)
+                order.append(document)
+            self.sizes[document] = self.sizes.get(document, 0) + (size or 0)
+        return [(document, self.sizes[document]) for document in order]
+
+    def signature(self, document):
+        """
+        (total size, (path, size, mtime) of each file) for a document, or None if none of its files exist. Once this
+        stops changing the document has stopped gaining pages.
+        """
+        files = []
+        for path in self.members(document):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((path, st.st_size, st.st_mtime))
+        if not files:
+            return None
+        return sum(size for path, size, mtime in files), tuple(files)
+
+    def members(self, document):
+        """
+        The input files for a document path, in natural name order. For ungrouped files this is just the file.
+        """
+        if not self.enabled:
+            return [document]
+        if self.mode == 'folder':
+            folder = os.path.splitext(document)[0]
+            if not os.path.isdir(folder):
+                return [document]
+        else:
+            folder = os.path.dirname(document)
+        try:
+            names = sorted(os.listdir(folder), key=natural_key)
+        except OSError:
+            return [document]
+        members = [os.path.join(folder, name) for name in names if name.lower().endswith(self.extension)]
+        members = [path for path in members if self.document(path) == document]
+        return members or [document]
@@ -1,13 +1,24 @@
 import os
 import platform
-import win32file
-
-from PyQt4.QtCore import QObject, pyqtSignal, QThread, Qt, QSettings, QMutex, QMutexLocker
-from PyQt4.QtGui import QApplication, QLineEdit, QStatusBar, QLabel, QFrame
-import win32api
-import pywintypes
-import win32con
-
+import time
+
+from PyQt4.QtCore import QObject, pyqtSignal, QThread, Qt, QSettings, QMutex, QMutexLocker, QSize
+from PyQt4.QtGui import QApplication, QLineEdit, QStatusBar, QLabel, QFrame, QListView, QStyledItemDelegate, \
+    QStyleOptionViewItemV4, QStyle, QTextDocument, QAbstractItemView, QKeySequence
+
+try:
+    import pywintypes
+    import win32api
+    import win32con
+    import win32event
+    import win32file
+except ImportError:
+    # Not on Windows (e.g. running the simulator engine). The watch folder is polled instead of watched.
+    win32file = None
+
+from ui.scan_manifest import ScanManifest
+from ui.settle_queue import SettleQueue
+from ui.tracing import tracer
 
 __author__ = 'Gary Hughes'
 
@@ -19,7 +30,24 @@ def find_app_path(app_name):
     return str(settings.value('Default', '').toString())
 
 
+def file_is_free(path):
+    """
+    Check that nothing else has a file open, e.g. because it's still being copied in. Always True off Windows, where
+    only the size and mtime are checked.
+    """
+    if not win32file:
+        return True
+    try:
+        handle = win32file.CreateFile(path, win32con.GENERIC_READ, 0, None, win32con.OPEN_EXISTING, 0, None)
+    except pywintypes.error:
+        return False
+    handle.Close()
+    return True
+
+
 def get_exe_version(exe_path):
+    if not win32file:
+        return None
     try:
         info = win32api.GetFileVersionInfo(exe_path, '\\')
         version = map(int, (win32api.HIWORD(info['FileVersionMS']), win32api.LOWORD(info['FileVersionMS'])))
@@ -34,25 +62,35 @@ class FileWatcher(QObject):
         1: 'Created',
         2: 'Deleted',
         3: 'Updated',
-        4: 'Renamed from something',
-        5: 'Renamed to something'
+        4: 'Renamed from (old name)',
+        5: 'Renamed to (new name)'
     }
 
     FILE_LIST_DIRECTORY = 0x0001
+    MAX_WAIT = 500  # Milliseconds between checks of the stopping flag.
+    POLL_INTERVAL = 5.0  # Seconds between rescans of the watch folder where it can't be watched.
 
     # Signals
-    first_queue = pyqtSignal(list)
+    queue_batch = pyqtSignal(list)
+    scan_finished = pyqtSignal(int)
     queue_change = pyqtSignal(tuple)
     count_change = pyqtSignal(int)
     finished = pyqtSignal()
     error = pyqtSignal(str)
+    overflowed = pyqtSignal()
 
-    def __init__(self, watch_folder, extension, parent=None):
+    def __init__(self, watch_folder, extension, incremental=False, scan_workers=8, settle_time=2.0, run_id=None,
+                 parent=None):
         super(FileWatcher, self).__init__(parent)
         self.watch_folder = watch_folder
         self.extension = extension
+        self.incremental = incremental
+        self.run_id = run_id
+        self.scan_workers = scan_workers
+        self.settle_queue = SettleQueue(settle_time, file_is_free)
         self.mutex = QMutex()
         self.stopping_value = False
+        self.rescan_requested = False
         self.h_dir = None
 
     @property
@@ -70,15 +108,37 @@ class FileWatcher(QObject):
         mutex_locker = QMutexLocker(self.mutex)
         self.stopping_value = value
 
-    def start(self):
-        # Build an initial queue.
-        file_queue = []
-        for dirpath, dirnames, filenames in os.walk(self.watch_folder):
-            file_queue += [os.path.normpath(os.path.join(dirpath, x)) for x in filenames if
-                           x.lower().endswith(self.extension)]
-            self.count_change.emit(len(file_queue))
+    def request_rescan(self):
+        """
+        Have the watch thread catch up with rescan() at its next check. Safe to call from any thread.
+        """
+        mutex_locker = QMutexLocker(self.mutex)
+        self.rescan_requested = True
+
+    def take_rescan_request(self):
+        mutex_locker = QMutexLocker(self.mutex)
+        requested, self.rescan_requested = self.rescan_requested, False
+        return requested
 
-        self.first_queue.emit(file_queue)
+    def start(self):
+        # Build an initial queue, handing it over in batches as it's found so processing can start straight away.
+        # When incremental, only files that are new since the last scan are queued and directories that haven't
+        # changed aren't listed again.
+        self.found_count = 0
+        manifest = ScanManifest()
+        with tracer.span('scan', 'watcher', folder=self.watch_folder, incremental=self.incremental):
+            file_queue, removed = manifest.scan(self.watch_folder, self.extension, full=not self.incremental,
+                                                progress=self.count_change.emit, workers=self.scan_workers,
+                                                on_batch=self.emit_batch, run_id=self.run_id)
+        manifest.close()
+
+        for filename in removed:
+            self.queue_change.emit((2, filename))
+        self.scan_finished.emit(self.found_count)
+
+        if not win32file:
+            self.poll()
+            return
 
         self.h_dir = win32file.CreateFile(
             self.watch_folder,
@@ -86,7 +146,7 @@ class FileWatcher(QObject):
             win32con.FILE_SHARE_READ | win32con.FILE_SHARE_WRITE | win32con.FILE_SHARE_DELETE,
             None,
             win32con.OPEN_EXISTING,
-            win32con.FILE_FLAG_BACKUP_SEMANTICS,
+            win32con.FILE_FLAG_BACKUP_SEMANTICS | win32con.FILE_FLAG_OVERLAPPED,
             None
         )
 
@@ -96,11 +156,16 @@ class FileWatcher(QObject):
 
         print 'Thread: Entering loop'
 
+        # Read changes asynchronously so settled files can be released while waiting for the next change.
+        overlapped = pywintypes.OVERLAPPED()
+        overlapped.hEvent = win32event.CreateEvent(None, True, False, None)
+        buffer = win32file.AllocateReadBuffer(65536)
+
         while 1:
             try:
-                results = win32file.ReadDirectoryChangesW(
+                win32file.ReadDirectoryChangesW(
                     self.h_dir,
-                    10240,
+                    buffer,
                     True,
                     win32con.FILE_NOTIFY_CHANGE_FILE_NAME |
                     win32con.FILE_NOTIFY_CHANGE_DIR_NAME |
@@ -108,27 +173,99 @@ class FileWatcher(QObject):
                     win32con.FILE_NOTIFY_CHANGE_SIZE |
                     win32con.FILE_NOTIFY_CHANGE_LAST_WRITE |
                     win32con.FILE_NOTIFY_CHANGE_SECURITY,
-                    None,
+                    overlapped,
                     None
                 )
             except pywintypes.error, e:
                 self.error.emit(e[2])
                 return
 
-            if self.stopping:
-                print 'WOOP', win32file.CancelIo(self.h_dir)
-                self.finished.emit()
+            while 1:
+                wait_time = self.settle_queue.wait_time()
+                timeout = self.MAX_WAIT if wait_time is None else min(self.MAX_WAIT, int(wait_time * 1000) + 1)
+                result = win32event.WaitForSingleObject(overlapped.hEvent, timeout)
+                if self.stopping:
+                    win32file.CancelIo(self.h_dir)
+                    self.finished.emit()
+                    return
+                if self.take_rescan_request():
+                    self.rescan()
+                self.release_settled()
+                if result == win32event.WAIT_OBJECT_0:
+                    break
+
+            try:
+                size = win32file.GetOverlappedResult(self.h_dir, overlapped, True)
+            except pywintypes.error, e:
+                self.error.emit(e[2])
                 return
-            for action, filename in results:
+            if not size:
+                # The buffer overflowed and the changes were lost. The main window asks for a rescan to find them.
+                print 'Change buffer overflowed'
+                self.overflowed.emit()
+                continue
+
+            now = time.time()
+            for action, filename in win32file.FILE_NOTIFY_INFORMATION(buffer, size):
                 full_filename = os.path.normpath(os.path.join(self.watch_folder, filename))
                 if not filename.lower().endswith(self.extension):
                     continue
                 print (full_filename, self.ACTIONS.get(action, 'Unknown'))
-                self.queue_change.emit((action, full_filename))
+                if action in (1, 3, 5):
+                    # Created / Updated / Renamed to. Hold it until it has finished being written.
+                    self.settle_queue.touch(full_filename, now)
+                elif action in (2, 4):
+                    # Deleted / Renamed from.
+                    self.settle_queue.discard(full_filename)
+                    self.queue_change.emit((action, full_filename))
 
         print 'Watcher thread closing...'
         self.finished.emit()
 
+    def poll(self):
+        """
+        Stand-in for watching the folder off Windows: rescan it every POLL_INTERVAL seconds until stopped.
+        """
+        print 'Thread: Polling watch folder'
+        next_scan = time.time() + self.POLL_INTERVAL
+        while not self.stopping:
+            if time.time() >= next_scan or self.take_rescan_request():
+                self.rescan()
+                next_scan = time.time() + self.POLL_INTERVAL
+            self.release_settled()
+            wait_time = self.settle_queue.wait_time()
+            wait_time = min(self.MAX_WAIT / 1000.0, max(0.0, next_scan - time.time()),
+                            self.MAX_WAIT / 1000.0 if wait_time is None else wait_time)
+            time.sleep(wait_time)
+        self.finished.emit()
+
+    def rescan(self):
+        """
+        Catch up after change notifications were lost: list the directories that have changed since the last scan and
+        treat what's new or gone as if its events had arrived, so new files still wait to settle.
+        """
+        now = time.time()
+        manifest = ScanManifest()
+        with tracer.span('rescan', 'watcher', folder=self.watch_folder):
+            new_entries, removed = manifest.scan(self.watch_folder, self.extension, workers=self.scan_workers,
+                                                 run_id=self.run_id)
+        manifest.close()
+        print 'Rescan found {0:,} new and {1:,} removed files'.format(len(new_entries), len(removed))
+        for filename, size in new_entries:
+            self.settle_queue.touch(filename, now)
+        for filename in removed:
+            self.settle_queue.discard(filename)
+            self.queue_change.emit((2, filename))
+
+    def release_settled(self):
+        for filename, size in self.settle_queue.pop_settled():
+            print (filename, 'Settled')
+            self.queue_change.emit((1, filename, size))
+
+    def emit_batch(self, entries):
+        self.found_count += len(entries)
+        self.queue_batch.emit(entries)
+
 
 class Win7Taskbar(QObject):
     TBPF_NOPROGRESS = 0
@@ -249,3 +386,74 @@ class StatusBar(QStatusBar):
     def update_right(self, text):
         self.right_label.setText(text)
 
+
+class HtmlItemDelegate(QStyledItemDelegate):
+    """ Item delegate that draws the item text as HTML """
+
+    def __init__(self, parent=None):
+        super(HtmlItemDelegate, self).__init__(parent)
+        self.document = QTextDocument(self)
+        self.document.setDocumentMargin(1)
+
+    def set_document(self, option, html):
+        self.document.setDefaultFont(option.font)
+        self.document.setHtml(html)
+
+    def paint(self, painter, option, index):
+        option = QStyleOptionViewItemV4(option)
+        self.initStyleOption(option, index)
+        html = option.text
+        # Draw the background (and selection) without the text, then the text on top.
+        option.text = ''
+        style = option.widget.style() if option.widget else QApplication.style()
+        style.drawControl(QStyle.CE_ItemViewItem, option, painter, option.widget)
+        self.set_document(option, html)
+        painter.save()
+        painter.translate(option.rect.topLeft())
+        painter.setClipRect(0, 0, option.rect.width(), option.rect.height())
+        self.document.drawContents(painter)
+        painter.restore()
+
+    def sizeHint(self, option, index):
+        self.set_document(option, index.data().toString())
+        return QSize(int(self.document.idealWidth()), int(self.document.size().height()))
+
+
+class LogView(QListView):
+    """
+    View for a LogModel. Only the visible lines are drawn, and it keeps scrolled to the newest line unless it has been
+    scrolled up to read something.
+    """
+
+    def __init__(self, parent=None):
+        super(LogView, self).__init__(parent)
+        self.setUniformItemSizes(True)
+        self.setItemDelegate(HtmlItemDelegate(self))
+        self.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.follow = True
+
+    def setModel(self, model):
+        super(LogView, self).setModel(model)
+        model.rowsAboutToBeInserted.connect(self.check_follow)
+        model.flushed.connect(self.on_flushed)
+
+    def check_follow(self, *args):
+        v_scrollbar = self.verticalScrollBar()
+        self.follow = v_scrollbar.value() == v_scrollbar.maximum()
+
+    def on_flushed(self):
+        if self.follow:
+            self.scrollToBottom()
+
+    def keyPressEvent(self, event):
+        if not event.matches(QKeySequence.Copy):
+            return super(LogView, self).keyPressEvent(event)
+        # Copy the selected lines as plain text.
+        document = QTextDocument()
+        lines = []
+        for index in sorted(self.selectedIndexes(), key=lambda i: i.row()):
+            document.setHtml(index.data().toString())
+            lines.append(unicode(document.toPlainText()))
+        QApplication.clipboard().setText('\n'.join(lines))
@@ -0,0 +1,227 @@
+import os
+import subprocess
+import sys
+
+from ui.liveness import FineReaderProbe, ProcessProbe
+from ui.proxy_protocol import JOB_ENVIRONMENT_KEY
+from ui.temp_folders import temp_folder_index
+
+try:
+    import pywinauto
+except ImportError:
+    # Not on Windows (e.g. running against the simulator). Dialog checks are skipped.
+    pywinauto = None
+
+try:
+    import win32api
+    import win32con
+    import win32process
+except ImportError:
+    win32process = None
+
+__author__ = 'Gary Hughes'
+
+# Longest command line Windows will start a process with, less some room for FineReader's own arguments.
+MAX_COMMAND_LINE = 32000
+
+SIMULATOR_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'utils',
+                              'fake_finereader.py')
+
+
+class EngineError(Exception):
+    pass
+
+
+def get_process_memory(pid):
+    """
+    Working set of a process in bytes, or None if it can't be read.
+    """
+    if not win32process:
+        return None
+    try:
+        handle = win32api.OpenProcess(win32con.PROCESS_QUERY_INFORMATION | win32con.PROCESS_VM_READ, False, pid)
+        try:
+            return win32process.GetProcessMemoryInfo(handle)['WorkingSetSize']
+        finally:
+            win32api.CloseHandle(handle)
+    except win32api.error:
+        return None
+
+
+class Engine(object):
+    """
+    An OCR program that AbbyyOcr runs jobs in, one process per instance:
+      - launch() starts an instance on the files for its first job.
+      - probe() gives the ProcessProbe that AppWatcher follows an instance's progress and errors with, looking for
+        check_phrases in its dialogs, and kills it with.
+      - Results come back to the AcrobatProxyListener as (job ID, PDF path) over ui.proxy_protocol, with the job ID the
+        instance was launched with.
+      - If reusable is True, probe().open_document() gives a running instance its next job.
+
+    Instance temp folders are found through temp_folder_index, so an engine's instances must lay them out the way
+    FineReader 10 does.
+    """
+
+    name = None
+    reusable = False
+    # Engines that send their results through Acrobat need the Acrobat proxy installed.
+    needs_acrobat_proxy = False
+    # Text in an instance's dialogs that means the job has failed.
+    check_phrases = ()
+
+    def arguments(self, input_paths, profile):
+        raise NotImplementedError
+
+    def environment(self, job_id):
+        environment = dict(os.environ)
+        if job_id is not None:
+            environment[JOB_ENVIRONMENT_KEY] = str(job_id)
+        return environment
+
+    def launch(self, input_paths, profile=None, job_id=None):
+        """
+        Start an instance on input_paths and return its subprocess.Popen. Raises EngineError if it can't be started.
+        """
+        args = self.arguments(input_paths, profile)
+        if len(subprocess.list2cmdline(args)) > MAX_COMMAND_LINE:
+            raise EngineError('Too many files to send to ABBYY in one batch.')
+        return subprocess.Popen(args, env=self.environment(job_id))
+
+    def probe(self, proc):
+        """
+        Called on the watcher's thread.
+        """
+        return ProcessProbe(proc)
+
+    def temp_folder(self, pid):
+        return temp_folder_index.lookup(pid)
+
+    def memory(self, pid):
+        """
+        Memory use of an instance in bytes, or None if it can't be read.
+        """
+        return get_process_memory(pid)
+
+
+class FineReader10(Engine):
+    """
+    ABBYY FineReader 10, started with /send Acrobat so each finished document goes to the Acrobat proxy. Running
+    instances are driven through pywinauto, so they can only be reused on Windows.
+    """
+
+    name = 'finereader10'
+    needs_acrobat_proxy = True
+    check_phrases = (
+        'Some licenses cannot be used',
+        'Some of the pages have not been',
+        'Process failed'
+    )
+
+    def __init__(self, abbyy_path):
+        self.abbyy_path = abbyy_path
+
+    @property
+    def reusable(self):
+        return pywinauto is not None
+
+    def arguments(self, input_paths, profile):
+        options = ['/OptionsFile', profile] if profile else []
+        return [self.abbyy_path] + list(input_paths) + options + ['/send', 'Acrobat']
+
+    def launch(self, input_paths, profile=None, job_id=None):
+        if not hasattr(subprocess, 'STARTUPINFO'):
+            return super(FineReader10, self).launch(input_paths, profile, job_id)
+        args = self.arguments(input_paths, profile)
+        if len(subprocess.list2cmdline(args)) > MAX_COMMAND_LINE:
+            raise EngineError('Too many files to send to ABBYY in one batch.')
+        startup_info = subprocess.STARTUPINFO()
+        startup_info.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        return subprocess.Popen(args, startupinfo=startup_info, env=self.environment(job_id))
+
+    def probe(self, proc):
+        return FineReaderProbe(proc) if pywinauto else ProcessProbe(proc)
+
+
+class Simulator(Engine):
+    """
+    Runs utils/fake_finereader.py in place of FineReader, so throughput can be measured and tuned on any machine,
+    Linux included.
+
+    Latencies are distributions in the form name:parameters, e.g. fixed:1, uniform:0.5:2, normal:1:0.25,
+    lognormal:<median>:<sigma> or exponential:<mean>, in seconds. startup is paid once per instance and page once per
+    input file. Each job fails at the given rates: error shows one of check_phrases in a dialog, hang stops making
+    progress without finishing, and crash exits part way through. seed makes a run repeatable.
+    """
+
+    name = 'simulator'
+    reusable = True
+    check_phrases = FineReader10.check_phrases
+
+    def __init__(self, startup='fixed:0.5', page='fixed:1', error_rate=0.0, hang_rate=0.0, crash_rate=0.0, seed=None,
+                 python=None, script=SIMULATOR_PATH):
+        self.startup = startup
+        self.page = page
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.crash_rate = crash_rate
+        self.seed = seed
+        self.python = python or sys.executable
+        self.script = script
+        self.launches = 0
+
+    def arguments(self, input_paths, profile):
+        options = ['/OptionsFile', profile] if profile else []
+        return [self.python, self.script] + list(input_paths) + options + ['/send', 'Acrobat']
+
+    def environment(self, job_id):
+        environment = super(Simulator, self).environment(job_id)
+        environment.update({
+            'FAKE_FINEREADER_STARTUP': self.startup,
+            'FAKE_FINEREADER_PAGE': self.page,
+            'FAKE_FINEREADER_ERROR_RATE': str(self.error_rate),
+            'FAKE_FINEREADER_HANG_RATE': str(self.hang_rate),
+            'FAKE_FINEREADER_CRASH_RATE': str(self.crash_rate),
+            'FAKE_FINEREADER_ERRORS': '|'.join(self.check_phrases),
+        })
+        if self.seed is not None:
+            # Different for every instance, but the same from one run to the next.
+            environment['FAKE_FINEREADER_SEED'] = str(self.seed + self.launches)
+        self.launches += 1
+        return environment
+
+    def probe(self, proc):
+        return SimulatorProbe(proc, self)
+
+
+class SimulatorProbe(ProcessProbe):
+    """
+    Reads the simulator's "dialogs" from a file in its temp folder and gives it new documents the same way.
+    """
+
+    def __init__(self, proc, engine):
+        super(SimulatorProbe, self).__init__(proc)
+        self.engine = engine
+
+    def dialog_text(self):
+        temp_folder = self.engine.temp_folder(self.pid)
+        if not temp_folder:
+            return None
+        try:
+            with open(os.path.join(temp_folder, 'dialog.txt')) as dialog_file:
+                return dialog_file.read().strip()
+        except IOError:
+            return None
+
+    def open_document(self, input_paths):
+        temp_folder = self.engine.temp_folder(self.pid)
+        if not temp_folder:
+            raise EngineError('Simulator temp folder not found')
+        # Written then renamed, so the simulator never reads half a list.
+        open_path = os.path.join(temp_folder, 'open.txt')
+        with open(open_path + '.part', 'w') as open_file:
+            open_file.write('\n'.join(input_paths))
+        os.rename(open_path + '.part', open_path)
+
+    def send_document(self):
+        # The simulator sends each document as soon as it's done, as FineReader does when started with /send.
+        pass
@@ -0,0 +1,218 @@
+import os
+import sqlite3
+import time
+
+__author__ = 'Gary Hughes'
+
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+# Failed, but still to be retried.
+FAILED = 'failed'
+# Failed too many times. Not queued again until released.
+QUARANTINED = 'quarantined'
+
+
+class JobJournal(object):
+    """
+    Persistent record of every job in a SQLite database (WAL mode) so that a restart can rebuild its queue straight
+    from the journal instead of walking the watch folder and checking every output again.
+
+    Jobs belong to a run, which is a watch folder/output folder pair. A job is queued, running, done, failed (waiting
+    to be retried) or quarantined, and keeps the time it was queued, started and finished and how many attempts it has
+    had. Quarantined jobs stay in the journal, so later scans skip them, until release_quarantine() is called.
+    """
+
+    def __init__(self, db_path='journal.sqlite'):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.text_factory = str
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id INTEGER PRIMARY KEY,
+                watch_folder TEXT NOT NULL,
+                output_folder TEXT NOT NULL,
+                UNIQUE (watch_folder, output_folder)
+            );
+            CREATE TABLE IF NOT EXISTS jobs (
+                run_id INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                state TEXT NOT NULL,
+                size INTEGER,
+                queued_at REAL,
+                started_at REAL,
+                finished_at REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                PRIMARY KEY (run_id, path)
+            );
+            CREATE INDEX IF NOT EXISTS jobs_state ON jobs (run_id, state);
+        ''')
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(jobs)')]
+        if 'size' not in columns:
+            # Journal from before sizes were recorded.
+            self.connection.execute('ALTER TABLE jobs ADD COLUMN size INTEGER')
+        self.connection.commit()
+        self.run_id = None
+
+    def open_run(self, watch_folder, output_folder):
+        """
+        Select the run for a watch/output folder pair, creating it if needed. Returns True if the run already has jobs.
+        """
+        watch_folder = os.path.normcase(os.path.normpath(watch_folder))
+        output_folder = os.path.normcase(os.path.normpath(output_folder))
+        with self.connection:
+            self.connection.execute('INSERT OR IGNORE INTO runs (watch_folder, output_folder) VALUES (?, ?)',
+                                    (watch_folder, output_folder))
+        self.run_id = self.connection.execute('SELECT run_id FROM runs WHERE watch_folder = ? AND output_folder = ?',
+                                              (watch_folder, output_folder)).fetchone()[0]
+        return self.connection.execute('SELECT 1 FROM jobs WHERE run_id = ? LIMIT 1', (self.run_id,)).fetchone() \
+            is not None
+
+    def resume(self):
+        """
+        Put jobs left running by a crash (and failed jobs waiting for a retry) back in the queue and return every
+        queued (path, size) in the order it was first queued. Quarantined jobs are left where they are.
+        """
+        with self.connection:
+            self.connection.execute(
+                'UPDATE jobs SET state = ?, started_at = NULL WHERE run_id = ? AND state IN (?, ?)',
+                (QUEUED, self.run_id, RUNNING, FAILED))
+        cursor = self.connection.execute('SELECT path, size FROM jobs WHERE run_id = ? AND state = ? ORDER BY rowid',
+                                         (self.run_id, QUEUED))
+        return cursor.fetchall()
+
+    def add(self, entries):
+        """
+        Queue any (path, size) entries the journal doesn't already know about and return them, in the order given.
+        """
+        now = time.time()
+        new_entries = []
+        with self.connection:
+            for path, size in entries:
+                cursor = self.connection.execute(
+                    'INSERT OR IGNORE INTO jobs (run_id, path, state, size, queued_at) VALUES (?, ?, ?, ?, ?)',
+                    (self.run_id, path, QUEUED, size, now))
+                if cursor.rowcount:
+                    new_entries.append((path, size))
+        return new_entries
+
+    def remove(self, path):
+        """
+        Forget a job that hasn't been processed yet (or is waiting for a retry), e.g. because its input was deleted.
+        """
+        with self.connection:
+            self.connection.execute('DELETE FROM jobs WHERE run_id = ? AND path = ? AND state IN (?, ?)',
+                                    (self.run_id, path, QUEUED, FAILED))
+
+    def mark_running(self, path):
+        with self.connection:
+            self.connection.execute(
+                'UPDATE jobs SET state = ?, started_at = ?, attempts = attempts + 1 WHERE run_id = ? AND path = ?',
+                (RUNNING, time.time(), self.run_id, path))
+
+    def mark_done(self, path):
+        with self.connection:
+            self.connection.execute(
+                'UPDATE jobs SET state = ?, finished_at = ?, error = NULL WHERE run_id = ? AND path = ?',
+                (DONE, time.time(), self.run_id, path))
+
+    def mark_all_done(self, paths):
+        """
+        mark_done() for many paths in one transaction, e.g. inputs skipped because their output already exists.
+        """
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                'UPDATE jobs SET state = ?, finished_at = ?, error = NULL WHERE run_id = ? AND path = ?',
+                ((DONE, now, self.run_id, path) for path in paths))
+
+    def mark_failed(self, path, error_message):
+        with self.connection:
+            self.connection.execute(
+                'UPDATE jobs SET state = ?, finished_at = ?, error = ? WHERE run_id = ? AND path = ?',
+                (FAILED, time.time(), error_message, self.run_id, path))
+
+    def mark_quarantined(self, path, error_message):
+        with self.connection:
+            self.connection.execute(
+                'UPDATE jobs SET state = ?, finished_at = ?, error = ? WHERE run_id = ? AND path = ?',
+                (QUARANTINED, time.time(), error_message, self.run_id, path))
+
+    def state(self, path):
+        """
+        A job's state, or None if the journal doesn't know it.
+        """
+        row = self.connection.execute('SELECT state FROM jobs WHERE run_id = ? AND path = ?',
+                                      (self.run_id, path)).fetchone()
+        return row[0] if row else None
+
+    def update_size(self, path, size):
+        with self.connection:
+            self.connection.execute('UPDATE jobs SET size = ? WHERE run_id = ? AND path = ?',
+                                    (size, self.run_id, path))
+
+    def requeue(self, path, size):
+        """
+        Queue a finished job again as if it were new, e.g. because a batched document has gained pages since.
+        """
+        with self.connection:
+            self.connection.execute(
+                'UPDATE jobs SET state = ?, size = ?, queued_at = ?, started_at = NULL, finished_at = NULL, '
+                'attempts = 0, error = NULL WHERE run_id = ? AND path = ?',
+                (QUEUED, size, time.time(), self.run_id, path))
+
+    def job(self, path):
+        """
+        (attempts, size) for a job, or None if the journal doesn't know it.
+        """
+        return self.connection.execute('SELECT attempts, size FROM jobs WHERE run_id = ? AND path = ?',
+                                       (self.run_id, path)).fetchone()
+
+    def quarantined(self):
+        """
+        (path, attempts, last error) for every quarantined job in the current run.
+        """
+        cursor = self.connection.execute(
+            'SELECT path, attempts, error FROM jobs WHERE run_id = ? AND state = ? ORDER BY finished_at',
+            (self.run_id, QUARANTINED))
+        return cursor.fetchall()
+
+    def release_quarantine(self, paths=None):
+        """
+        Queue quarantined jobs (all of them, or just paths) again with their attempts reset, and return them as
+        (path, size).
+        """
+        if paths is None:
+            paths = [row[0] for row in self.quarantined()]
+        released = []
+        with self.connection:
+            for path in paths:
+                cursor = self.connection.execute(
+                    'UPDATE jobs SET state = ?, attempts = 0, error = NULL, started_at = NULL, finished_at = NULL '
+                    'WHERE run_id = ? AND path = ? AND state = ?', (QUEUED, self.run_id, path, QUARANTINED))
+                if cursor.rowcount:
+                    released.append(path)
+        return [self.connection.execute('SELECT path, size FROM jobs WHERE run_id = ? AND path = ?',
+                                        (self.run_id, path)).fetchone() for path in released]
+
+    def runs(self):
+        """
+        (run ID, watch folder, output folder) for every run in the journal.
+        """
+        return self.connection.execute(
+            'SELECT run_id, watch_folder, output_folder FROM runs ORDER BY run_id').fetchall()
+
+    def counts(self):
+        """
+        Number of jobs in each state for the current run.
+        """
+        cursor = self.connection.execute('SELECT state, COUNT(*) FROM jobs WHERE run_id = ? GROUP BY state',
+                                         (self.run_id,))
+        return dict(cursor)
+
+    def close(self):
+        self.connection.close()
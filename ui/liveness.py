@@ -0,0 +1,358 @@
+import errno
+from itertools import chain
+import os
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import win32api
+    import win32con
+    import win32process
+except ImportError:
+    win32process = None
+
+try:
+    import pywinauto
+except ImportError:
+    pywinauto = None
+
+__author__ = 'Gary Hughes'
+
+STILL_ACTIVE = 259
+
+
+def pid_alive(pid):
+    """
+    True if a process with this PID is running. If that can't be found out, assume it is.
+    """
+    if psutil:
+        return psutil.pid_exists(pid)
+    if win32process:
+        try:
+            handle = win32api.OpenProcess(win32con.PROCESS_QUERY_INFORMATION, False, pid)
+        except win32api.error:
+            return False
+        try:
+            return win32process.GetExitCodeProcess(handle) == STILL_ACTIVE
+        finally:
+            win32api.CloseHandle(handle)
+    if os.name == 'posix':
+        try:
+            os.kill(pid, 0)
+        except OSError, e:
+            return e.errno == errno.EPERM
+    return True
+
+
+class ProcessProbe(object):
+    """
+    What AppWatcher can find out about a FineReader process. This base class only looks at the process itself: whether
+    it has exited, and its CPU time and I/O counters through psutil (or pywin32 without it). FineReaderProbe adds
+    FineReader's dialogs through pywinauto.
+
+    Anything with the same methods can be used in their place, so LivenessMonitor can be run on Linux against
+    utils/fake_finereader.py or a ScriptedProbe.
+    """
+
+    def __init__(self, proc):
+        self.proc = proc
+        self.pid = proc.pid
+        self.process = None
+        if psutil:
+            try:
+                self.process = psutil.Process(self.pid)
+            except psutil.Error:
+                pass
+
+    def exited(self):
+        return self.proc.poll() is not None
+
+    def counters(self):
+        """
+        (CPU seconds, I/O operations) used by the process so far, or None if they can't be read.
+        """
+        if self.process is not None:
+            try:
+                cpu_times = self.process.cpu_times()
+                try:
+                    io_counters = self.process.io_counters()
+                    io_count = io_counters.read_count + io_counters.write_count
+                except (psutil.AccessDenied, AttributeError):
+                    # Not available on every platform.
+                    io_count = 0
+                return cpu_times.user + cpu_times.system, io_count
+            except psutil.Error:
+                return None
+        if win32process:
+            try:
+                handle = win32api.OpenProcess(win32con.PROCESS_QUERY_INFORMATION, False, self.pid)
+                try:
+                    times = win32process.GetProcessTimes(handle)
+                    io_counters = win32process.GetProcessIoCounters(handle)
+                finally:
+                    win32api.CloseHandle(handle)
+            except win32api.error:
+                return None
+            # Times are in 100 ns units.
+            return ((times['KernelTime'] + times['UserTime']) / 1e7,
+                    io_counters['ReadOperationCount'] + io_counters['WriteOperationCount'])
+        return None
+
+    def dialog_text(self):
+        """
+        Text of the dialogs FineReader has open, '' if there's a dialog without readable text, or None if there are no
+        dialogs.
+        """
+        return None
+
+    def kill(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+
+
+class ScriptedProbe(ProcessProbe):
+    """
+    ProcessProbe that plays back a list of (exited, counters, dialog text) states instead of watching a process, one
+    per LivenessMonitor check, repeating the last one when they run out. utils/check_liveness.py uses it to run the
+    monitor through busy, stalled and crashed processes, and through documents opened into and sent from a running
+    instance.
+    """
+
+    def __init__(self, states, pid=0, initial=(False, None, None), fail_open=False, fail_send=False):
+        self.proc = None
+        self.pid = pid
+        self.process = None
+        self.states = list(states)
+        self.state = initial
+        self.killed = False
+        # Documents opened and sent, and whether opening or sending raises as pywinauto would.
+        self.opened = []
+        self.sent = 0
+        self.fail_open = fail_open
+        self.fail_send = fail_send
+
+    def exited(self):
+        # The monitor asks this first on every check, so it moves the script on.
+        if self.states:
+            self.state = self.states.pop(0)
+        return self.state[0] or self.killed
+
+    def counters(self):
+        return self.state[1]
+
+    def dialog_text(self):
+        return self.state[2]
+
+    def open_document(self, input_paths):
+        if self.fail_open:
+            raise RuntimeError('No open dialog')
+        self.opened.append(list(input_paths))
+
+    def send_document(self):
+        if self.fail_send:
+            raise RuntimeError('No Send To menu')
+        self.sent += 1
+
+    def kill(self):
+        self.killed = True
+
+
+class FineReaderProbe(ProcessProbe):
+    """
+    ProcessProbe that can also read and drive FineReader's windows. Must be created on the thread that will use it.
+    """
+
+    # Menu command that sends the open document to the Acrobat proxy, as /send Acrobat does on the command line.
+    send_menu = 'File->Send To->Adobe Acrobat'
+
+    def __init__(self, proc):
+        super(FineReaderProbe, self).__init__(proc)
+        self.abbyy_app = pywinauto.Application().connect(process=self.pid)
+        """@type : Application"""
+        self.abbyy_dialog = self.abbyy_app.window_(class_name='#32770')
+
+    def dialog_text(self):
+        try:
+            dialog_exists = self.abbyy_dialog.Exists()
+        except pywinauto.WindowAmbiguousError:
+            dialog_exists = True
+        if not dialog_exists:
+            return None
+        # We have a dialog. Read it!
+        static_texts = ''
+        try:  # Wrap in a try block in case the pesky window vanishes while we're reading...
+            try:
+                static_texts = ' '.join([
+                    ' '.join(self.abbyy_dialog.Static.Texts()),
+                    ' '.join(self.abbyy_dialog.Static2.Texts())
+                ]).strip()
+            except (MemoryError, OverflowError):
+                print 'Memory error when attempting to read text'
+            except pywinauto.findwindows.WindowAmbiguousError:
+                # More than one dialog.
+                try:
+                    static_texts = ' '.join(' '.join(c.Texts()) for c in chain.from_iterable(
+                        x.Children() for x in self.abbyy_app.windows_(class_name='#32770')))
+                except (MemoryError, OverflowError):
+                    print 'Memory error when attempting to read text'
+                    static_texts = ''
+            except TypeError:
+                # Bug in pywinauto, possibly for when there is no window text.
+                static_texts = ''
+        except pywinauto.findwindows.WindowNotFoundError:
+            print 'Window went away. No biggy.'
+            return None
+        return static_texts
+
+    def open_document(self, input_paths):
+        """
+        Start a new document in FineReader and open input_paths into it.
+        """
+        main_window = self.abbyy_app.top_window_()
+        main_window.TypeKeys('^n')
+        # Don't save the previous document.
+        save_prompt = self.abbyy_app.window_(class_name='#32770')
+        if save_prompt.Exists(timeout=1):
+            save_prompt.No.Click()
+        main_window.TypeKeys('^o')
+        open_dialog = self.abbyy_app.window_(class_name='#32770')
+        open_dialog.Wait('ready', timeout=10)
+        open_dialog.Edit.SetEditText(' '.join('"{0:s}"'.format(path) for path in input_paths))
+        open_dialog.Edit.TypeKeys('{ENTER}')
+
+    def send_document(self):
+        self.abbyy_app.top_window_().MenuSelect(self.send_menu)
+
+    def kill(self):
+        self.abbyy_app.kill_()
+
+
+class LivenessMonitor(object):
+    """
+    Decides whether FineReader has failed or hung, and how long to wait before looking again.
+
+    While the process's CPU time or I/O counters keep rising it's clearly working, so its dialogs aren't read and the
+    interval between checks doubles up to max_interval. Once progress stops the interval drops back to min_interval
+    and dialogs are read to look for error phrases. FineReader is only treated as hung after making no progress (with
+    no dialog open) for a timeout that grows with the size and number of the input files, so long documents aren't
+    killed while they're still being read. A dialog that stays open without progress gets longer before it counts as
+    a hang.
+
+    If the counters can't be read, an open dialog (e.g. FineReader's progress window) counts as progress instead, as it
+    always used to.
+
+    A document opened into a running instance (open_document) has to be sent on once FineReader has read it. That's
+    taken to be once it has been seen working and then been quiet for send_after_quiet checks in a row, so it isn't
+    sent before reading has even started.
+    """
+
+    min_interval = 0.5
+    max_interval = 8.0
+    # Less CPU than this between checks (in seconds) is just FineReader's UI ticking over.
+    min_cpu = 0.05
+    base_timeout = 10.0
+    timeout_per_mb = 0.5
+    timeout_per_page = 2.0
+    # A dialog that isn't an error (e.g. a prompt nobody will answer) is given this many times as long.
+    dialog_timeout_factor = 3
+    send_after_quiet = 2
+
+    def __init__(self, probe, check_phrases, input_paths=()):
+        self.probe = probe
+        self.check_phrases = check_phrases
+        self.start_job(input_paths)
+
+    def start_job(self, input_paths=(), now=None, send=False):
+        size = 0
+        for path in input_paths:
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        pages = max(1, len(input_paths))
+        self.timeout = self.base_timeout + self.timeout_per_mb * size / 1048576.0 + self.timeout_per_page * (pages - 1)
+        # When the document is opened into a running instance, take the counters before it's opened so that reading
+        # finished by the first check still shows up as progress.
+        self.last_counters = self.probe.counters() if send else None
+        self.last_progress = time.time() if now is None else now
+        self.interval = self.min_interval
+        self.progressing = False
+        self.dialog = None
+        self.send_pending = send
+        self.reading = False
+        self.quiet_checks = 0
+
+    def open_document(self, input_paths, now=None):
+        """
+        Start a job by opening input_paths in the running FineReader. send_if_due() sends the result on once it has
+        been read. Raises whatever the probe does if FineReader's UI isn't as expected.
+        """
+        self.start_job(input_paths, now, send=True)
+        self.probe.open_document(input_paths)
+
+    @property
+    def quiet(self):
+        """
+        True if FineReader wasn't doing anything and had no dialogs open at the last check.
+        """
+        return not self.progressing and self.dialog is None
+
+    def check(self, now=None):
+        """
+        Look at the process once. Returns an error message if it has failed or hung, otherwise None. The next check is
+        due in self.interval seconds.
+        """
+        if now is None:
+            now = time.time()
+        if self.probe.exited():
+            return 'Abbyy exited before being able to process the file.'
+
+        counters = self.probe.counters()
+        last_counters, self.last_counters = self.last_counters, counters
+        self.progressing = bool(counters and last_counters and (
+            counters[0] - last_counters[0] >= self.min_cpu or counters[1] > last_counters[1]))
+        if self.progressing:
+            self.last_progress = now
+            self.dialog = None
+            self.interval = min(self.interval * 2, self.max_interval)
+            return None
+
+        self.interval = self.min_interval
+        self.dialog = self.probe.dialog_text()
+        if self.dialog:
+            for phrase in self.check_phrases:
+                if phrase in self.dialog:
+                    return phrase
+        if self.dialog is not None and counters is None:
+            self.last_progress = now
+            return None
+        stalled_for = now - self.last_progress
+        print '{0:.1f} seconds without progress...'.format(stalled_for)
+        if stalled_for >= (self.timeout if self.dialog is None else self.timeout * self.dialog_timeout_factor):
+            return 'Abbyy made no progress for {0:.0f} seconds.'.format(stalled_for)
+        return None
+
+    def send_if_due(self):
+        """
+        Call after a check that found no error. Sends an opened document on if FineReader has finished reading it, and
+        returns True if it did. Raises whatever the probe does if the send fails.
+        """
+        if not self.send_pending:
+            return False
+        if not self.quiet:
+            # Progress, or a dialog such as FineReader's progress window: it's reading.
+            self.reading = True
+            self.quiet_checks = 0
+            return False
+        if not self.reading:
+            return False
+        self.quiet_checks += 1
+        if self.quiet_checks < self.send_after_quiet:
+            return False
+        self.send_pending = False
+        self.probe.send_document()
+        return True
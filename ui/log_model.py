@@ -0,0 +1,88 @@
+from collections import deque
+
+from PyQt4.QtCore import Qt, QAbstractListModel, QModelIndex, QTimer, QVariant, pyqtSignal
+
+__author__ = 'Gary Hughes'
+
+
+class LogModel(QAbstractListModel):
+    """
+    The application log as a list model holding at most max_lines lines of HTML, oldest dropped first.
+
+    New lines are held back and added to the model together every flush_interval milliseconds, so a burst of log
+    messages costs one view update instead of one per line. Lines waiting to be added are bounded by max_lines too, so
+    memory stays flat however long the application runs.
+    """
+
+    # Signals
+    flushed = pyqtSignal()
+
+    def __init__(self, max_lines=5000, flush_interval=100, parent=None):
+        super(LogModel, self).__init__(parent)
+        self.max_lines = max(1, max_lines)
+        self.lines = deque(maxlen=self.max_lines)
+        self.pending = deque(maxlen=self.max_lines)
+        self.last_changed = False
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setInterval(flush_interval)
+        self.flush_timer.timeout.connect(self.flush)
+        self.flush_timer.start()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.lines)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid() or index.row() >= len(self.lines):
+            return QVariant()
+        return QVariant(self.lines[index.row()])
+
+    def append(self, text):
+        self.pending.append(text)
+
+    def replace_last(self, text):
+        """
+        Replace the most recent line, or add text if there isn't one.
+        """
+        if self.pending:
+            self.pending[-1] = text
+        elif self.lines:
+            self.lines[-1] = text
+            self.last_changed = True
+        else:
+            self.pending.append(text)
+
+    def clear(self):
+        self.beginResetModel()
+        self.lines.clear()
+        self.pending.clear()
+        self.last_changed = False
+        self.endResetModel()
+
+    def flush(self):
+        if self.last_changed:
+            self.last_changed = False
+            index = self.index(len(self.lines) - 1)
+            self.dataChanged.emit(index, index)
+        if not self.pending:
+            return
+        count = len(self.pending)
+        if count + len(self.lines) > self.max_lines and count >= len(self.lines):
+            # Most or all of the current lines are going, so start again.
+            self.beginResetModel()
+            self.lines.extend(self.pending)
+            self.pending.clear()
+            self.endResetModel()
+        else:
+            overflow = count + len(self.lines) - self.max_lines
+            if overflow > 0:
+                self.beginRemoveRows(QModelIndex(), 0, overflow - 1)
+                for i in xrange(overflow):
+                    self.lines.popleft()
+                self.endRemoveRows()
+            self.beginInsertRows(QModelIndex(), len(self.lines), len(self.lines) + count - 1)
+            self.lines.extend(self.pending)
+            self.pending.clear()
+            self.endInsertRows()
+        self.flushed.emit()
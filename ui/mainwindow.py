@@ -1,17 +1,27 @@
-from collections import deque
 from glob import iglob
 import os
 import re
-from shutil import move
 import shutil
 import sys
 
-from PyQt4.QtCore import pyqtSignature, QThread
+from PyQt4.QtCore import pyqtSignature, QThread, QTimer
 from PyQt4.QtGui import QMainWindow, QApplication, QFileDialog, QWidget
 
 from ui.Ui_mainwindow import Ui_MainWindow
-from ui.abbyy_controller import AcrobatProxyListener, AbbyyOcr
+from ui.abbyy_controller import AcrobatProxyListener, AbbyyPool
 from ui.custom_widgets import Win7Taskbar, FileWatcher, find_app_path, get_exe_version
+from ui.batching import Batcher
+from ui.engines import FineReader10, Simulator
+from ui.job_journal import DONE, FAILED, QUARANTINED, QUEUED, RUNNING, JobJournal
+from ui.log_model import LogModel
+from ui.metrics import metrics
+from ui.tracing import tracer
+from ui.output_index import OutputIndex
+from ui.output_mover import OutputMover
+from ui.reaper import temp_reaper
+from ui.retry import RetryPolicy, RetryQueue
+from ui.settle_queue import SettleQueue
+from ui.work_queue import WorkQueue, make_work_queue, pop_unfinished
 from ui.message_boxes import message_box_error
 from ui.settings import Settings
 
@@ -20,6 +30,9 @@ __author__ = 'Gary Hughes'
 
 regex_html_tags = re.compile('<[^<]+?>')  # Strip HTML tags.
 
+# Status bar and progress updates per second.
+REFRESH_RATE = 15
+
 
 class MainWindow(QMainWindow, Ui_MainWindow):
     """
@@ -38,8 +51,14 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
         self.setWindowTitle('ABBYY Automator v{0:s}'.format(self.app.applicationVersion()))
         self.settings = Settings()
+        self.log_model = LogModel(self.settings.log_lines)
+        self.lv_log.setModel(self.log_model)
 
-        self.get_app_paths()
+        if self.settings.engine == Simulator.name:
+            self.engine = self.settings.simulator
+        else:
+            self.get_app_paths()
+            self.engine = FineReader10(self.abby_path)
 
         self.button_save_errors.setVisible(False)
         self.progress_bar.setVisible(0)
@@ -51,21 +70,58 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.file_watcher = None
         self.processed_count = 0
         self.skipped_count = 0
-        self.file_queue = deque()
-        self.current_pathname = None
+        self.file_queue = WorkQueue()
         self.current_watch_path = None
         self.error_paths = []
+        self.scan_new_count = 0
+        self.job_journal = JobJournal()
+        self.retry_policy = RetryPolicy(self.settings.retry_limits, self.settings.retry_delays,
+                                        self.settings.retry_max_delay)
+        self.retry_queue = RetryQueue()
+        self.retry_timer = QTimer(self)
+        self.retry_timer.setSingleShot(True)
+        self.retry_timer.timeout.connect(self.release_retries)
 
         self.acrobat_proxy_listener = AcrobatProxyListener()
         self.acrobat_proxy_listener.new_path.connect(self.path_received)
 
-        self.abbyy_ocr = AbbyyOcr(self.abby_path)
-        self.abbyy_ocr.error.connect(self.error_received)
-
-        self.update_processed_status()
+        self.output_mover = OutputMover(self.settings.mover_workers)
+        self.output_mover.moved.connect(self.output_moved)
+        self.output_mover.start()
+
+        self.abbyy_pool = AbbyyPool(self.engine, self.settings.worker_count, self.settings.recycle_after,
+                                    self.settings.recycle_memory)
+        self.abbyy_pool.error.connect(self.error_received)
+        # Remove FineReader temp files in the background, including any left behind by earlier crashes.
+        temp_reaper.start()
+
+        if self.settings.metrics_port:
+            metrics.serve(self.settings.metrics_port)
+        if self.settings.metrics_file:
+            metrics.flush_to(self.settings.metrics_file, self.settings.metrics_flush_interval)
+        if self.settings.trace_file:
+            tracer.start(self.settings.trace_file)
+
+        # Status and progress are redrawn on a timer, however often the counts change.
+        self.status_dirty = True
+        self.progress_value = 0
+        self.last_progress = None
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(1000 // REFRESH_RATE)
+        self.refresh_timer.timeout.connect(self.refresh_status)
+        self.refresh_timer.start()
         self.statusbar.update_left('Ready to begin')
 
         self.output_folder = ''
+        self.output_index = None
+        self.batcher = None
+        # Batched documents that gained files while running, held until they stop changing.
+        self.batch_settle = None
+        self.batch_timer = QTimer(self)
+        self.batch_timer.setSingleShot(True)
+        self.batch_timer.timeout.connect(self.release_batches)
+        self.running_members = {}  # Batched document being processed: the files it was sent with.
+        self.stale_documents = set()  # Batched documents that gained files while being processed.
 
         self.load_settings()
 
@@ -73,6 +129,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.settings.last_watch_folder = self.le_watch_folder.text()
         self.settings.last_output_folder = self.le_output_folder.text()
         self.settings.last_profile = self.cb_profile.currentText()
+        self.settings.worker_count = self.abbyy_pool.size
 
     def load_settings(self):
         self.le_watch_folder.setText(self.settings.last_watch_folder)
@@ -160,9 +217,27 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
     def increment_processed(self):
         self.processed_count += 1
+        self.progress_value += 1
         self.update_processed_status()
 
     def update_processed_status(self):
+        """
+        Mark the status bar, progress bar and taskbar progress as out of date. They're brought up to date by the next
+        refresh_status() tick rather than straight away, so this is cheap enough to call for every file.
+        """
+        self.status_dirty = True
+
+    def refresh_status(self):
+        """
+        Called REFRESH_RATE times a second to show the current counts.
+        """
+        if not self.status_dirty and not self.output_mover.queue_depth:
+            return
+        self.status_dirty = False
+        with tracer.span('refresh', 'ui'):
+            self.redraw_status()
+
+    def redraw_status(self):
         if not self.skipped_count:
             skipped_text = ''
         else:
@@ -178,15 +253,39 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
         queue_size = len(self.file_queue)
         if queue_size == 1:
-            self.statusbar.update_right('1 file remaining')
+            remaining_text = '1 file remaining'
         else:
-            self.statusbar.update_right('{0:,} files remaining'.format(queue_size))
-
-        self.app.processEvents()
+            remaining_text = '{0:,} files remaining'.format(queue_size)
+        moving = self.output_mover.queue_depth
+        if moving:
+            remaining_text += ', {0:,} moving'.format(moving)
+            throughput = self.output_mover.throughput
+            if throughput:
+                remaining_text += ' ({0:.1f} MB/s)'.format(throughput / 1048576)
+        self.statusbar.update_right(remaining_text)
+
+        # Progress is out of everything seen since processing started. With nothing left (searching or waiting for
+        # files) the bar just shows activity.
+        total = self.progress_value + queue_size + self.abbyy_pool.busy_count + moving
+        if total > self.progress_value:
+            progress = (self.progress_bar.isVisible(), total, self.progress_value)
+        else:
+            progress = (self.progress_bar.isVisible(), 0, 0)
+        if progress != self.last_progress:
+            self.last_progress = progress
+            visible, total, value = progress
+            self.progress_bar.setRange(0, total)
+            self.progress_bar.setValue(value)
+            if not visible:
+                self.win7_taskbar.set_progress_state(Win7Taskbar.TBPF_NOPROGRESS)
+            elif total:
+                self.win7_taskbar.set_progress_value(value, total)
+            else:
+                self.win7_taskbar.set_progress_state(Win7Taskbar.TBPF_INDETERMINATE)
 
     def log(self, text='', indent=False, update_existing=False, colour=None, bold=False, status_bar=False):
         """
-        Update the QPlainTextEdit based log.
+        Add a line to the log. With update_existing, text is added to the end of the last line instead.
         """
         if colour:
             if colour == 'green':
@@ -198,14 +297,12 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         if indent or update_existing:
             text = '&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;%s' % text
         if update_existing:
-            self.pte_log.undo()
             text = '%s%s' % (self.last_logged_text, text)
-
-        self.pte_log.appendHtml(text)
+            self.log_model.replace_last(text)
+        else:
+            # Shown with the next batch of lines rather than straight away.
+            self.log_model.append(text)
         self.last_logged_text = text
-        self.app.processEvents()
-        v_scrollbar = self.pte_log.verticalScrollBar()
-        v_scrollbar.setValue(v_scrollbar.maximum())
 
         if status_bar:
             # Remove HTML tags from the text and add to the status bar.
@@ -216,17 +313,43 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         # on the next item in the queue.
         if not count:
             count = len(self.file_queue)
-        if count and self.button_start.isChecked() and not self.current_pathname:
+        if count and self.button_start.isChecked() and self.abbyy_pool.has_idle:
             print 'Processing restarted!'
             self.process_next()
 
     def queue_received(self, queue_list):
-        print 'Received new queue'
-        length = len(queue_list)
-        self.file_queue = deque(queue_list)
-        self.log('Found <b>{0:,} files'.format(length))
+        """
+        Add a batch of (path, size) entries found by the file watcher's initial search. Processing starts with the
+        first batch rather than waiting for the search to finish.
+        """
+        print 'Received {0:d} paths'.format(len(queue_list))
+        # Only queue files the journal doesn't already know about (queued, done or failed).
+        entries = self.batcher.group(queue_list)
+        new_entries = self.job_journal.add(entries)
+        if self.batcher.enabled and len(new_entries) < len(entries):
+            new_paths = set(path for path, size in new_entries)
+            for document, size in entries:
+                if document not in new_paths:
+                    self.document_grew(document, size)
+        self.scan_new_count += len(new_entries)
+        self.file_queue.extend(new_entries)
+        if tracer.enabled:
+            for path, size in new_entries:
+                tracer.step('job', path, 'queued', size=size)
+
+        self.update_processed_status()
+
+        if new_entries and self.button_start.isChecked():
+            self.process_next()
+
+    def scan_finished(self, count):
+        if self.file_watcher and self.file_watcher.incremental:
+            self.log('Found <b>{0:,} new files</b> since the last run'.format(self.scan_new_count))
+        elif self.scan_new_count == count:
+            self.log('Found <b>{0:,} files'.format(count))
+        else:
+            self.log('Found <b>{0:,} files</b> ({1:,} new)'.format(count, self.scan_new_count))
 
-        self.progress_bar.setRange(0, length)
         self.update_processed_status()
 
         if self.button_start.isChecked():
@@ -235,100 +358,252 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             self.log()
             self.process_next()
 
-    def adjust_progress_bars(self):
-        self.progress_bar.setMaximum(len(self.file_queue))
-
     def watch_folder_changed(self, event):
         print event
-        action, filename = event
+        action, filename = event[:2]
         if action == 3:
             # Updated.
             return
-        elif action in (1, 4):
-            # Created / Renamed from something.
-            self.file_queue.append(filename)
-        elif action in (2, 5):
-            # Deleted / Renamed to something.
+        elif action in (1, 5):
+            # Created / Renamed to (new name). The file watcher only sends these once the file has settled.
+            size = event[2] if len(event) > 2 else None
+            document = self.batcher.document(filename)
+            if document != filename:
+                # More pages may be on the way. Wait until the whole document has stopped changing.
+                self.batch_settle.touch(document)
+                self.schedule_batches()
+                return
+            if self.job_journal.add([(filename, size)]):
+                self.file_queue.append(filename, size)
+                tracer.step('job', filename, 'queued', size=size)
+        elif action in (2, 4):
+            # Deleted / Renamed from (old name).
+            filename = self.batcher.document(filename)
+            if self.batcher.members(filename) != [filename]:
+                # Other files in the batch are still there.
+                return
+            self.job_journal.remove(filename)
+            self.retry_queue.discard(filename)
             try:
                 self.file_queue.remove(filename)
             except ValueError:
                 print 'Error removing from queue:', filename
         self.update_processed_status()
         self.queue_size_changed()
-        self.adjust_progress_bars()
 
-    def process_next(self):
+    def schedule_batches(self):
+        wait_time = self.batch_settle.wait_time()
+        if wait_time is not None:
+            self.batch_timer.start(int(wait_time * 1000) + 1)
+
+    def release_batches(self):
         """
-        Get next item in the queue and send it to ABBYY.
+        Queue the batched documents that have stopped gaining files.
         """
-        try:
-            while True:
-                # Keep pulling from the queue until the output file doesn't already exist.
-                path = self.file_queue.popleft()
-                out_path = os.path.join(self.output_folder,
-                                        '{0:s}.pdf'.format(path[len(self.current_watch_path) + 1:-4]))
-                print 'CHECKING', out_path
-                if not os.path.isfile(out_path):
-                    break
-                self.skipped_count += 1
-                self.update_processed_status()
-        except IndexError:
-            # Queue is empty.
-            print 'QUEUE IS NOW EMPTY!'
-            self.current_pathname = None
-            self.progress_bar.setMaximum(0)
-            self.progress_bar.setValue(0)
-            self.statusbar.update_left('Waiting for files...')
-            return
+        for document, size in self.batch_settle.pop_settled():
+            print (document, 'Settled')
+            if self.job_journal.add([(document, size)]):
+                self.file_queue.append(document, size)
+                tracer.step('job', document, 'queued', size=size)
+            else:
+                self.document_grew(document, size)
+        self.schedule_batches()
+        self.update_processed_status()
+        self.queue_size_changed()
+
+    def document_grew(self, document, size):
+        """
+        A batched document the journal already knows has new files.
+        """
+        state = self.job_journal.state(document)
+        if state in (QUEUED, FAILED):
+            # Its files are listed when it's sent to FineReader, so the new ones will be included.
+            self.job_journal.update_size(document, size)
+        elif state == RUNNING:
+            if set(self.batcher.members(document)) - self.running_members.get(document, set()):
+                self.stale_documents.add(document)
+        elif state == DONE:
+            self.requeue_document(document)
+
+    def requeue_document(self, document):
+        """
+        Process a batched document again to take in files that arrived after it was processed.
+        """
+        signature = self.batcher.signature(document)
+        size = signature[0] if signature else None
+        self.job_journal.requeue(document, size)
+        # Its output will be replaced, so it mustn't be skipped for already existing.
+        self.output_index.discard(self.get_output_path(document))
+        if self.file_queue.append(document, size):
+            tracer.step('job', document, 'queued', size=size, requeued=True)
+        self.log('<b>{0:s}</b> has new files and will be processed again'.format(
+            document[len(self.current_watch_path) + 1:]))
+
+    def get_output_path(self, path):
+        """
+        Output PDF path for an input path, keeping its location relative to the watch folder.
+        """
+        return os.path.join(self.output_folder, '{0:s}.pdf'.format(path[len(self.current_watch_path) + 1:-4]))
+
+    def output_exists(self, path):
+        return self.output_index.exists(self.get_output_path(path))
 
-        self.current_pathname = path
+    def mark_skipped(self, paths):
+        """
+        Mark inputs whose output already exists as done, in one journal transaction.
+        """
+        self.job_journal.mark_all_done(paths)
+        for path in paths:
+            tracer.finish('job', path, skipped=True)
+        self.skipped_count += len(paths)
+        self.update_processed_status()
 
-        print 'QUEUE PROCESSING:', path
-        self.statusbar.update_left(path[len(self.current_watch_path):])
-        self.abbyy_ocr.ocr(path)
+    def process_next(self):
+        """
+        Send items from the queue to ABBYY until every FineReader instance in the pool is busy.
+
+        Files whose output already exists are skipped and marked done together. After SKIP_CHUNK of them the rest is
+        left to another call from the event loop, so a restart with thousands of finished files doesn't freeze the UI.
+        """
+        while self.abbyy_pool.has_idle:
+            try:
+                path = pop_unfinished(self.file_queue, self.output_exists, self.mark_skipped)
+            except IndexError:
+                # Queue is empty.
+                print 'QUEUE IS NOW EMPTY!'
+                if not self.abbyy_pool.busy_count:
+                    self.statusbar.update_left('Waiting for files...')
+                return
+            if path is None:
+                QTimer.singleShot(0, self.process_next)
+                return
+
+            print 'QUEUE PROCESSING:', path
+            self.statusbar.update_left(path[len(self.current_watch_path):])
+            self.job_journal.mark_running(path)
+            tracer.step('job', path, 'ocr')
+            if self.batcher.enabled:
+                members = self.batcher.members(path)
+                self.running_members[path] = set(members)
+                self.abbyy_pool.ocr(path, members)
+            else:
+                self.abbyy_pool.ocr(path, None)
 
     def closeEvent(self, event):
         self.save_settings()
         self.file_queue.clear()  # Ensure the queue is clear for a clean exit.
-        self.restore_acrobat()
-
-        self.abbyy_ocr.kill()
+        if self.engine.needs_acrobat_proxy:
+            self.restore_acrobat()
+
+        self.abbyy_pool.kill()
+        # Let the reaper finish removing the temp files of the instances just killed.
+        temp_reaper.stop()
+        # Let moves already under way finish and be recorded in the journal.
+        self.output_mover.stop()
+        self.app.processEvents()
+        self.job_journal.close()
+        # Write the metrics file one last time.
+        metrics.stop()
+        tracer.stop()
 
         super(MainWindow, self).closeEvent(event)
 
-    def path_received(self, path):
-        self.abbyy_ocr.kill()
-        path = str(path)
+    def path_received(self, job_id, path):
+        with metrics.time('path_received'):
+            self.handle_path(str(job_id), str(path))
+
+    def handle_path(self, job_id, path):
         print 'Path received:', path
+        source_path = self.abbyy_pool.complete(job_id)
+        if source_path is None:
+            print 'No running job for', path
+            return
 
-        # Calculate output path and store it for when the file is done.
-        out_path = os.path.join(self.output_folder,
-                                '{0:s}.pdf'.format(self.current_pathname[len(self.current_watch_path) + 1:-4]))
-        out_folder = os.path.dirname(out_path)
-        if not os.path.isdir(out_folder):
-            os.makedirs(out_folder)
-        try:
-            move(path, out_path)
-        except(IOError, OSError):
-            print 'Error moving', path, 'to', out_path
+        # The PDF is moved in the background so the next job can start straight away. The job is marked done (and
+        # counted as processed) once the move has finished.
+        tracer.step('job', source_path, 'move', pdf=path)
+        self.output_mover.request(source_path, path, self.get_output_path(source_path))
 
-        self.progress_bar.setValue(self.progress_bar.value() + 1)
-        self.increment_processed()
         self.update_processed_status()
         if self.button_start.isChecked():
             self.process_next()
-        else:
+        elif not self.abbyy_pool.busy_count:
             self.acrobat_proxy_listener.stop()
-
-    def error_received(self, error_message):
-        self.button_save_errors.setVisible(True)
-        self.error_paths.append(self.current_pathname)
-        self.log('Error processing {0:s}:'.format(self.current_pathname), bold=True, colour='red')
-        self.log('Error phrase matched: <b>{0:s}</b>'.format(error_message), indent=True)
-        self.progress_bar.setValue(self.progress_bar.value() + 1)
+            # Don't leave idle FineReader instances running.
+            self.abbyy_pool.kill()
+
+    def output_moved(self, source_path, path, out_path, error_message):
+        source_path, out_path, error_message = str(source_path), str(out_path), str(error_message)
+        if error_message:
+            self.log('Error moving {0:s} to {1:s}:'.format(source_path, out_path), bold=True, colour='red')
+            self.log(error_message, indent=True)
+            self.job_failed(source_path, 'Move failed: {0:s}'.format(error_message))
+            return
+        self.output_index.add(out_path)
+        self.job_journal.mark_done(source_path)
+        tracer.finish('job', source_path, output=out_path)
         self.increment_processed()
-        self.app.processEvents()  # Keep the GUI responsive during processing.
-        self.process_next()
+        self.running_members.pop(source_path, None)
+        if source_path in self.stale_documents:
+            self.stale_documents.discard(source_path)
+            self.requeue_document(source_path)
+            self.queue_size_changed()
+
+    def error_received(self, path, error_message):
+        path, error_message = str(path), str(error_message)
+        self.log('Error processing {0:s}:'.format(path), bold=True, colour='red')
+        self.log('Error phrase matched: <b>{0:s}</b>'.format(error_message), indent=True)
+        self.job_failed(path, error_message)
+
+    def job_failed(self, path, error_message):
+        """
+        Retry a failed job after a delay, or quarantine it if it's used up its attempts.
+        """
+        # A retry lists a batched document's files again.
+        self.running_members.pop(path, None)
+        self.stale_documents.discard(path)
+        job = self.job_journal.job(path)
+        attempts, size = job if job else (1, None)
+        error_class, delay = self.retry_policy.decide(error_message, attempts)
+        if delay is not None:
+            # Try again later. Until then it's left failed in the journal, so a restart picks it up too.
+            self.job_journal.mark_failed(path, error_message)
+            self.retry_queue.add(path, size, delay)
+            self.schedule_retry()
+            tracer.step('job', path, 'retry wait', error=error_message, attempts=attempts)
+            self.log('Retrying in {0:.0f} s (attempt {1:d} of {2:d})'.format(
+                delay, attempts + 1, self.retry_policy.limit(error_class)), indent=True)
+        else:
+            self.button_save_errors.setVisible(True)
+            self.error_paths.append(path)
+            self.job_journal.mark_quarantined(path, error_message)
+            tracer.finish('job', path, error=error_message)
+            self.log('Quarantined after {0:d} attempt{1:s}'.format(attempts, 's' if attempts != 1 else ''),
+                     indent=True)
+            self.increment_processed()
+        if self.button_start.isChecked():
+            self.process_next()
+
+    def schedule_retry(self):
+        wait_time = self.retry_queue.wait_time()
+        if wait_time is not None:
+            self.retry_timer.start(int(wait_time * 1000) + 1)
+
+    def release_retries(self):
+        """
+        Queue the failed jobs whose retry time has come.
+        """
+        for path, size in self.retry_queue.pop_due():
+            if self.file_queue.append(path, size):
+                tracer.step('job', path, 'queued', retry=True)
+        self.schedule_retry()
+        self.update_processed_status()
+        if self.button_start.isChecked():
+            self.process_next()
+
+    def watch_folder_overflowed(self):
+        self.log('Too many changes in the watch folder to follow. Searching it for new files...')
+        self.file_watcher.request_rescan()
 
     def file_watcher_error(self, error_message):
         self.log('WATCH FOLDER ERROR:', colour='red', bold=True)
@@ -354,7 +629,13 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
         self.processed_count = 0
         self.skipped_count = 0
-        self.file_queue = deque()
+        self.progress_value = 0
+        self.file_queue = WorkQueue()
+        self.retry_queue.clear()
+        self.retry_timer.stop()
+        self.batch_timer.stop()
+        self.batch_settle = None
+        self.stale_documents.clear()
         self.update_processed_status()
 
     @pyqtSignature('')
@@ -382,9 +663,11 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         if not pressed:
             print 'Released!', pressed
             self.progress_bar.setVisible(False)
+            self.update_processed_status()
             self.statusbar.update_left('Ready to begin')
-            if self.current_pathname is None:
+            if not self.abbyy_pool.busy_count:
                 self.acrobat_proxy_listener.stop()
+                self.abbyy_pool.kill()
             return
 
         self.set_inputs_enabled(False)
@@ -393,6 +676,13 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.output_folder = str(self.le_output_folder.text())
         print "Output folder:", self.output_folder
 
+        # Index what's already in the output folder in the background so skip checks don't hit the disk. It's built
+        # again on every start, as outputs may have been deleted or added outside the application since the last one.
+        if self.output_index:
+            self.output_index.stop()
+        self.output_index = OutputIndex(self.output_folder, self.settings.scan_workers)
+        self.output_index.start()
+
         watch_folder = str(self.le_watch_folder.text())
         print watch_folder
         if not os.path.isdir(watch_folder):
@@ -405,18 +695,20 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
         # Set profile.
         if self.cb_profile.currentIndex():
-            self.abbyy_ocr.current_profile = str(self.cb_profile.itemData(self.cb_profile.currentIndex()).toString())
+            self.abbyy_pool.current_profile = str(self.cb_profile.itemData(self.cb_profile.currentIndex()).toString())
         else:
-            self.abbyy_ocr.current_profile = None
-        print 'Current profile:', self.abbyy_ocr.current_profile
+            self.abbyy_pool.current_profile = None
+        print 'Current profile:', self.abbyy_pool.current_profile
 
-        print self.install_acrobat_proxy()
+        if self.engine.needs_acrobat_proxy:
+            print self.install_acrobat_proxy()
         # return
 
         self.current_watch_path = watch_folder
         self.log('Searching for files in <b>{0:s}</b>...'.format(watch_folder), status_bar=True)
         self.progress_bar.setVisible(True)
-        self.progress_bar.setRange(0, 0)
+        self.progress_value = 0
+        self.update_processed_status()
 
         if not self.acrobat_proxy_listener.start():
             message_box_error('Error starting Acrobat Proxy Listener',
@@ -426,8 +718,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             self.reset()
             return
 
-        # if not hasattr(self, 'file_watcher_thread'):
-            # Get extension from radio buttons.
+        # Get extension from radio buttons.
         if self.rb_tiff.isChecked():
             extension = ('.tiff', '.tif')
         elif self.rb_pdf.isChecked():
@@ -437,24 +728,54 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         else:
             raise Exception('No extension selected')
 
+        self.batcher = Batcher(self.settings.batch_mode, self.settings.batch_pattern, extension, watch_folder)
+        print 'Batching:', self.batcher.mode
+        self.batch_timer.stop()
+        self.batch_settle = SettleQueue(self.settings.settle_time, signature=self.batcher.signature)
+
+        # Pick up where the last run on these folders left off, without waiting for the watch folder to be searched.
+        has_journal = self.job_journal.open_run(watch_folder, self.output_folder)
+        quarantined = self.job_journal.counts().get(QUARANTINED, 0)
+        if quarantined:
+            self.log('Skipping <b>{0:,} quarantined files</b> that failed every attempt on earlier runs. Release them '
+                     'with utils/quarantine.py to try them again.'.format(quarantined))
+        if not self.file_queue and not self.abbyy_pool.busy_count:
+            # Failed jobs waiting for a retry are in the journal, so they're resumed now instead.
+            self.retry_queue.clear()
+            self.retry_timer.stop()
+            self.file_queue = make_work_queue(self.settings.schedule, watch_folder, self.settings.priorities)
+            print 'Scheduling:', self.settings.schedule
+            if has_journal:
+                resumed = self.job_journal.resume()
+                self.file_queue.extend(resumed)
+                if tracer.enabled:
+                    for path, size in resumed:
+                        tracer.step('job', path, 'queued', size=size, resumed=True)
+                self.log('Resuming <b>{0:,} files</b> queued in the job journal'.format(len(self.file_queue)))
+                self.update_processed_status()
+                self.process_next()
+
+        self.scan_new_count = 0
         self.file_watcher_thread = QThread()
         self.file_watcher_threads.append(self.file_watcher_thread)
-        self.file_watcher = FileWatcher(watch_folder, extension)
+        self.file_watcher = FileWatcher(watch_folder, extension, incremental=has_journal,
+                                        scan_workers=self.settings.scan_workers,
+                                        settle_time=self.settings.settle_time, run_id=self.job_journal.run_id)
         self.file_watcher.moveToThread(self.file_watcher_thread)
         self.file_watcher_thread.started.connect(self.file_watcher.start)
         self.file_watcher_thread.finished.connect(self.file_watcher_thread.deleteLater)
         self.file_watcher.finished.connect(self.file_watcher_thread.quit)
         self.file_watcher.count_change.connect(self.queue_size_changed)
-        self.file_watcher.first_queue.connect(self.queue_received)
+        self.file_watcher.queue_batch.connect(self.queue_received)
+        self.file_watcher.scan_finished.connect(self.scan_finished)
         self.file_watcher.queue_change.connect(self.watch_folder_changed)
         self.file_watcher.error.connect(self.file_watcher_error)
+        self.file_watcher.overflowed.connect(self.watch_folder_overflowed)
 
         if not self.file_watcher_thread.isRunning():
             self.file_watcher_thread.start()
         else:
             if self.file_queue:
-                self.adjust_progress_bars()
-                self.progress_bar.setValue(0)
                 self.update_processed_status()
                 self.process_next()
 
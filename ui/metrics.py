@@ -0,0 +1,252 @@
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from bisect import bisect_left
+from contextlib import contextmanager
+import json
+import os
+import sys
+import threading
+import time
+
+__author__ = 'Gary Hughes'
+
+PREFIX = 'abbyy_automator'
+
+# Upper bounds in seconds. Jobs run from well under a second (proxy delivery) to minutes (OCR of a long document).
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+STAGES = {
+    'spawn': 'Starting an engine instance.',
+    'temp_folder': 'From starting an instance until its temp folder is found.',
+    'dialog_poll': 'One check of an instance for progress and error dialogs.',
+    'ocr': 'From sending a job to an instance until its PDF is delivered.',
+    'delivery': 'From the proxy connecting until its path is acknowledged.',
+    'path_received': 'Handling a delivered path in the main window.',
+    'move': 'Moving a PDF into the output folder.',
+    'kill': 'Killing an instance and stopping its watcher.',
+    'cleanup': 'Waiting for a killed instance to exit and removing its temp files.',
+}
+
+
+def _monotonic_clock():
+    """
+    A clock that never goes backwards, for timing stages. time.time() can jump when the system clock is set.
+    """
+    if sys.platform == 'win32':
+        # QueryPerformanceCounter, counted from the first call.
+        return time.clock
+    try:
+        import ctypes
+        import ctypes.util
+
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        librt = ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c'), use_errno=True)
+        clock_gettime = librt.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        clock_monotonic = 1
+        value = timespec()
+
+        def monotonic():
+            if clock_gettime(clock_monotonic, ctypes.byref(value)):
+                return time.time()
+            return value.tv_sec + value.tv_nsec * 1e-9
+        monotonic()
+        return monotonic
+    except (ImportError, OSError, AttributeError, TypeError):
+        return time.time
+
+
+monotonic = _monotonic_clock()
+
+
+class Histogram(object):
+    """
+    Counts of observed durations by bucket, along with their sum, as for a Prometheus histogram. Safe to use from any
+    thread.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        """
+        (cumulative counts per bucket including +Inf, sum, count).
+        """
+        with self.lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        cumulative = []
+        running = 0
+        for bucket_count in counts:
+            running += bucket_count
+            cumulative.append(running)
+        return cumulative, total, count
+
+
+class Metrics(object):
+    """
+    Timings for each stage of a job, kept in one histogram per stage (see STAGES), plus event counters.
+
+    Stages are timed with the monotonic clock:
+
+        start = monotonic()
+        ...
+        metrics.observe('spawn', monotonic() - start)
+
+    or with metrics.time('spawn'). Optionally the metrics are served in Prometheus text format on a local port
+    (serve()), and written as JSON to a file every flush_interval seconds (flush_to()).
+    """
+
+    def __init__(self):
+        self.histograms = dict((stage, Histogram()) for stage in STAGES)
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.server = None
+        self.flush_path = None
+        self.flush_interval = 60
+        self.flush_thread = None
+        self.stopping = threading.Event()
+
+    def observe(self, stage, seconds):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(stage, Histogram())
+        histogram.observe(seconds)
+
+    @contextmanager
+    def time(self, stage):
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.observe(stage, monotonic() - start)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def snapshot(self):
+        stages = {}
+        for stage, histogram in self.histograms.items():
+            cumulative, total, count = histogram.snapshot()
+            stages[stage] = {
+                'count': count,
+                'sum': total,
+                'buckets': dict(zip([str(bucket) for bucket in histogram.buckets] + ['+Inf'], cumulative)),
+            }
+        with self.lock:
+            counters = dict(self.counters)
+        return {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'stages': stages, 'counters': counters}
+
+    def prometheus(self):
+        """
+        The metrics in the Prometheus text exposition format.
+        """
+        name = PREFIX + '_stage_seconds'
+        lines = ['# HELP {0:s} Time spent in each stage of a job.'.format(name),
+                 '# TYPE {0:s} histogram'.format(name)]
+        for stage in sorted(self.histograms):
+            histogram = self.histograms[stage]
+            cumulative, total, count = histogram.snapshot()
+            for bucket, bucket_count in zip(histogram.buckets, cumulative):
+                lines.append('{0:s}_bucket{{stage="{1:s}",le="{2:g}"}} {3:d}'.format(name, stage, bucket,
+                                                                                    bucket_count))
+            lines.append('{0:s}_bucket{{stage="{1:s}",le="+Inf"}} {2:d}'.format(name, stage, cumulative[-1]))
+            lines.append('{0:s}_sum{{stage="{1:s}"}} {2:.6f}'.format(name, stage, total))
+            lines.append('{0:s}_count{{stage="{1:s}"}} {2:d}'.format(name, stage, count))
+        with self.lock:
+            counters = sorted(self.counters.items())
+        for counter, value in counters:
+            counter_name = '{0:s}_{1:s}_total'.format(PREFIX, counter)
+            lines.append('# TYPE {0:s} counter'.format(counter_name))
+            lines.append('{0:s} {1:d}'.format(counter_name, value))
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        """
+        Serve /metrics on a background thread. Returns False if the port couldn't be opened.
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            self.server = HTTPServer((host, port), Handler)
+        except EnvironmentError, e:
+            print 'Could not serve metrics on port {0:d}: {1:s}'.format(port, str(e))
+            return False
+        thread = threading.Thread(target=self.server.serve_forever, name='MetricsServer')
+        thread.daemon = True
+        thread.start()
+        print 'Serving metrics on http://{0:s}:{1:d}/metrics'.format(host, port)
+        return True
+
+    def flush_to(self, path, interval=60):
+        """
+        Write the metrics to path as JSON every interval seconds, and once more on stop().
+        """
+        self.flush_path = path
+        self.flush_interval = interval
+        self.stopping.clear()
+        self.flush_thread = threading.Thread(target=self.run_flush, name='MetricsFlush')
+        self.flush_thread.daemon = True
+        self.flush_thread.start()
+
+    def run_flush(self):
+        while not self.stopping.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        if not self.flush_path:
+            return
+        part_path = self.flush_path + '.part'
+        try:
+            with open(part_path, 'w') as flush_file:
+                json.dump(self.snapshot(), flush_file, indent=2, sort_keys=True)
+            if os.path.exists(self.flush_path):
+                # os.rename won't replace a file on Windows.
+                os.remove(self.flush_path)
+            os.rename(part_path, self.flush_path)
+        except EnvironmentError, e:
+            print 'Could not write metrics to {0:s}: {1:s}'.format(self.flush_path, str(e))
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if self.flush_thread:
+            self.stopping.set()
+            self.flush_thread.join()
+            self.flush_thread = None
+            self.flush()
+
+
+metrics = Metrics()
@@ -0,0 +1,74 @@
+import os
+import threading
+
+from ui.scanner import ParallelScanner, list_directory
+
+__author__ = 'Gary Hughes'
+
+
+class OutputIndex(object):
+    """
+    In-memory set of the PDFs already in the output folder, so deciding whether to skip an input is a set lookup
+    rather than a stat call against the output share.
+
+    The output tree is walked once on a background thread. Until that finishes, paths not yet in the index are checked
+    on disk as before. Outputs written while running are added with add(), and outputs that are to be written again are
+    taken out with discard().
+    """
+
+    def __init__(self, output_folder, workers=8):
+        self.output_folder = os.path.normpath(output_folder)
+        self.workers = workers
+        self.paths = set()
+        self.discarded = set()  # Keys discarded while running, which the walk may still find on disk.
+        self.ready = threading.Event()
+        self.stopping = False
+        self.thread = None
+
+    def key(self, path):
+        return os.path.normcase(os.path.relpath(os.path.normpath(path), self.output_folder))
+
+    def start(self):
+        self.thread = threading.Thread(target=self.build, name='OutputIndex')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopping = True
+
+    def build(self):
+        def process(dir_path):
+            try:
+                subdirs, files = list_directory(dir_path, '.pdf')
+            except OSError:
+                return [], []
+            return [os.path.join(dir_path, name) for name in subdirs], files
+
+        print 'Indexing output folder', self.output_folder
+        for dir_path, files in ParallelScanner(self.workers).walk(self.output_folder, process):
+            if self.stopping:
+                return
+            for name, size, mtime in files:
+                self.paths.add(self.key(os.path.join(dir_path, name)))
+        self.ready.set()
+        print 'Output folder indexed: {0:,} files'.format(len(self.paths))
+
+    def add(self, path):
+        key = self.key(path)
+        self.paths.add(key)
+        self.discarded.discard(key)
+
+    def discard(self, path):
+        key = self.key(path)
+        self.paths.discard(key)
+        self.discarded.add(key)
+
+    def exists(self, path):
+        key = self.key(path)
+        if key in self.discarded:
+            return False
+        if key in self.paths:
+            return True
+        if self.ready.is_set():
+            return False
+        return os.path.isfile(path)
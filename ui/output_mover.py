@@ -0,0 +1,187 @@
+import errno
+import os
+import Queue
+import shutil
+import threading
+
+from PyQt4.QtCore import QObject, pyqtSignal
+
+from ui.metrics import metrics, monotonic
+
+try:
+    import pywintypes
+    import win32file
+    move_errors = (IOError, OSError, pywintypes.error)
+except ImportError:
+    win32file = None
+    move_errors = (IOError, OSError)
+
+__author__ = 'Gary Hughes'
+
+
+def replace(path, out_path):
+    """
+    Rename path to out_path, replacing out_path if it already exists.
+    """
+    if win32file:
+        win32file.MoveFileEx(path, out_path, win32file.MOVEFILE_REPLACE_EXISTING)
+    else:
+        os.rename(path, out_path)
+
+
+def same_volume(path, folder):
+    """
+    Best guess at whether path can be renamed into folder rather than copied.
+    """
+    try:
+        path_device = os.stat(path).st_dev
+        folder_device = os.stat(folder).st_dev
+    except OSError:
+        return False
+    if path_device or folder_device:
+        return path_device == folder_device
+    # Windows doesn't give a device number, so compare drives (or \\server\share for UNC paths).
+    return (os.path.normcase(os.path.splitdrive(os.path.abspath(path))[0]) ==
+            os.path.normcase(os.path.splitdrive(os.path.abspath(folder))[0]))
+
+
+class OutputMover(QObject):
+    """
+    Moves finished PDFs into the output folder on a small pool of background threads, so a slow output share doesn't
+    freeze the UI or hold up the next job.
+
+    A PDF on the same volume as its output folder is renamed into place. Otherwise it's copied in buffer_size chunks
+    to a .part file next to the output and then renamed, so a half-copied PDF never appears under its real name.
+    Output folders already known to exist aren't checked again.
+
+    queue_depth, throughput (bytes per second while copying) and renamed (PDFs moved by renaming, which take no time
+    worth measuring) can be read from any thread. If an output folder disappears while running, a move into it makes it
+    again and has one more try.
+    """
+
+    # Signals
+    moved = pyqtSignal(str, str, str, str)  # Input path, PDF path, output path, error message ('' if it worked).
+
+    def __init__(self, workers=2, buffer_size=4 * 1024 * 1024, parent=None):
+        super(OutputMover, self).__init__(parent)
+        self.workers = max(1, workers)
+        self.buffer_size = buffer_size
+        self.queue = Queue.Queue()
+        self.threads = []
+        self.known_folders = set()
+        self.lock = threading.Lock()
+        self.in_progress = 0
+        self.bytes_copied = 0
+        self.copy_time = 0.0
+        self.renamed = 0
+
+    @property
+    def queue_depth(self):
+        """
+        Number of moves waiting or under way.
+        """
+        return self.queue.qsize() + self.in_progress
+
+    @property
+    def throughput(self):
+        return self.bytes_copied / self.copy_time if self.copy_time else 0.0
+
+    def start(self):
+        while len(self.threads) < self.workers:
+            thread = threading.Thread(target=self.run, name='OutputMover')
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        """
+        Finish any moves already requested, then stop the threads.
+        """
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def request(self, source_path, path, out_path):
+        self.queue.put((source_path, path, out_path))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            source_path, path, out_path = item
+            with self.lock:
+                self.in_progress += 1
+            start = monotonic()
+            size = 0
+            copied = False
+            error_message = ''
+            try:
+                size, copied = self.move(path, out_path)
+            except move_errors, e:
+                error_message = str(e)
+            elapsed = monotonic() - start
+            metrics.observe('move', elapsed)
+            with self.lock:
+                self.in_progress -= 1
+                if copied:
+                    self.bytes_copied += size
+                    self.copy_time += elapsed
+                elif not error_message:
+                    self.renamed += 1
+            print 'Moved {0:s} ({1:,} bytes) in {2:.3f} s'.format(out_path, size, elapsed)
+            self.moved.emit(source_path, path, out_path, error_message)
+
+    def make_folder(self, folder):
+        if folder in self.known_folders:
+            return
+        try:
+            os.makedirs(folder)
+        except OSError, e:
+            # Another thread may have just made it.
+            if e.errno != errno.EEXIST or not os.path.isdir(folder):
+                raise
+        self.known_folders.add(folder)
+
+    def move(self, path, out_path):
+        """
+        Move path to out_path. Returns its size and whether it had to be copied.
+        """
+        out_folder = os.path.dirname(out_path)
+        try:
+            return self.move_once(path, out_path)
+        except move_errors:
+            if out_folder not in self.known_folders or os.path.isdir(out_folder) or not os.path.exists(path):
+                raise
+            # The output folder has been deleted since it was made. Make it again and have another go.
+            self.known_folders.discard(out_folder)
+            return self.move_once(path, out_path)
+
+    def move_once(self, path, out_path):
+        out_folder = os.path.dirname(out_path)
+        self.make_folder(out_folder)
+        size = os.path.getsize(path)
+        if same_volume(path, out_folder):
+            try:
+                replace(path, out_path)
+                return size, False
+            except move_errors:
+                # Not the same volume after all.
+                pass
+        part_path = out_path + '.part'
+        try:
+            with open(path, 'rb') as source_file:
+                with open(part_path, 'wb') as out_file:
+                    shutil.copyfileobj(source_file, out_file, self.buffer_size)
+            shutil.copystat(path, part_path)
+            replace(part_path, out_path)
+        except:
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
+            raise
+        os.remove(path)
+        return size, True
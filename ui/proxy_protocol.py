@@ -0,0 +1,251 @@
+"""
+Protocol between the Acrobat proxy (or anything standing in for it) and the AcrobatProxyListener in ABBYY Automator.
+
+Every message is a frame: a 4 byte big-endian length followed by that many bytes of payload. The proxy sends
+
+    DELIVER\\n<request ID>\\n<job ID>\\n<PDF path>
+
+and the listener answers with ACK\\n<request ID> once the path has been handed on, or NAK\\n<request ID>\\n<reason>. A
+proxy that doesn't get an ACK reconnects and sends the same request again. The listener remembers recent request IDs
+and acknowledges repeats without passing them on a second time, so a retried delivery is never processed twice.
+
+Any number of proxies can be connected at once, and a connection can carry more than one request.
+
+Proxies from before this protocol send "<job ID>\\n<path>" unframed and disconnect. They're recognised by the first
+byte, which can't be a printable character in a frame, and still accepted.
+"""
+from collections import deque
+import errno
+import os
+import struct
+import sys
+import time
+
+__author__ = 'Gary Hughes'
+
+LISTENER_NAME = 'Acrobat-Proxy-Listener'
+
+# Environment variable ABBYY Automator sets on each FineReader process, and the Acrobat proxy inherits from it, so a
+# delivered PDF can be matched back to the job that produced it.
+JOB_ENVIRONMENT_KEY = 'ABBYY_AUTOMATOR_JOB'
+
+HEADER = struct.Struct('>I')
+MAX_FRAME = 64 * 1024
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class ListenerNotFound(ProtocolError):
+    """
+    Nothing is listening at the address, so there's no point retrying.
+    """
+
+
+def encode_frame(payload):
+    return HEADER.pack(len(payload)) + payload
+
+
+def delivery(request_id, job_id, path):
+    return encode_frame('DELIVER\n{0:s}\n{1:s}\n{2:s}'.format(request_id, job_id, path))
+
+
+def new_request_id():
+    # Not uuid, which loads ctypes on import and adds noticeably to the proxy's start-up time.
+    return os.urandom(16).encode('hex')
+
+
+class FrameDecoder(object):
+    """
+    Splits the bytes read from a connection into frames, however they were broken up on the way.
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.legacy = None
+
+    def feed(self, data):
+        """
+        Add data read from the connection. Returns the payloads of any frames it completed.
+        """
+        self.buffer += data
+        if self.legacy is None and self.buffer:
+            # Lengths are under MAX_FRAME, so a frame always starts with a zero byte.
+            self.legacy = self.buffer[0] != '\0'
+        if self.legacy:
+            return []
+        frames = []
+        while len(self.buffer) >= HEADER.size:
+            length, = HEADER.unpack_from(self.buffer)
+            if length > MAX_FRAME:
+                raise ProtocolError('Frame of {0:d} bytes is too long'.format(length))
+            end = HEADER.size + length
+            if len(self.buffer) < end:
+                break
+            frames.append(self.buffer[HEADER.size:end])
+            self.buffer = self.buffer[end:]
+        return frames
+
+
+class DeliveryHandler(object):
+    """
+    The listener's side of the protocol, without the sockets. handle() takes a payload and returns the response frame
+    along with the (job ID, path) to process, or None if there's nothing new.
+    """
+
+    def __init__(self, remember=10000):
+        self.seen = set()
+        self.seen_order = deque()
+        self.remember = remember
+
+    def handle(self, payload):
+        parts = payload.split('\n', 3)
+        if parts[0] != 'DELIVER' or len(parts) != 4:
+            return encode_frame('NAK\n\nUnknown request'), None
+        request_id, job_id, path = parts[1:]
+        response = encode_frame('ACK\n{0:s}'.format(request_id))
+        if request_id in self.seen:
+            print 'Repeat delivery', request_id, 'acknowledged again'
+            return response, None
+        self.seen.add(request_id)
+        self.seen_order.append(request_id)
+        if len(self.seen_order) > self.remember:
+            self.seen.discard(self.seen_order.popleft())
+        return response, (job_id, path)
+
+    @staticmethod
+    def handle_legacy(data):
+        job_id, _, path = data.rpartition('\n')
+        return job_id, path
+
+
+def listener_address(name=LISTENER_NAME):
+    """
+    Where QLocalServer listens: a named pipe on Windows, a Unix socket in the temp folder elsewhere.
+    """
+    if sys.platform == 'win32':
+        return r'\\.\pipe\{0:s}'.format(name)
+    return os.path.join(os.environ.get('TMPDIR', '/tmp'), name)
+
+
+class Connection(object):
+    """
+    Blocking client connection to the listener using only the standard library. On Windows the named pipe is opened as
+    a file, so the socket module (and the SSL libraries it loads) is only imported elsewhere.
+
+    Connecting and every read give up after timeout seconds, so a busy or stuck listener can't hold up FineReader,
+    which waits for the proxy. A file has no timeout of its own, so on Windows opening the pipe is retried until the
+    deadline (as WaitNamedPipe would) and reads are done on a helper thread that's abandoned if it takes too long.
+    """
+
+    pipe_retry_delay = 0.05
+
+    def __init__(self, name=LISTENER_NAME, timeout=5.0):
+        self.decoder = FrameDecoder()
+        self.timeout = timeout
+        self.reader = None
+        if sys.platform == 'win32':
+            self.sock = None
+            self.pipe = self.open_pipe(listener_address(name), time.time() + timeout)
+        else:
+            import socket
+            self.pipe = None
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(timeout)
+            try:
+                self.sock.connect(listener_address(name))
+            except socket.error, e:
+                self.sock.close()
+                if e.errno in (errno.ENOENT, errno.ECONNREFUSED):
+                    raise ListenerNotFound('No listener at {0:s}'.format(listener_address(name)))
+                raise
+
+    def open_pipe(self, address, deadline):
+        while True:
+            try:
+                return open(address, 'r+b', 0)
+            except IOError, e:
+                if e.errno == errno.ENOENT:
+                    raise ListenerNotFound('No listener at {0:s}'.format(address))
+                # Every instance of the pipe is busy.
+                if time.time() >= deadline:
+                    raise
+                time.sleep(self.pipe_retry_delay)
+
+    def read_pipe(self):
+        import threading
+        result = []
+
+        def read():
+            try:
+                result.append(os.read(self.pipe.fileno(), 4096))
+            except (IOError, OSError), e:
+                result.append(e)
+
+        self.reader = threading.Thread(target=read)
+        self.reader.daemon = True
+        self.reader.start()
+        self.reader.join(self.timeout)
+        if self.reader.is_alive():
+            raise ProtocolError('No response from the listener in {0:.0f} seconds'.format(self.timeout))
+        self.reader = None
+        if isinstance(result[0], EnvironmentError):
+            raise result[0]
+        return result[0]
+
+    def send(self, data):
+        if self.sock:
+            self.sock.sendall(data)
+        else:
+            self.pipe.write(data)
+
+    def receive(self):
+        """
+        Wait for the next frame and return its payload.
+        """
+        while True:
+            data = self.sock.recv(4096) if self.sock else self.read_pipe()
+            if not data:
+                raise ProtocolError('Connection closed by the listener')
+            frames = self.decoder.feed(data)
+            if frames:
+                # One request at a time is outstanding, so there's only ever one response.
+                return frames[0]
+
+    def deliver(self, request_id, job_id, path):
+        self.send(delivery(request_id, job_id, path))
+        response = self.receive().split('\n', 2)
+        if response[0] == 'ACK' and response[1] == request_id:
+            return True
+        raise ProtocolError('Delivery refused: {0:s}'.format(' '.join(response[1:])))
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+        elif not self.reader:
+            # With a read still waiting on another thread, closing the pipe could block as well. It's left to be closed
+            # when the process exits.
+            self.pipe.close()
+
+
+def deliver(job_id, path, name=LISTENER_NAME, retries=5, timeout=5.0, retry_delay=0.2):
+    """
+    Send a PDF path to the listener and wait for it to be acknowledged, reconnecting and retrying with the same request
+    ID if anything goes wrong. Raises the last error if every attempt fails, or ListenerNotFound straight away if
+    nothing is listening.
+    """
+    request_id = new_request_id()
+    for attempt in xrange(retries):
+        try:
+            connection = Connection(name, timeout)
+            try:
+                return connection.deliver(request_id, job_id, path)
+            finally:
+                connection.close()
+        except ListenerNotFound:
+            raise
+        except (IOError, OSError, ProtocolError):
+            if attempt == retries - 1:
+                raise
+            time.sleep(retry_delay * (attempt + 1))
@@ -0,0 +1,179 @@
+import glob
+import os
+import Queue
+import stat
+from shutil import rmtree
+import threading
+import time
+
+from ui.liveness import pid_alive
+from ui.metrics import metrics, monotonic
+from ui.tracing import tracer
+from ui.temp_folders import temp_folder_index
+
+__author__ = 'Gary Hughes'
+
+
+def folder_size(path):
+    """
+    Total size in bytes of the files under path.
+    """
+    total = 0
+    for dir_path, dir_names, file_names in os.walk(path):
+        for name in file_names:
+            try:
+                total += os.path.getsize(os.path.join(dir_path, name))
+            except OSError:
+                pass
+    return total
+
+
+class TempReaper(object):
+    """
+    Removes FineReader's temp files on a background thread.
+
+    Killed instances are handed over with reap(). The reaper waits for the process to exit and then removes its temp
+    folder and any loose *.tmp files. The queue is bounded: if it's full, the instance is left for the next purge
+    rather than holding up the caller.
+
+    When it starts, and every purge_interval seconds after, the reaper also purges orphaned Untitled.FR10* folders.
+    These are folders whose PID is no longer running, or that have no readable PID and haven't changed for
+    orphan_age seconds. They are left behind when FineReader or this application crashes. The bytes reclaimed and the
+    time taken are printed and added to the running totals.
+    """
+
+    purge_interval = 600
+    orphan_age = 3600
+
+    def __init__(self, base_folder=None, index=temp_folder_index, max_queued=64):
+        self.base_folder = base_folder or index.base_folder
+        self.index = index
+        self.queue = Queue.Queue(max_queued)
+        self.thread = None
+        self.reclaimed_bytes = 0
+        self.reclaim_time = 0.0
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.thread = threading.Thread(target=self.run, name='TempReaper')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Finish the instances already queued, then stop the thread.
+        """
+        if not self.thread:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def reap(self, proc, abbyy_temp_path=None):
+        """
+        Clean up after a killed FineReader process. Returns False if the queue was full.
+        """
+        try:
+            self.queue.put_nowait((proc, abbyy_temp_path))
+        except Queue.Full:
+            print 'Reaper queue full. FineReader {0:d} will be cleaned up by the next purge.'.format(proc.pid)
+            return False
+        return True
+
+    def run(self):
+        self.purge_orphans()
+        next_purge = time.time() + self.purge_interval
+        while True:
+            try:
+                item = self.queue.get(timeout=max(0, next_purge - time.time()))
+            except Queue.Empty:
+                self.purge_orphans()
+                next_purge = time.time() + self.purge_interval
+                continue
+            if item is None:
+                return
+            self.clean_up(*item)
+
+    def clean_up(self, proc, abbyy_temp_path=None):
+        start = monotonic()
+        proc.wait()
+        if not abbyy_temp_path:
+            abbyy_temp_path = self.index.lookup(proc.pid)
+        reclaimed = 0
+        if abbyy_temp_path:
+            reclaimed += self.remove_folder(abbyy_temp_path)
+        self.index.forget(proc.pid)
+        reclaimed += self.remove_tmp_files()
+        elapsed = monotonic() - start
+        metrics.observe('cleanup', elapsed)
+        tracer.finish('instance', proc.pid, reclaimed=reclaimed)
+        self.report('FineReader {0:d}'.format(proc.pid), reclaimed, elapsed)
+
+    def purge_orphans(self):
+        start = time.time()
+        with self.index.lock:
+            self.index.refresh()
+            folder_pids = {}
+            for pid, folder in self.index.pids.iteritems():
+                folder_pids.setdefault(folder, []).append(pid)
+        try:
+            names = os.listdir(self.base_folder)
+        except OSError:
+            return
+        reclaimed = 0
+        removed = 0
+        for name in names:
+            if not name.lower().startswith('untitled.fr10'):
+                continue
+            folder = os.path.join(self.base_folder, name)
+            pids = folder_pids.get(folder)
+            if pids:
+                if any(pid_alive(pid) for pid in pids):
+                    continue
+            else:
+                # FineReader may not have written its .loc file yet, so only purge these once they're old.
+                try:
+                    if time.time() - os.stat(folder).st_mtime < self.orphan_age:
+                        continue
+                except OSError:
+                    continue
+            reclaimed += self.remove_folder(folder)
+            removed += 1
+            for pid in pids or ():
+                self.index.forget(pid)
+        reclaimed += self.remove_tmp_files()
+        self.report('{0:d} orphaned temp folders'.format(removed), reclaimed, time.time() - start)
+
+    @staticmethod
+    def remove_folder(path):
+        print 'Removing', path
+        size = folder_size(path)
+        try:
+            os.chmod(path, stat.S_IWRITE)
+            rmtree(path)
+        except (OSError, IOError):
+            # Some of it may still be in use. Count whatever has gone.
+            size -= folder_size(path)
+        return size
+
+    def remove_tmp_files(self):
+        # Other instances may still hold their own .tmp files open, so remove what we can one at a time.
+        reclaimed = 0
+        for tmp_path in glob.glob(os.path.join(self.base_folder, '*.tmp')):
+            try:
+                size = os.path.getsize(tmp_path)
+                os.remove(tmp_path)
+                reclaimed += size
+            except (OSError, IOError):
+                pass
+        return reclaimed
+
+    def report(self, what, reclaimed, elapsed):
+        self.reclaimed_bytes += reclaimed
+        self.reclaim_time += elapsed
+        print 'Reclaimed {0:,} bytes from {1:s} in {2:.3f} s ({3:,} bytes in {4:.1f} s in total)'.format(
+            reclaimed, what, elapsed, self.reclaimed_bytes, self.reclaim_time)
+
+
+temp_reaper = TempReaper()
@@ -0,0 +1,120 @@
+import heapq
+import random
+import time
+
+__author__ = 'Gary Hughes'
+
+# Error classes, matched in order against the start of each error message. Anything else is 'other'.
+ERROR_CLASSES = (
+    ('licence', ('Some licenses cannot be used',)),
+    ('pages', ('Some of the pages have not been',)),
+    ('process', ('Process failed',)),
+    ('crash', ('Abbyy exited before',)),
+    ('hang', ('Abbyy made no progress',)),
+    ('batch', ('Too many files',)),
+    ('move', ('Move failed',)),
+)
+
+# Attempts allowed in total for each class (including the first) and the delay in seconds before the first retry.
+# Licence contention, crashes and an unreachable output share usually clear up on their own; a file that FineReader
+# rejects outright or that's too big for one batch will fail the same way every time.
+DEFAULT_LIMITS = {'licence': 6, 'crash': 3, 'hang': 2, 'process': 2, 'pages': 1, 'batch': 1, 'move': 3, 'other': 2}
+DEFAULT_DELAYS = {'licence': 60.0, 'crash': 5.0, 'hang': 30.0, 'process': 10.0, 'move': 10.0, 'other': 10.0}
+
+
+def classify(error_message):
+    for error_class, prefixes in ERROR_CLASSES:
+        if any(error_message.startswith(prefix) for prefix in prefixes):
+            return error_class
+    return 'other'
+
+
+class RetryPolicy(object):
+    """
+    Decides whether a failed job is tried again, and when.
+
+    Each error class has its own limit on attempts. Retries are delayed by the class's base delay, doubled for every
+    attempt already made, up to max_delay, and spread by +/- jitter so jobs that failed together don't all come back
+    together. A job that has used up its attempts is quarantined.
+    """
+
+    def __init__(self, limits=None, delays=None, max_delay=3600.0, jitter=0.25):
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update(limits or {})
+        self.delays = dict(DEFAULT_DELAYS)
+        self.delays.update(delays or {})
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def limit(self, error_class):
+        return self.limits.get(error_class, self.limits['other'])
+
+    def delay(self, error_class, attempts):
+        base = self.delays.get(error_class, self.delays['other'])
+        delay = min(self.max_delay, base * 2 ** max(0, attempts - 1))
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def decide(self, error_message, attempts):
+        """
+        (error class, seconds to wait before retrying) after a job's attempts-th attempt failed, with None for the
+        wait if the job should be quarantined.
+        """
+        error_class = classify(error_message)
+        if attempts >= self.limit(error_class):
+            return error_class, None
+        return error_class, self.delay(error_class, attempts)
+
+
+class RetryQueue(object):
+    """
+    Failed jobs waiting for their retry time, in a heap ordered by due time.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.pending = {}  # Path: due time.
+
+    def __len__(self):
+        return len(self.pending)
+
+    def __contains__(self, path):
+        return path in self.pending
+
+    def add(self, path, size, delay, now=None):
+        due = (time.time() if now is None else now) + delay
+        self.pending[path] = due
+        heapq.heappush(self.heap, (due, path, size))
+
+    def discard(self, path):
+        return self.pending.pop(path, None) is not None
+
+    def clear(self):
+        self.heap = []
+        self.pending.clear()
+
+    def wait_time(self, now=None):
+        """
+        Seconds until the next retry is due, or None if nothing is waiting.
+        """
+        if now is None:
+            now = time.time()
+        while self.heap:
+            due, path, size = self.heap[0]
+            if self.pending.get(path) == due:
+                return max(0.0, due - now)
+            heapq.heappop(self.heap)
+        return None
+
+    def pop_due(self, now=None):
+        """
+        (path, size) for every retry that's due, in the order they became due.
+        """
+        if now is None:
+            now = time.time()
+        due_entries = []
+        while self.heap and self.heap[0][0] <= now:
+            due, path, size = heapq.heappop(self.heap)
+            if self.pending.get(path) == due:
+                del self.pending[path]
+                due_entries.append((path, size))
+        return due_entries
@@ -0,0 +1,138 @@
+import marshal
+import os
+import sqlite3
+import time
+
+from ui.scanner import ParallelScanner, list_directory
+
+__author__ = 'Gary Hughes'
+
+
+class ScanManifest(object):
+    """
+    Persisted record of the watch folder tree so that a cold start only has to list directories that have changed.
+
+    Each directory is stored with its mtime, the names of its subdirectories and the (size, mtime) of every matching
+    file in it. A directory whose mtime hasn't changed since the last scan is not listed again; its subdirectories are
+    taken from the manifest and only they are checked. Files added, removed or renamed in a directory change its mtime,
+    but a file rewritten in place does not, so such a file won't be picked up until its directory changes.
+
+    Snapshots are kept per job journal run (watch folder and output folder pair) as well as per root and extension, so
+    an incremental scan always compares against what the same run saw last. With one snapshot per watch folder, a run
+    on another output folder would overwrite it, and files added before switching back would never be reported.
+    """
+
+    def __init__(self, db_path='journal.sqlite'):
+        self.connection = sqlite3.connect(db_path)
+        self.connection.text_factory = str
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS scan_dirs (
+                root TEXT NOT NULL,
+                path TEXT NOT NULL,
+                mtime REAL NOT NULL,
+                subdirs BLOB NOT NULL,
+                files BLOB NOT NULL,
+                PRIMARY KEY (root, path)
+            )
+        ''')
+        self.connection.commit()
+
+    @staticmethod
+    def root_key(root, extension, run_id=None):
+        if not isinstance(extension, basestring):
+            extension = ','.join(extension)
+        key = '{0:s}|{1:s}'.format(os.path.normcase(os.path.normpath(root)), extension)
+        if run_id is not None:
+            key += '|{0:d}'.format(run_id)
+        return key
+
+    def load_files(self, key, path):
+        row = self.connection.execute('SELECT files FROM scan_dirs WHERE root = ? AND path = ?', (key, path)).fetchone()
+        return marshal.loads(str(row[0])) if row else {}
+
+    def scan(self, root, extension, full=False, progress=None, workers=8, on_batch=None, batch_size=500,
+             batch_interval=0.25, run_id=None):
+        """
+        Scan root for files ending with extension and update the manifest.
+
+        Returns a tuple of (new (path, size) entries, removed paths) compared with the last scan. If full is True every
+        directory is listed and every matching file is returned as new, while the manifest is still brought up to
+        date. progress, if given, is called with the number of new files found so far after each listed directory.
+        Directories are checked and listed by a pool of worker threads. run_id is the job journal run the scan is for.
+
+        If on_batch is given, new entries are passed to it while the scan runs instead of being returned: the first one
+        as soon as it's found, then in lists of up to batch_size entries, at least every batch_interval seconds.
+        """
+        key = self.root_key(root, extension, run_id)
+        root = os.path.normpath(root)
+        cursor = self.connection.execute('SELECT path, mtime, subdirs FROM scan_dirs WHERE root = ?', (key,))
+        known = dict((path, (mtime, marshal.loads(str(subdirs)))) for path, mtime, subdirs in cursor)
+
+        def process(dir_path):
+            # Runs on the scanner's threads, so mustn't touch the database.
+            try:
+                dir_mtime = os.stat(dir_path).st_mtime
+            except OSError:
+                return [], None
+            record = known.get(dir_path)
+            if record and record[0] == dir_mtime and not full:
+                # Unchanged since the last scan. Only its subdirectories need checking.
+                return [os.path.join(dir_path, name) for name in record[1]], (dir_mtime, None, None)
+            try:
+                subdirs, files = list_directory(dir_path, extension)
+            except OSError:
+                return [], (dir_mtime, None, None)
+            return [os.path.join(dir_path, name) for name in subdirs], (dir_mtime, subdirs, files)
+
+        new_entries = []
+        new_count = 0
+        last_batch = None
+        removed_paths = []
+        updates = []
+        seen = set()
+        for dir_path, result in ParallelScanner(workers).walk(root, process):
+            if result is None:
+                continue
+            seen.add(dir_path)
+            dir_mtime, subdirs, files = result
+            if subdirs is None:
+                continue
+
+            old_files = self.load_files(key, dir_path) if dir_path in known else {}
+            new_files = {}
+            for name, size, mtime in files:
+                new_files[name] = (size, mtime)
+                if full or old_files.get(name) != (size, mtime):
+                    new_entries.append((os.path.normpath(os.path.join(dir_path, name)), size))
+                    new_count += 1
+                    if on_batch and (last_batch is None or len(new_entries) >= batch_size or
+                                     time.time() - last_batch >= batch_interval):
+                        on_batch(new_entries)
+                        new_entries = []
+                        last_batch = time.time()
+            removed_paths += [os.path.normpath(os.path.join(dir_path, name)) for name in old_files
+                              if name not in new_files]
+            updates.append((key, dir_path, dir_mtime, sqlite3.Binary(marshal.dumps(subdirs)),
+                            sqlite3.Binary(marshal.dumps(new_files))))
+            if progress:
+                progress(new_count)
+
+        # Anything in the manifest that wasn't reached any more has been deleted.
+        gone = [path for path in known if path not in seen]
+        for path in gone:
+            removed_paths += [os.path.normpath(os.path.join(path, name)) for name in self.load_files(key, path)]
+
+        if on_batch and new_entries:
+            on_batch(new_entries)
+            new_entries = []
+
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO scan_dirs VALUES (?, ?, ?, ?, ?)', updates)
+            self.connection.executemany('DELETE FROM scan_dirs WHERE root = ? AND path = ?',
+                                        ((key, path) for path in gone))
+        return new_entries, removed_paths
+
+    def close(self):
+        self.connection.close()
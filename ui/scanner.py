@@ -0,0 +1,117 @@
+import os
+import Queue
+import stat
+import threading
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+__author__ = 'Gary Hughes'
+
+
+def list_directory(path, extension):
+    """
+    List a single directory. Returns a tuple of (subdirectory names, [(file name, size, mtime), ...]) for the files
+    ending with extension, in listing order.
+
+    Uses scandir where available, which on Windows gets the size and mtime from the directory listing itself rather
+    than needing a stat call (and a network round trip) per file.
+    """
+    subdirs = []
+    files = []
+    if scandir:
+        for entry in scandir(path):
+            try:
+                if entry.is_dir():
+                    subdirs.append(entry.name)
+                elif entry.name.lower().endswith(extension):
+                    st = entry.stat()
+                    files.append((entry.name, st.st_size, st.st_mtime))
+            except OSError:
+                continue
+    else:
+        for name in os.listdir(path):
+            try:
+                st = os.stat(os.path.join(path, name))
+            except OSError:
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                subdirs.append(name)
+            elif name.lower().endswith(extension):
+                files.append((name, st.st_size, st.st_mtime))
+    return subdirs, files
+
+
+class ParallelScanner(object):
+    """
+    Walks a directory tree with a bounded pool of threads so that several directory listings are in flight at once.
+    On network shares, where each listing is a round trip, a single thread spends nearly all its time waiting.
+
+    process(dir_path) is called on the worker threads for every directory and must return a tuple of (subdirectory
+    paths, result). walk() yields (dir_path, result) in the same top-down order as os.walk, however the listings
+    happen to complete, so callers see exactly what a serial walk would give.
+    """
+
+    def __init__(self, workers=8):
+        self.workers = max(1, int(workers))
+
+    def walk(self, root, process):
+        if self.workers == 1:
+            stack = [root]
+            while stack:
+                dir_path = stack.pop()
+                subdirs, result = process(dir_path)
+                yield dir_path, result
+                stack.extend(reversed(subdirs))
+            return
+
+        results = {}
+        condition = threading.Condition()
+        work = Queue.Queue()
+        stopping = threading.Event()
+
+        def worker():
+            while True:
+                dir_path = work.get()
+                if dir_path is None or stopping.is_set():
+                    return
+                try:
+                    output = process(dir_path)
+                except Exception, e:
+                    output = e
+                else:
+                    # Queue subdirectories straight away so listings run ahead of the caller.
+                    for subdir in output[0]:
+                        work.put(subdir)
+                with condition:
+                    results[dir_path] = output
+                    condition.notify_all()
+
+        threads = [threading.Thread(target=worker, name='Scanner-{0:d}'.format(i)) for i in xrange(self.workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        work.put(root)
+
+        try:
+            stack = [root]
+            while stack:
+                dir_path = stack.pop()
+                with condition:
+                    while dir_path not in results:
+                        condition.wait()
+                    output = results.pop(dir_path)
+                if isinstance(output, Exception):
+                    raise output
+                subdirs, result = output
+                yield dir_path, result
+                stack.extend(reversed(subdirs))
+        finally:
+            stopping.set()
+            for _ in threads:
+                work.put(None)
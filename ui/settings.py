@@ -1,6 +1,10 @@
 import os
 from PyQt4.QtCore import QSettings, QVariant, QString
 
+from ui.batching import MODES as BATCH_MODES
+from ui.engines import FineReader10, Simulator
+from ui.work_queue import POLICIES
+
 __author__ = 'Gary Hughes'
 
 
@@ -42,3 +46,252 @@ class Settings(object):
     @last_profile.setter
     def last_profile(self, path):
         self.settings.setValue('last_settings/profile', path)
+
+    @property
+    def engine(self):
+        """
+        OCR engine to run jobs on: finereader10, or simulator to run utils/fake_finereader.py with the simulator/*
+        settings.
+        """
+        engine = str(self.settings.value('processing/engine', QVariant(FineReader10.name)).toString()).lower()
+        return engine if engine in (FineReader10.name, Simulator.name) else FineReader10.name
+
+    @engine.setter
+    def engine(self, engine):
+        self.settings.setValue('processing/engine', engine)
+
+    def simulator_value(self, key, default):
+        return str(self.settings.value('simulator/' + key, QVariant(default)).toString()) or default
+
+    def simulator_rate(self, key):
+        rate, ok = self.settings.value('simulator/' + key, QVariant(0.0)).toDouble()
+        return min(1.0, max(0.0, rate)) if ok else 0.0
+
+    @property
+    def simulator(self):
+        """
+        Simulator engine set up from the simulator/* settings: startup and page latency distributions (see
+        ui.engines.Simulator), and error_rate, hang_rate and crash_rate from 0 to 1.
+        """
+        seed, ok = self.settings.value('simulator/seed', QVariant('')).toInt()
+        return Simulator(self.simulator_value('startup', 'fixed:0.5'), self.simulator_value('page', 'fixed:1'),
+                         self.simulator_rate('error_rate'), self.simulator_rate('hang_rate'),
+                         self.simulator_rate('crash_rate'), seed if ok else None)
+
+    @property
+    def worker_count(self):
+        """
+        Number of FineReader instances to run at once.
+        """
+        count, ok = self.settings.value('processing/worker_count', QVariant(1)).toInt()
+        return max(1, count) if ok else 1
+
+    @worker_count.setter
+    def worker_count(self, count):
+        self.settings.setValue('processing/worker_count', count)
+
+    @property
+    def recycle_after(self):
+        """
+        Number of jobs a FineReader instance runs before it's replaced with a fresh one. 1 starts a new instance for
+        every job.
+        """
+        count, ok = self.settings.value('processing/recycle_after', QVariant(1)).toInt()
+        return max(1, count) if ok else 1
+
+    @recycle_after.setter
+    def recycle_after(self, count):
+        self.settings.setValue('processing/recycle_after', count)
+
+    @property
+    def recycle_memory(self):
+        """
+        Memory use in MB past which a FineReader instance is replaced after its current job. 0 for no limit.
+        """
+        limit, ok = self.settings.value('processing/recycle_memory', QVariant(1024)).toInt()
+        return max(0, limit) if ok else 1024
+
+    @recycle_memory.setter
+    def recycle_memory(self, limit):
+        self.settings.setValue('processing/recycle_memory', limit)
+
+    @property
+    def mover_workers(self):
+        """
+        Number of finished PDFs to move into the output folder at once.
+        """
+        count, ok = self.settings.value('processing/mover_workers', QVariant(2)).toInt()
+        return max(1, count) if ok else 2
+
+    @mover_workers.setter
+    def mover_workers(self, count):
+        self.settings.setValue('processing/mover_workers', count)
+
+    @property
+    def metrics_port(self):
+        """
+        Local port to serve job stage timings on in Prometheus format, at /metrics. 0 to turn it off.
+        """
+        port, ok = self.settings.value('metrics/port', QVariant(0)).toInt()
+        return port if ok and 0 < port < 65536 else 0
+
+    @metrics_port.setter
+    def metrics_port(self, port):
+        self.settings.setValue('metrics/port', port)
+
+    @property
+    def metrics_file(self):
+        """
+        JSON file to write job stage timings to every metrics_flush_interval seconds. Empty to turn it off.
+        """
+        return str(self.settings.value('metrics/file', QVariant('')).toString())
+
+    @metrics_file.setter
+    def metrics_file(self, path):
+        self.settings.setValue('metrics/file', path)
+
+    @property
+    def metrics_flush_interval(self):
+        seconds, ok = self.settings.value('metrics/flush_interval', QVariant(60)).toInt()
+        return max(1, seconds) if ok else 60
+
+    @metrics_flush_interval.setter
+    def metrics_flush_interval(self, seconds):
+        self.settings.setValue('metrics/flush_interval', seconds)
+
+    @property
+    def trace_file(self):
+        """
+        Chrome trace file to record job lifecycles to, which can include time.strftime() codes. Empty to turn tracing
+        off.
+        """
+        return str(self.settings.value('trace/file', QVariant('')).toString())
+
+    @trace_file.setter
+    def trace_file(self, path):
+        self.settings.setValue('trace/file', path)
+
+    @property
+    def log_lines(self):
+        """
+        Number of lines kept in the log. Older lines are dropped.
+        """
+        count, ok = self.settings.value('interface/log_lines', QVariant(5000)).toInt()
+        return max(100, count) if ok else 5000
+
+    @log_lines.setter
+    def log_lines(self, count):
+        self.settings.setValue('interface/log_lines', count)
+
+    @property
+    def scan_workers(self):
+        """
+        Number of directories to list at once when searching the watch folder.
+        """
+        count, ok = self.settings.value('processing/scan_workers', QVariant(8)).toInt()
+        return max(1, count) if ok else 8
+
+    @scan_workers.setter
+    def scan_workers(self, count):
+        self.settings.setValue('processing/scan_workers', count)
+
+    @property
+    def settle_time(self):
+        """
+        Seconds a new file's size and modified time must stay the same before it's queued.
+        """
+        seconds, ok = self.settings.value('processing/settle_time', QVariant(2.0)).toDouble()
+        return max(0.0, seconds) if ok else 2.0
+
+    @settle_time.setter
+    def settle_time(self, seconds):
+        self.settings.setValue('processing/settle_time', seconds)
+
+    @property
+    def schedule(self):
+        """
+        Order to process queued files in: fifo, smallest, fair (turns between top-level subfolders) or priority.
+        """
+        schedule = str(self.settings.value('processing/schedule', QVariant('fifo')).toString()).lower()
+        return schedule if schedule in POLICIES else 'fifo'
+
+    @schedule.setter
+    def schedule(self, schedule):
+        self.settings.setValue('processing/schedule', schedule)
+
+    @property
+    def priorities(self):
+        """
+        Rules for the priority schedule, stored as "pattern=priority;pattern=priority". Patterns are matched against
+        paths relative to the watch folder and the first match wins.
+        """
+        rules = []
+        value = str(self.settings.value('processing/priorities', QVariant('')).toString())
+        for rule in value.split(';'):
+            pattern, _, priority = rule.rpartition('=')
+            try:
+                rules.append((pattern.strip(), int(priority)))
+            except ValueError:
+                continue
+        return rules
+
+    @priorities.setter
+    def priorities(self, rules):
+        self.settings.setValue('processing/priorities', ';'.join('{0:s}={1:d}'.format(*rule) for rule in rules))
+
+    @property
+    def batch_mode(self):
+        """
+        How input files are grouped into one FineReader run: none, folder or pattern. See ui.batching.Batcher.
+        """
+        mode = str(self.settings.value('processing/batch_mode', QVariant('none')).toString()).lower()
+        return mode if mode in BATCH_MODES else 'none'
+
+    @batch_mode.setter
+    def batch_mode(self, mode):
+        self.settings.setValue('processing/batch_mode', mode)
+
+    @property
+    def batch_pattern(self):
+        """
+        Regular expression for the pattern batch mode. Its first group is the name of the document a file belongs to.
+        """
+        return str(self.settings.value('processing/batch_pattern', QVariant('')).toString())
+
+    @batch_pattern.setter
+    def batch_pattern(self, pattern):
+        self.settings.setValue('processing/batch_pattern', pattern)
+
+    def rules(self, key, convert):
+        """
+        A setting stored as "name=value;name=value", as a dict. Rules that don't parse are ignored.
+        """
+        rules = {}
+        for rule in str(self.settings.value(key, QVariant('')).toString()).split(';'):
+            name, _, value = rule.partition('=')
+            try:
+                rules[name.strip().lower()] = convert(value)
+            except ValueError:
+                continue
+        return rules
+
+    @property
+    def retry_limits(self):
+        """
+        Attempts allowed for each class of error before a file is quarantined, as "class=attempts;...", e.g.
+        "licence=6;crash=3". Classes not given keep their defaults (see ui.retry).
+        """
+        return self.rules('retry/limits', int)
+
+    @property
+    def retry_delays(self):
+        """
+        Seconds before the first retry for each class of error, as "class=seconds;...". Later retries wait twice as
+        long each time.
+        """
+        return self.rules('retry/delays', float)
+
+    @property
+    def retry_max_delay(self):
+        seconds, ok = self.settings.value('retry/max_delay', QVariant(3600.0)).toDouble()
+        return max(0.0, seconds) if ok else 3600.0
@@ -0,0 +1,99 @@
+import heapq
+import os
+import time
+
+__author__ = 'Gary Hughes'
+
+
+class SettleQueue(object):
+    """
+    Holds paths from file system events until they stop changing, so files that are still being copied in aren't
+    handed to FineReader half written.
+
+    A path is released once its size and mtime are the same as they were quiet_time seconds earlier and, if given,
+    is_free(path) returns True (e.g. nothing else has it open). signature(path), if given, replaces the size and mtime
+    check; it must return None for a path that's gone and a tuple starting with the size otherwise. Any further event
+    for a pending path just pushes its check back, so a burst of events for one file is merged into a single release.
+
+    Pending checks are kept in a heap ordered by due time. Entries are never removed from the heap; superseded ones are
+    skipped when they reach the top.
+    """
+
+    def __init__(self, quiet_time=2.0, is_free=None, signature=None):
+        self.quiet_time = quiet_time
+        self.is_free = is_free
+        if signature:
+            self.signature = signature
+        self.heap = []
+        self.pending = {}  # Path: [due time, signature]
+
+    def __len__(self):
+        return len(self.pending)
+
+    @staticmethod
+    def signature(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime
+
+    def touch(self, path, now=None):
+        """
+        Record an event for path. Returns False if the path was already waiting to settle.
+        """
+        if now is None:
+            now = time.time()
+        due = now + self.quiet_time
+        entry = self.pending.get(path)
+        if entry:
+            entry[0] = due
+            heapq.heappush(self.heap, (due, path))
+            return False
+        self.pending[path] = [due, self.signature(path)]
+        heapq.heappush(self.heap, (due, path))
+        return True
+
+    def discard(self, path):
+        return self.pending.pop(path, None) is not None
+
+    def wait_time(self, now=None):
+        """
+        Seconds until the next check is due, or None if nothing is waiting.
+        """
+        if not self.pending:
+            return None
+        if now is None:
+            now = time.time()
+        while self.heap:
+            due, path = self.heap[0]
+            entry = self.pending.get(path)
+            if entry and entry[0] == due:
+                return max(0.0, due - now)
+            heapq.heappop(self.heap)
+        return None
+
+    def pop_settled(self, now=None):
+        """
+        Check every path that's due and return (path, size) for those that have settled, in the order they became due.
+        Paths that have disappeared are dropped and paths still changing are checked again after another quiet_time.
+        """
+        if now is None:
+            now = time.time()
+        settled = []
+        while self.heap and self.heap[0][0] <= now:
+            due, path = heapq.heappop(self.heap)
+            entry = self.pending.get(path)
+            if not entry or entry[0] != due:
+                continue
+            signature = self.signature(path)
+            if signature is None:
+                del self.pending[path]
+            elif signature == entry[1] and (not self.is_free or self.is_free(path)):
+                del self.pending[path]
+                settled.append((path, signature[0]))
+            else:
+                entry[0] = now + self.quiet_time
+                entry[1] = signature
+                heapq.heappush(self.heap, (entry[0], path))
+        return settled
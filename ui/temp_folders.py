@@ -0,0 +1,117 @@
+import glob
+import os
+import re
+import tempfile
+import threading
+import time
+
+__author__ = 'Gary Hughes'
+
+regex_pid = re.compile(r'(?<=^PID:\s)\d+$')
+
+
+class TempFolderIndex(object):
+    """
+    Maps FineReader PIDs to their temp folders (%TEMP%\\FineReader10\\Untitled.FR10*). One index is shared by every
+    watcher and cleanup thread.
+
+    Each temp folder holds a {GUID}.loc file with the PID of the FineReader instance using it. The index remembers what
+    it has already read, so looking up a known PID is a dict lookup. A refresh lists the FineReader10 folder once,
+    skips subfolders whose modification time hasn't changed since they were last read, and only reads .loc files it
+    hasn't seen before. Folders that have gone away are dropped. However many watchers are waiting for a PID to
+    appear, there's at most one refresh every min_refresh seconds.
+    """
+
+    def __init__(self, base_folder=None, min_refresh=0.5):
+        self.base_folder = base_folder or os.path.join(tempfile.gettempdir(), 'FineReader10')
+        self.min_refresh = min_refresh
+        self.lock = threading.Lock()
+        self.folders = {}  # Folder path: mtime when it was last fully read.
+        self.loc_files = {}  # .loc path: PID.
+        self.pids = {}  # PID: folder path.
+        self.last_refresh = 0
+
+    def lookup(self, pid, refresh=True):
+        """
+        Temp folder for pid, or None if it hasn't been created yet.
+        """
+        pid = int(pid)
+        with self.lock:
+            folder = self.pids.get(pid)
+            if folder is None and refresh and time.time() - self.last_refresh >= self.min_refresh:
+                self.refresh()
+                folder = self.pids.get(pid)
+            return folder
+
+    def forget(self, pid):
+        """
+        Drop pid, e.g. once its temp folder has been removed. PIDs are reused, so a stale entry could otherwise be found
+        for a later process.
+        """
+        with self.lock:
+            folder = self.pids.get(int(pid))
+            if folder:
+                self.drop(folder)
+
+    def refresh(self):
+        self.last_refresh = time.time()
+        try:
+            names = os.listdir(self.base_folder)
+        except OSError:
+            names = []
+        present = set()
+        for name in names:
+            if not name.lower().startswith('untitled.fr10'):
+                continue
+            folder = os.path.join(self.base_folder, name)
+            try:
+                mtime = os.stat(folder).st_mtime
+            except OSError:
+                continue
+            present.add(folder)
+            if self.folders.get(folder) == mtime:
+                continue
+            if self.read_folder(folder):
+                self.folders[folder] = mtime
+        for folder in set(self.folders).difference(present):
+            self.drop(folder)
+
+    def read_folder(self, folder):
+        """
+        Read any .loc files in folder that haven't been read yet. Returns False if one couldn't be read (e.g. FineReader
+        hasn't finished writing it), so the folder is looked at again on the next refresh.
+        """
+        complete = True
+        for loc_file_path in glob.glob(os.path.join(folder, '{*}.loc')):
+            if loc_file_path in self.loc_files:
+                continue
+            pid = self.read_pid(loc_file_path)
+            if pid is None:
+                complete = False
+                continue
+            self.loc_files[loc_file_path] = pid
+            # If a PID turns up in more than one folder (an orphan from an earlier process), the newest one wins.
+            self.pids[pid] = folder
+        return complete
+
+    @staticmethod
+    def read_pid(loc_file_path):
+        try:
+            with open(loc_file_path, 'r') as loc_file:
+                for line in loc_file:
+                    match = regex_pid.findall(line.rstrip('\r\n'))
+                    if len(match) == 1:
+                        return int(match[0])
+        except (IOError, OSError):
+            pass
+        return None
+
+    def drop(self, folder):
+        self.folders.pop(folder, None)
+        for loc_file_path in [path for path in self.loc_files if os.path.dirname(path) == folder]:
+            pid = self.loc_files.pop(loc_file_path)
+            if self.pids.get(pid) == folder:
+                del self.pids[pid]
+
+
+temp_folder_index = TempFolderIndex()
@@ -0,0 +1,183 @@
+from collections import deque
+from contextlib import contextmanager
+import json
+import os
+import sys
+import threading
+import time
+
+from ui.metrics import monotonic
+
+__author__ = 'Gary Hughes'
+
+# Paths are byte strings in the file system's encoding (e.g. mbcs on Windows), not UTF-8.
+PATH_ENCODING = sys.getfilesystemencoding() or 'utf-8'
+
+
+def json_safe(value):
+    """
+    value with any byte strings that won't decode as PATH_ENCODING replaced by their repr().
+    """
+    if isinstance(value, str):
+        try:
+            value.decode(PATH_ENCODING)
+            return value
+        except UnicodeDecodeError:
+            return repr(value)
+    if isinstance(value, dict):
+        return dict((json_safe(key), json_safe(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [json_safe(item) for item in value]
+    return value
+
+
+def dumps(event):
+    try:
+        return json.dumps(event, separators=(',', ':'), encoding=PATH_ENCODING)
+    except UnicodeDecodeError:
+        return json.dumps(json_safe(event), separators=(',', ':'), encoding=PATH_ENCODING)
+
+
+class Tracer(object):
+    """
+    Opt-in tracing to a Chrome Trace Event file, which can be opened in Perfetto (ui.perfetto.dev) or chrome://tracing.
+
+    Calls are no-ops until start() is called. After that each call only appends an event to a deque; a background
+    thread turns them into JSON and writes them out every flush_interval seconds. The file is a JSON array that's
+    closed by stop(). If the application crashes the closing bracket is missing, which both viewers accept.
+
+    Two kinds of event are recorded:
+      - span(): timed work on the current thread, like a watch folder scan or a refresh tick.
+      - step() and finish(): the life of a job or an engine instance, as one track per key in its category. Each step
+        ends the key's previous phase and starts a new one; finish() ends the last. mark() adds a point in time to the
+        key's track.
+    """
+
+    flush_interval = 0.5
+
+    def __init__(self):
+        self.enabled = False
+        self.events = deque()
+        self.phases = {}  # (category, key): current phase name.
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.named_threads = set()
+        self.path = None
+        self.thread = None
+        self.stopping = threading.Event()
+
+    def start(self, path):
+        """
+        Start tracing to path, which can include time.strftime() codes (e.g. trace-%Y%m%d-%H%M%S.json).
+        """
+        if self.enabled:
+            return
+        self.path = time.strftime(path)
+        self.trace_file = open(self.path, 'w')
+        self.trace_file.write('[\n')
+        self.first_event = True
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name='Tracer')
+        self.thread.daemon = True
+        self.thread.start()
+        self.enabled = True
+        print 'Tracing to', self.path
+
+    def stop(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+        self.write_events()
+        self.trace_file.write('\n]\n')
+        self.trace_file.close()
+        print 'Trace written to', self.path
+
+    def run(self):
+        while not self.stopping.wait(self.flush_interval):
+            try:
+                self.write_events()
+            except EnvironmentError, e:
+                # Can't write the file any more. Stop collecting events rather than letting them pile up.
+                print 'Tracing stopped, could not write to {0:s}: {1:s}'.format(self.path, str(e))
+                self.enabled = False
+                self.events.clear()
+                try:
+                    self.trace_file.close()
+                except EnvironmentError:
+                    pass
+                return
+
+    def write_events(self):
+        events = self.events
+        lines = []
+        while events:
+            event = events.popleft()
+            try:
+                lines.append(dumps(event))
+            except (TypeError, ValueError), e:
+                # One bad event shouldn't stop the rest being written.
+                print 'Could not trace event {0:s}: {1:s}'.format(repr(event), str(e))
+        if not lines:
+            return
+        if not self.first_event:
+            self.trace_file.write(',\n')
+        self.first_event = False
+        self.trace_file.write(',\n'.join(lines))
+        self.trace_file.flush()
+
+    def event(self, phase, name, category, args=None, **fields):
+        thread = threading.current_thread()
+        if thread.ident not in self.named_threads:
+            self.named_threads.add(thread.ident)
+            self.events.append({'ph': 'M', 'name': 'thread_name', 'pid': self.pid, 'tid': thread.ident,
+                                'args': {'name': thread.name}})
+        fields.update({'ph': phase, 'name': name, 'cat': category, 'pid': self.pid, 'tid': thread.ident})
+        if 'ts' not in fields:
+            fields['ts'] = monotonic() * 1e6
+        if args:
+            fields['args'] = args
+        self.events.append(fields)
+
+    @contextmanager
+    def span(self, name, category, **args):
+        if not self.enabled:
+            yield
+            return
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.event('X', name, category, args, ts=start * 1e6, dur=(monotonic() - start) * 1e6)
+
+    def step(self, category, key, phase, **args):
+        if not self.enabled:
+            return
+        key = str(key)
+        with self.lock:
+            previous = self.phases.get((category, key))
+            self.phases[(category, key)] = phase
+        now = monotonic() * 1e6
+        if previous:
+            self.event('e', previous, category, id=key, ts=now)
+        args['key'] = key
+        self.event('b', phase, category, args, id=key, ts=now)
+
+    def mark(self, category, key, name, **args):
+        if not self.enabled:
+            return
+        self.event('n', name, category, args, id=str(key))
+
+    def finish(self, category, key, **args):
+        if not self.enabled:
+            return
+        key = str(key)
+        with self.lock:
+            previous = self.phases.pop((category, key), None)
+        if previous:
+            self.event('e', previous, category, args, id=key)
+
+
+tracer = Tracer()
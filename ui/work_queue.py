@@ -0,0 +1,255 @@
+from collections import deque
+from fnmatch import fnmatch
+import heapq
+import os
+
+__author__ = 'Gary Hughes'
+
+
+class WorkQueue(object):
+    """
+    FIFO queue of paths with O(1) membership tests, removal and de-duplication.
+
+    Paths are kept in a deque in the order they were added, alongside a dict of the paths currently queued. Removing a
+    path only deletes it from the dict; its stale deque entry is skipped when it reaches the front, and the deque is
+    compacted if stale entries start to outnumber live ones. Adding a path that's already queued does nothing.
+
+    This is also the interface for the other scheduling policies below: paths are added with their size in bytes, if
+    known, and popleft() always returns the path that should be processed next.
+    """
+
+    def __init__(self, entries=()):
+        self.order = deque()
+        self.members = {}
+        self.sequence = 0
+        self.extend(entries)
+
+    def __len__(self):
+        return len(self.members)
+
+    def __nonzero__(self):
+        return bool(self.members)
+
+    def __contains__(self, path):
+        return path in self.members
+
+    def append(self, path, size=None):
+        """
+        Add path to the back of the queue. Returns False if it was already queued.
+        """
+        if path in self.members:
+            return False
+        self.sequence += 1
+        self.members[path] = self.sequence
+        self.order.append((self.sequence, path))
+        return True
+
+    def extend(self, entries):
+        """
+        Add (path, size) pairs.
+        """
+        for path, size in entries:
+            self.append(path, size)
+
+    def popleft(self):
+        members = self.members
+        order = self.order
+        while order:
+            sequence, path = order.popleft()
+            if members.get(path) == sequence:
+                del members[path]
+                return path
+        raise IndexError('pop from an empty queue')
+
+    def remove(self, path):
+        try:
+            del self.members[path]
+        except KeyError:
+            raise ValueError('{0:s} is not queued'.format(path))
+        if len(self.order) > 2 * len(self.members) + 1024:
+            self.compact()
+
+    def discard(self, path):
+        try:
+            self.remove(path)
+        except ValueError:
+            pass
+
+    def compact(self):
+        self.order = deque(entry for entry in self.order if self.members.get(entry[1]) == entry[0])
+
+    def clear(self):
+        self.order.clear()
+        self.members.clear()
+
+
+class HeapWorkQueue(WorkQueue):
+    """
+    Base for policies that order paths by a sort key, lowest first and FIFO between equal keys. The same lazy removal
+    as WorkQueue is used, with a heap in place of the deque.
+    """
+
+    def __init__(self, entries=()):
+        super(HeapWorkQueue, self).__init__()
+        self.order = []
+        self.extend(entries)
+
+    def sort_key(self, path, size):
+        raise NotImplementedError
+
+    def append(self, path, size=None):
+        if path in self.members:
+            return False
+        self.sequence += 1
+        self.members[path] = self.sequence
+        heapq.heappush(self.order, (self.sort_key(path, size), self.sequence, path))
+        return True
+
+    def popleft(self):
+        members = self.members
+        order = self.order
+        while order:
+            key, sequence, path = heapq.heappop(order)
+            if members.get(path) == sequence:
+                del members[path]
+                return path
+        raise IndexError('pop from an empty queue')
+
+    def compact(self):
+        self.order = [entry for entry in self.order if self.members.get(entry[2]) == entry[1]]
+        heapq.heapify(self.order)
+
+    def clear(self):
+        self.order = []
+        self.members.clear()
+
+
+class SmallestFirstQueue(HeapWorkQueue):
+    """
+    Smallest files first, so one huge file doesn't hold up hundreds of small ones. Paths of unknown size go first.
+    """
+
+    def sort_key(self, path, size):
+        return size or 0
+
+
+class PriorityWorkQueue(HeapWorkQueue):
+    """
+    Explicit priorities from a list of (pattern, priority) rules. The first pattern that matches a path (relative to
+    the watch folder) sets its priority, otherwise it's 0. Higher priorities go first.
+    """
+
+    def __init__(self, root, rules, entries=()):
+        self.root = root
+        self.rules = rules
+        super(PriorityWorkQueue, self).__init__(entries)
+
+    def priority(self, path):
+        relative_path = path[len(self.root) + 1:]
+        for pattern, priority in self.rules:
+            if fnmatch(relative_path, pattern):
+                return priority
+        return 0
+
+    def sort_key(self, path, size):
+        return -self.priority(path)
+
+
+class FairShareQueue(WorkQueue):
+    """
+    Takes turns between the top-level subfolders of the watch folder (files directly in it count as one more folder),
+    so one big folder can't starve the rest. Each folder's files are kept in FIFO order.
+    """
+
+    def __init__(self, root, entries=()):
+        self.root = root
+        self.folders = {}  # Folder: WorkQueue
+        self.rotation = deque()
+        self.in_rotation = set()
+        super(FairShareQueue, self).__init__(entries)
+
+    def folder(self, path):
+        relative_path = path[len(self.root) + 1:]
+        return relative_path.split(os.sep, 1)[0] if os.sep in relative_path else ''
+
+    def append(self, path, size=None):
+        if path in self.members:
+            return False
+        folder = self.folder(path)
+        self.members[path] = folder
+        folder_queue = self.folders.get(folder)
+        if folder_queue is None:
+            folder_queue = self.folders[folder] = WorkQueue()
+        folder_queue.append(path)
+        if folder not in self.in_rotation:
+            self.in_rotation.add(folder)
+            self.rotation.append(folder)
+        return True
+
+    def popleft(self):
+        while self.rotation:
+            folder = self.rotation.popleft()
+            folder_queue = self.folders.get(folder)
+            if not folder_queue:
+                self.in_rotation.discard(folder)
+                self.folders.pop(folder, None)
+                continue
+            path = folder_queue.popleft()
+            del self.members[path]
+            if folder_queue:
+                self.rotation.append(folder)
+            else:
+                self.in_rotation.discard(folder)
+                del self.folders[folder]
+            return path
+        raise IndexError('pop from an empty queue')
+
+    def remove(self, path):
+        try:
+            folder = self.members.pop(path)
+        except KeyError:
+            raise ValueError('{0:s} is not queued'.format(path))
+        self.folders[folder].remove(path)
+
+    def clear(self):
+        self.members.clear()
+        self.folders.clear()
+        self.rotation.clear()
+        self.in_rotation.clear()
+
+
+POLICIES = ('fifo', 'smallest', 'fair', 'priority')
+# Finished paths skipped in one go before letting the event loop run.
+SKIP_CHUNK = 1000
+
+
+def make_work_queue(policy, root, priorities=(), entries=()):
+    """
+    Create the work queue for a scheduling policy name from POLICIES. Unknown names fall back to FIFO.
+    """
+    if policy == 'smallest':
+        return SmallestFirstQueue(entries)
+    elif policy == 'fair':
+        return FairShareQueue(root, entries)
+    elif policy == 'priority':
+        return PriorityWorkQueue(root, priorities, entries)
+    return WorkQueue(entries)
+
+
+def pop_unfinished(queue, finished, mark_all_done, chunk=SKIP_CHUNK):
+    """
+    Pop paths from queue until one that isn't finished(path), and return it. The finished paths passed over are handed
+    to mark_all_done in one call, however the search ends. Returns None after chunk of them, leaving the rest of the
+    queue for a later call, and raises IndexError if the queue runs out.
+    """
+    skipped = []
+    try:
+        while len(skipped) < chunk:
+            path = queue.popleft()
+            if not finished(path):
+                return path
+            skipped.append(path)
+        return None
+    finally:
+        if skipped:
+            mark_all_done(skipped)
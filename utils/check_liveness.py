@@ -0,0 +1,183 @@
+#!/usr/bin/env python2
+"""
+Runs ui.liveness.LivenessMonitor through scripted FineReader behaviour (busy, stalled, showing dialogs, crashed) with
+a ScriptedProbe and a simulated clock, and checks what it decides, including when a document opened into a running
+instance is sent on. Needs nothing but Python, so it runs anywhere.
+
+Usage:
+    check_liveness.py [-v]
+
+Exits with 1 if any scenario fails.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ui.liveness import LivenessMonitor, ScriptedProbe
+
+__author__ = 'Gary Hughes'
+
+PHRASES = ('Some licenses cannot be used', 'Process failed')
+
+
+def busy(step):
+    """
+    Counters that rise every check.
+    """
+    return (False, (step * 1.0, step * 100), None)
+
+
+def stalled(dialog=None):
+    return (False, (5.0, 500), dialog)
+
+
+def run(states, input_paths=(), duration=600):
+    """
+    Check a monitor against states until it reports an error or duration simulated seconds pass. Returns (error,
+    simulated time of the error, intervals between checks).
+    """
+    monitor = LivenessMonitor(ScriptedProbe(states), PHRASES)
+    monitor.start_job(input_paths, now=0.0)
+    now = 0.0
+    intervals = []
+    while now <= duration:
+        error = monitor.check(now=now)
+        if error:
+            return error, now, intervals
+        intervals.append(monitor.interval)
+        now += monitor.interval
+    return None, now, intervals
+
+
+def hand_off(states, initial=(False, None, None), duration=60, **failures):
+    """
+    Open a document into a running instance as AppWatcher does, then check it like run() until it's sent, an error is
+    reported or duration simulated seconds pass. Returns (probe, error, number of checks before the send or None).
+    """
+    probe = ScriptedProbe(states, initial=initial, **failures)
+    monitor = LivenessMonitor(probe, PHRASES)
+    monitor.open_document(['next.tif'], now=0.0)
+    now = 0.0
+    checks = 0
+    while now <= duration:
+        error = monitor.check(now=now)
+        checks += 1
+        if error:
+            return probe, error, None
+        if monitor.send_if_due():
+            return probe, None, checks
+        now += monitor.interval
+    return probe, None, None
+
+
+def scenarios(temp_folder):
+    four_mb = os.path.join(temp_folder, 'four_mb.tif')
+    with open(four_mb, 'wb') as four_mb_file:
+        four_mb_file.write('\0' * 4 * 1048576)
+    pages = [os.path.join(temp_folder, 'page{0:d}.tif'.format(i)) for i in range(1, 6)]
+    for path in pages:
+        open(path, 'wb').close()
+
+    base = LivenessMonitor.base_timeout
+
+    # Working the whole time: never an error, and checks back off to max_interval.
+    error, at, intervals = run([busy(step) for step in range(1000)], duration=300)
+    yield 'busy is never hung', error is None
+    yield 'busy backs off to max_interval', intervals[-1] == LivenessMonitor.max_interval
+
+    # Works for a while, then stops: hung once base_timeout has passed since the last progress, checked quickly.
+    error, at, intervals = run([busy(step) for step in range(10)] + [stalled()])
+    yield 'stalled is hung', error is not None and error.startswith('Abbyy made no progress')
+    last_progress = sum(LivenessMonitor.min_interval * 2 ** min(i, 4) for i in range(9))
+    yield 'stalled is hung after base_timeout', base <= at - last_progress < base + LivenessMonitor.max_interval
+    yield 'stalled checks every min_interval', intervals[-1] == LivenessMonitor.min_interval
+
+    # The timeout grows with the size and number of the inputs.
+    error, at, intervals = run([stalled()], [four_mb])
+    yield 'timeout scales with size', base + 4 * LivenessMonitor.timeout_per_mb <= at
+    error, at, intervals = run([stalled()], pages)
+    yield 'timeout scales with pages', base + 4 * LivenessMonitor.timeout_per_page <= at
+
+    # A dialog without an error phrase is given dialog_timeout_factor times as long.
+    error, at, intervals = run([stalled('Please wait')])
+    yield 'dialog gets longer', base * LivenessMonitor.dialog_timeout_factor <= at
+
+    # An error phrase fails the job at the first check that sees it.
+    error, at, intervals = run([busy(0), stalled('Process failed: out of memory')])
+    yield 'error phrase is reported', error == 'Process failed'
+
+    # Exited part way through.
+    error, at, intervals = run([busy(0), busy(1), (True, None, None)])
+    yield 'crash is reported', error is not None and error.startswith('Abbyy exited before')
+
+    # Without counters an open dialog counts as progress, as it did before counters were read.
+    error, at, intervals = run([(False, None, 'Reading page 1')], duration=120)
+    yield 'dialog without counters is progress', error is None
+    error, at, intervals = run([(False, None, None)])
+    yield 'no dialog without counters is hung', error is not None and base <= at
+
+    # A document opened into a running instance is sent once FineReader has worked on it and then been quiet twice.
+    probe, error, checks = hand_off([busy(1), busy(2), busy(3), busy(3)])
+    yield 'opened document is opened', probe.opened == [['next.tif']]
+    yield 'read document is sent', error is None and probe.sent == 1 and checks == 5
+    probe, error, checks = hand_off([busy(1), busy(2), busy(2), busy(3), busy(3)])
+    yield 'progress between quiet checks waits', checks == 6
+    # Not before reading has started, however long FineReader takes to get going.
+    probe, error, checks = hand_off([busy(5)] * 4 + [busy(6), busy(6)])
+    yield 'not sent before reading starts', probe.sent == 1 and checks == 7
+    probe, error, checks = hand_off([stalled()])
+    yield 'never read is hung, not sent', probe.sent == 0 and error.startswith('Abbyy made no progress')
+    # Read before the first check: counters are taken when the document is opened, so it still shows as progress.
+    probe, error, checks = hand_off([stalled()], initial=busy(1))
+    yield 'read before first check is sent', probe.sent == 1 and checks == 3
+    # Without counters, FineReader's progress window shows it reading.
+    probe, error, checks = hand_off([(False, None, 'Reading page 1')] * 3 + [(False, None, None)])
+    yield 'progress dialog then quiet is sent', probe.sent == 1 and checks == 5
+    probe, error, checks = hand_off([busy(1), busy(2), stalled('Process failed: bad image')])
+    yield 'error dialog is reported, not sent', error == 'Process failed' and probe.sent == 0
+
+    # pywinauto errors are left to AppWatcher, which restarts the instance or fails the job.
+    try:
+        hand_off([busy(1)], fail_open=True)
+        raised = False
+    except RuntimeError:
+        raised = True
+    yield 'failed open raises', raised
+    try:
+        hand_off([busy(1), busy(2), stalled()], fail_send=True)
+        raised = False
+    except RuntimeError:
+        raised = True
+    yield 'failed send raises', raised
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check LivenessMonitor against scripted FineReader behaviour.')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show the monitor\'s own output')
+    args = parser.parse_args()
+
+    temp_folder = tempfile.mkdtemp()
+    failures = 0
+    stdout = sys.stdout
+    if not args.verbose:
+        # The monitor prints every check without progress.
+        sys.stdout = open(os.devnull, 'w')
+    try:
+        for name, passed in scenarios(temp_folder):
+            stdout.write('{0:<40s} {1:s}\n'.format(name, 'ok' if passed else 'FAILED'))
+            failures += not passed
+    finally:
+        if sys.stdout is not stdout:
+            sys.stdout.close()
+            sys.stdout = stdout
+        shutil.rmtree(temp_folder)
+    print '{0:d} failed'.format(failures) if failures else 'All passed'
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
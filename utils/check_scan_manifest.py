@@ -0,0 +1,96 @@
+#!/usr/bin/env python2
+"""
+Checks ui.scan_manifest.ScanManifest's incremental scans against a small watch tree in a temp folder, in particular
+that switching a watch folder between output folders (job journal runs) and back doesn't lose files. Needs nothing but
+Python, so it runs anywhere.
+
+Usage:
+    check_scan_manifest.py
+
+Exits with 1 if any scenario fails.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ui.job_journal import JobJournal
+from ui.scan_manifest import ScanManifest
+
+__author__ = 'Gary Hughes'
+
+
+def add_file(path):
+    folder = os.path.dirname(path)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    # Make sure the folder's mtime moves on, however coarse the file system's clock.
+    time.sleep(0.05)
+    with open(path, 'wb') as new_file:
+        new_file.write('tif')
+
+
+def scan(db_path, watch_folder, run_id, full=False):
+    manifest = ScanManifest(db_path)
+    try:
+        new_entries, removed = manifest.scan(watch_folder, '.tif', full=full, workers=2, run_id=run_id)
+    finally:
+        manifest.close()
+    return sorted(os.path.basename(path) for path, size in new_entries), removed
+
+
+def scenarios(temp_folder):
+    db_path = os.path.join(temp_folder, 'journal.sqlite')
+    watch_folder = os.path.join(temp_folder, 'watch')
+    add_file(os.path.join(watch_folder, 'a', 'one.tif'))
+    add_file(os.path.join(watch_folder, 'two.tif'))
+
+    journal = JobJournal(db_path)
+    journal.open_run(watch_folder, os.path.join(temp_folder, 'output1'))
+    run1 = journal.run_id
+    journal.open_run(watch_folder, os.path.join(temp_folder, 'output2'))
+    run2 = journal.run_id
+    journal.close()
+
+    new, removed = scan(db_path, watch_folder, run1, full=True)
+    yield 'first scan finds everything', new == ['one.tif', 'two.tif']
+    new, removed = scan(db_path, watch_folder, run1)
+    yield 'unchanged tree finds nothing', new == [] and removed == []
+
+    # Switch to the second output folder. Its first scan is full, as there's no journal for it yet.
+    new, removed = scan(db_path, watch_folder, run2, full=True)
+    yield 'other run scans everything', new == ['one.tif', 'two.tif']
+    add_file(os.path.join(watch_folder, 'a', 'three.tif'))
+    add_file(os.path.join(watch_folder, 'four.tif'))
+    new, removed = scan(db_path, watch_folder, run2)
+    yield 'other run finds new files', new == ['four.tif', 'three.tif']
+
+    # Back to the first output folder: the files added while the second was in use are new to it.
+    new, removed = scan(db_path, watch_folder, run1)
+    yield 'switching back finds files added since', new == ['four.tif', 'three.tif']
+    new, removed = scan(db_path, watch_folder, run1)
+    yield 'and only once', new == []
+
+    os.remove(os.path.join(watch_folder, 'a', 'one.tif'))
+    new, removed = scan(db_path, watch_folder, run1)
+    yield 'removed files are reported', [os.path.basename(path) for path in removed] == ['one.tif']
+
+
+def main():
+    temp_folder = tempfile.mkdtemp()
+    failures = 0
+    try:
+        for name, passed in scenarios(temp_folder):
+            print '{0:<40s} {1:s}'.format(name, 'ok' if passed else 'FAILED')
+            failures += not passed
+    finally:
+        shutil.rmtree(temp_folder)
+    print '{0:d} failed'.format(failures) if failures else 'All passed'
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python2
+"""
+Stand-in for FineReader.exe so the AbbyyPool can be exercised without a licensed Windows machine. ui.engines.Simulator
+runs it with the settings below; it can also be run directly.
+
+It behaves the way ABBYY Automator expects FineReader 10 to:
+  - writes a {GUID}.loc file containing its PID into %TEMP%\FineReader10\Untitled.FR10*,
+  - starts up for FAKE_FINEREADER_STARTUP seconds, then "processes" each input file for FAKE_FINEREADER_PAGE seconds
+    (FAKE_FINEREADER_DELAY, the old setting, is the page time if that's not set), touching a file in its temp folder
+    as it goes so its I/O counters show progress,
+  - writes a tmp*.pdf into %TEMP%\FineReader10 and hands its path to the Acrobat-Proxy-Listener along with the job ID
+    from the environment, as the Acrobat proxy would,
+  - then waits for the next document: input paths, one per line, written to open.txt in its temp folder.
+
+Times are distributions: fixed:<s>, uniform:<low>:<high>, normal:<mean>:<sd>, lognormal:<median>:<sigma> or
+exponential:<mean>. A plain number is fixed.
+
+Each job can also go wrong, at the rates (0 to 1) in:
+  - FAKE_FINEREADER_ERROR_RATE: shows one of the |-separated FAKE_FINEREADER_ERRORS in dialog.txt in its temp folder,
+    as FineReader would in a dialog, and waits to be killed.
+  - FAKE_FINEREADER_HANG_RATE: stops making progress without finishing.
+  - FAKE_FINEREADER_CRASH_RATE: exits part way through.
+FAKE_FINEREADER_SEED makes a run repeatable.
+
+Usage (the same arguments ABBYY Automator passes to FineReader):
+    fake_finereader.py <input path> [<input path> ...] [/OptionsFile <profile>] /send Acrobat
+"""
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ui.proxy_protocol import JOB_ENVIRONMENT_KEY, deliver
+
+__author__ = 'Gary Hughes'
+
+# How often progress is shown and open.txt is looked for.
+TICK = 0.1
+
+
+def make_temp_folder(base_folder):
+    pid = os.getpid()
+    temp_folder = os.path.join(base_folder, 'Untitled.FR10{0:d}'.format(pid))
+    if not os.path.isdir(temp_folder):
+        os.makedirs(temp_folder)
+    loc_path = os.path.join(temp_folder, '{{{0:s}}}.loc'.format(str(uuid.uuid4()).upper()))
+    with open(loc_path, 'w') as loc_file:
+        loc_file.write('PID: {0:d}\n'.format(pid))
+    return temp_folder
+
+
+def sample(spec, rng):
+    """
+    Draw a time in seconds from a distribution like lognormal:2:0.5.
+    """
+    name, _, parameters = spec.partition(':')
+    try:
+        if not parameters:
+            return max(0.0, float(name))
+        values = [float(value) for value in parameters.split(':')]
+    except ValueError:
+        raise ValueError('Bad distribution: {0:s}'.format(spec))
+    if name == 'fixed':
+        value = values[0]
+    elif name == 'uniform':
+        value = rng.uniform(values[0], values[1])
+    elif name == 'normal':
+        value = rng.normalvariate(values[0], values[1])
+    elif name == 'lognormal':
+        value = rng.lognormvariate(math.log(values[0]), values[1])
+    elif name == 'exponential':
+        value = rng.expovariate(1.0 / values[0])
+    else:
+        raise ValueError('Unknown distribution: {0:s}'.format(name))
+    return max(0.0, value)
+
+
+def work(seconds, progress_file):
+    """
+    Take seconds, showing progress the whole time.
+    """
+    end = time.time() + seconds
+    while True:
+        remaining = end - time.time()
+        if remaining <= 0:
+            return
+        progress_file.write('.')
+        progress_file.flush()
+        time.sleep(min(TICK, remaining))
+
+
+def wait_forever():
+    while True:
+        time.sleep(60)
+
+
+def parse_arguments(arguments):
+    input_paths = []
+    for argument in arguments:
+        if argument.lower() in ('/optionsfile', '/send'):
+            break
+        input_paths.append(argument)
+    return input_paths
+
+
+def next_document(temp_folder):
+    """
+    Wait for ABBYY Automator to open the next document and return its input paths.
+    """
+    open_path = os.path.join(temp_folder, 'open.txt')
+    while True:
+        try:
+            with open(open_path) as open_file:
+                input_paths = [line for line in open_file.read().splitlines() if line]
+        except IOError:
+            time.sleep(TICK)
+            continue
+        os.remove(open_path)
+        return input_paths
+
+
+def run_job(input_paths, base_folder, temp_folder, progress_file, rng):
+    page_time = os.environ.get('FAKE_FINEREADER_PAGE') or os.environ.get('FAKE_FINEREADER_DELAY', '1')
+    duration = sum(sample(page_time, rng) for _ in input_paths)
+
+    error_rate = float(os.environ.get('FAKE_FINEREADER_ERROR_RATE', 0))
+    hang_rate = float(os.environ.get('FAKE_FINEREADER_HANG_RATE', 0))
+    crash_rate = float(os.environ.get('FAKE_FINEREADER_CRASH_RATE', 0))
+    roll = rng.random()
+    if roll < crash_rate:
+        work(duration * rng.random(), progress_file)
+        print 'Crashing'
+        os._exit(3)
+    elif roll < crash_rate + hang_rate:
+        work(duration * rng.random(), progress_file)
+        print 'Hanging'
+        wait_forever()
+    elif roll < crash_rate + hang_rate + error_rate:
+        work(duration * rng.random(), progress_file)
+        errors = [phrase for phrase in os.environ.get('FAKE_FINEREADER_ERRORS', 'Process failed').split('|') if phrase]
+        with open(os.path.join(temp_folder, 'dialog.txt'), 'w') as dialog_file:
+            dialog_file.write(rng.choice(errors))
+        print 'Showing an error'
+        wait_forever()
+
+    work(duration, progress_file)
+    handle, pdf_path = tempfile.mkstemp(prefix='tmp', suffix='.pdf', dir=base_folder)
+    os.close(handle)
+    if input_paths and os.path.isfile(input_paths[0]):
+        shutil.copyfile(input_paths[0], pdf_path)
+
+    deliver(os.environ.get(JOB_ENVIRONMENT_KEY, ''), pdf_path)
+
+
+def main(arguments):
+    input_paths = parse_arguments(arguments)
+    if not input_paths:
+        print 'No input file given'
+        return 1
+
+    seed = os.environ.get('FAKE_FINEREADER_SEED')
+    rng = random.Random(int(seed) if seed else None)
+
+    base_folder = os.path.join(tempfile.gettempdir(), 'FineReader10')
+    if not os.path.isdir(base_folder):
+        os.makedirs(base_folder)
+    temp_folder = make_temp_folder(base_folder)
+
+    with open(os.path.join(temp_folder, 'progress'), 'w') as progress_file:
+        work(sample(os.environ.get('FAKE_FINEREADER_STARTUP', '0'), rng), progress_file)
+        # FineReader stays open after sending to Acrobat until ABBYY Automator kills it or opens the next document.
+        while True:
+            run_job(input_paths, base_folder, temp_folder, progress_file, rng)
+            input_paths = next_document(temp_folder)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,63 @@
+#!/usr/bin/env python2
+"""
+Lists or releases the files ABBYY Automator has quarantined after they failed every retry. Quarantined files are kept
+in the job journal and skipped by every scan until they're released; a released file is queued again, with its
+attempts reset, the next time processing starts on its watch folder.
+
+Usage:
+    quarantine.py [--journal journal.sqlite] list
+    quarantine.py [--journal journal.sqlite] reset [<path> ...]
+
+reset with no paths releases every quarantined file.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ui.job_journal import JobJournal
+
+__author__ = 'Gary Hughes'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='List or release quarantined files.')
+    parser.add_argument('--journal', default='journal.sqlite', help='Job journal (default: %(default)s).')
+    parser.add_argument('command', choices=('list', 'reset'))
+    parser.add_argument('paths', nargs='*', help='Files to release (default: all of them).')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.journal):
+        parser.error('No journal at {0:s}'.format(args.journal))
+    journal = JobJournal(args.journal)
+    paths = [os.path.abspath(path) for path in args.paths] or None
+    total = 0
+    try:
+        for run_id, watch_folder, output_folder in journal.runs():
+            journal.open_run(watch_folder, output_folder)
+            if args.command == 'list':
+                jobs = journal.quarantined()
+                if jobs:
+                    print '{0:s} -> {1:s}'.format(watch_folder, output_folder)
+                for path, attempts, error in jobs:
+                    print '  {0:s} ({1:d} attempts): {2:s}'.format(path, attempts, error or '')
+                total += len(jobs)
+            else:
+                run_paths = None
+                if paths:
+                    # Journal paths are as the scanner found them, so compare them normalised.
+                    wanted = set(os.path.normcase(path) for path in paths)
+                    run_paths = [path for path, attempts, error in journal.quarantined()
+                                 if os.path.normcase(os.path.abspath(path)) in wanted]
+                for path, size in journal.release_quarantine(run_paths):
+                    print 'Released', path
+                    total += 1
+    finally:
+        journal.close()
+    print '{0:d} file{1:s} {2:s}'.format(total, '' if total == 1 else 's',
+                                         'quarantined' if args.command == 'list' else 'released')
+
+
+if __name__ == '__main__':
+    main()